@@ -0,0 +1,4 @@
+import sys
+from BotB_functions.fn_cli import main
+
+sys.exit(main())
@@ -0,0 +1,324 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.pyplot import figure
+import pandas as pd
+import pickle
+from pint import UnitRegistry
+import os
+from dotmap import DotMap
+import sys
+from BotB_functions.fn_profile import profiled, profiling_enabled, count
+from BotB_functions.fn_cellformat import *
+from BotB_functions.fn_24M import *
+from BotB_functions.fn_ocv import window_voltage
+
+
+# FLOAT KERNEL OF THE CELL BUILDERS
+# Same maths as make_cell (make_cylindrical, make_pouch, make_24Mpouch, ...) but on plain floats or
+# numpy arrays (broadcast against each other), without pint units or uncertainties. The geometry
+# comes from the same format plugins (CELL_FORMATS in fn_cellformat).
+# Every input and output is expressed in the fixed units below.
+KERNEL_UNITS = {
+    #electrodes (pos_ and neg_ prefixes)
+    "speccap": 'mA*hr/g',
+    "actdens": 'g/cm**3',
+    "avgE": 'V',
+    "ocv": 'V', #optional OCV curve, a (2, n) [soc; voltage] array rather than a number
+    "activefrac": 'dimensionless',
+    "inactivefrac": 'dimensionless', #optional: non-active phases (binder, carbon) lumped together
+    "inactivedens": 'g/cm**3',
+    "lithium": 'dimensionless', #1 for a lithium metal negative (make_lithium)
+    "porosity": 'dimensionless',
+    "arealcap": 'mA*hr/cm**2',
+    "arealload": 'g/cm**2', #optional: with _thick/_density completed to arealcap and porosity (fn_pipeline)
+    "ccthick": 'cm',
+    "ccdens": 'g/cm**3',
+    #separator (sep_ prefix) and electrolyte (elyte_ prefix)
+    "thick": 'cm',
+    "density": 'g/cm**3',
+    "solid": 'dimensionless', #1 for a solid electrolyte separator (make_solidseparator)
+    "conductivity": 'mS/cm',
+    #cell
+    "ecapratio": 'mL/(A*hr)',
+    "elyteexcess": 'dimensionless',
+    "porefill": 'dimensionless', #1 fills the pore volume (elytefill='porevolume'), 0 fills ecapratio*capacity
+    "llifactor": 'dimensionless',
+    "extramass": 'g',
+    "diameter": 'cm',
+    "height": 'cm',
+    "width": 'cm',
+    "nlayers": 'dimensionless',
+    "canthick": 'cm',
+    "candens": 'g/cm**3',
+    "mandreldiam": 'cm',
+    "headspace": 'cm',
+    "pouchthick": 'cm',
+    "pouchdens": 'g/cm**3',
+    "pouchclearance": 'cm',
+    "tabh": 'cm',
+    "tabw": 'cm',
+    "tabt": 'cm',
+    "tabdenspos": 'g/cm**3',
+    "tabdensneg": 'g/cm**3',
+    #results
+    "jlarea": 'cm**2',
+    "capacity": 'A*hr',
+    "elytevolume": 'mL',
+    "energy": 'W*hr',
+    "volume": 'cm**3',
+    "stackthick": 'cm',
+    "depth": 'cm',
+    "NPratio": 'dimensionless',
+    "mass": 'g',
+    "gravimetric_energy": 'W*hr/kg',
+    "volumetric_energy": 'W*hr/L',
+}
+
+def get_nominal(value):
+    try:
+        nominal = value.n
+    except AttributeError:
+        try:
+            nominal = value.magnitude
+        except AttributeError:
+            nominal = value
+    return nominal
+
+
+#Units of a kernel input/output key, e.g. 'pos_arealcap' -> 'mA*hr/cm**2'
+def kernel_unit(key):
+    if key in KERNEL_UNITS:
+        return KERNEL_UNITS[key]
+    if key.startswith('mass_'):
+        return KERNEL_UNITS['mass']
+    for geometry in CELL_FORMATS.values():
+        if key in geometry['units']:
+            return geometry['units'][key]
+    return KERNEL_UNITS[key.split('_',1)[1]]
+
+
+#Nominal value of a pint quantity (or plain number) in kernel units
+def to_kernel(value, key, unit):
+    try:
+        value = value.to(unit(kernel_unit(key)))
+    except AttributeError: #plain number, already dimensionless
+        return float(value)
+    return float(get_nominal(value))
+
+
+# EXTRACT KERNEL INPUTS FROM A BUILT CELL
+#Non-active phases of a composite lumped into one with the same mass fraction and specific volume
+def phase_inputs(composite, prefix, unit):
+    if len(composite.phases) == 0:
+        return {}
+    inactivefrac = sum([to_kernel(phase.massfrac, prefix+'_inactivefrac', unit) for phase in composite.phases])
+    specvol = sum([to_kernel(phase.massfrac, prefix+'_inactivefrac', unit)/to_kernel(phase.density, prefix+'_inactivedens', unit)
+                   for phase in composite.phases])
+    return {prefix+'_inactivefrac': inactivefrac, prefix+'_inactivedens': inactivefrac/specvol}
+
+
+def composite_inputs(electrode, prefix, unit):
+    composite = electrode.composite
+    inputs = {
+        prefix+'_speccap': to_kernel(composite.active.speccap, prefix+'_speccap', unit),
+        prefix+'_actdens': to_kernel(composite.active.density, prefix+'_actdens', unit),
+        prefix+'_avgE': to_kernel(composite.active.avgE, prefix+'_avgE', unit),
+        prefix+'_activefrac': to_kernel(composite.activefrac, prefix+'_activefrac', unit),
+        prefix+'_porosity': to_kernel(composite.porosity, prefix+'_porosity', unit),
+        prefix+'_arealcap': to_kernel(composite.arealcap, prefix+'_arealcap', unit),
+        prefix+'_ccthick': to_kernel(electrode.currentcollector.thick, prefix+'_ccthick', unit),
+        prefix+'_ccdens': to_kernel(electrode.currentcollector.density, prefix+'_ccdens', unit),
+    }
+    inputs.update(phase_inputs(composite, prefix, unit))
+    if composite.get('type') == 'lithium':
+        inputs[prefix+'_lithium'] = 1.0
+    if 'ocv' in composite.active:
+        inputs[prefix+'_ocv'] = composite.active.ocv
+    return inputs
+
+
+def cellstack_inputs(cellstack, unit):
+    inputs = {}
+    inputs.update(composite_inputs(cellstack.positive, 'pos', unit))
+    inputs.update(composite_inputs(cellstack.negative, 'neg', unit))
+    inputs['sep_thick'] = to_kernel(cellstack.separator.thick, 'sep_thick', unit)
+    inputs['sep_density'] = to_kernel(cellstack.separator.density, 'sep_density', unit)
+    inputs['sep_porosity'] = to_kernel(cellstack.separator.porosity, 'sep_porosity', unit)
+    if cellstack.separator.get('type') == 'solid':
+        inputs['sep_solid'] = 1.0
+        inputs['sep_conductivity'] = to_kernel(cellstack.separator.conductivity, 'sep_conductivity', unit)
+    inputs['elyte_density'] = to_kernel(cellstack.electrolyte.density, 'elyte_density', unit)
+    return inputs
+
+
+def cell_inputs(cell):
+    unit = cell.unit
+    inputs = cellstack_inputs(cell.cellstack, unit)
+    for key in cellformat_keys(cell.format):
+        inputs[key] = to_kernel(cell[key], key, unit)
+    inputs['porefill'] = 1.0 if cell.elytefill == 'porevolume' else 0.0
+    return inputs
+
+
+# KERNEL
+#Skeletal density of the coating solids, the unassigned mass fraction at the active density (as skeletal_density)
+def batch_skeletal(p, prefix):
+    if prefix+'_inactivefrac' not in p:
+        return p[prefix+'_actdens']
+    inactivefrac = p[prefix+'_inactivefrac']
+    return 1/((1-inactivefrac)/p[prefix+'_actdens'] + inactivefrac/p[prefix+'_inactivedens'])
+
+
+#Composite thickness and density at fixed areal capacity and porosity (same relations as complete_composite)
+def batch_composite(p, prefix):
+    density = batch_skeletal(p, prefix)*p[prefix+'_activefrac']*(1-p[prefix+'_porosity'])
+    thick = p[prefix+'_arealcap']/p[prefix+'_speccap']/density
+    return thick, density
+
+
+#Lithium metal negative: areal capacity it can take (as hosting_arealcap) and growth at full charge
+def batch_hostcap(p):
+    if 'neg_lithium' not in p:
+        return p['neg_arealcap']
+    return np.where(p['neg_lithium'] >= 0.5, p['pos_arealcap']+p['neg_arealcap'], p['neg_arealcap'])
+
+
+def batch_growth(p):
+    if 'neg_lithium' not in p:
+        return 0
+    return np.where(p['neg_lithium'] >= 0.5, p['pos_arealcap']/p['neg_speccap']/p['neg_actdens'], 0)
+
+
+#Average cell voltage (as cell_voltage): integrated over the N/P balanced window when p has OCV curves
+def batch_avgE(p):
+    if 'pos_ocv' not in p and 'neg_ocv' not in p:
+        return p['pos_avgE']-p['neg_avgE']
+    return window_voltage(p.get('pos_ocv'), p.get('neg_ocv'), p['pos_avgE'], p['neg_avgE'],
+                          p['pos_arealcap'], batch_hostcap(p), p['llifactor'])
+
+
+#Numeric kernel inputs (everything but the OCV curves)
+def numeric_keys(p):
+    return [key for key in p if not key.endswith('_ocv')]
+
+
+#Density of the whole coating for the electrode mass (as coating_density): only the active mass without phases
+def batch_coatdens(p, prefix, density):
+    if prefix+'_inactivefrac' not in p:
+        return density
+    return batch_skeletal(p, prefix)*(1-p[prefix+'_porosity'])
+
+
+#Electrolyte filled pore volume of the electrodes and separators (as stack_porevolume)
+def batch_porevolume(p, area, ncoat, posthick, negthick):
+    return area*ncoat*(posthick*p['pos_porosity'] + negthick*p['neg_porosity'] + p['sep_thick']*p['sep_porosity'])
+
+
+#Electrolyte volume: ecapratio*capacity, or the pore volume plus elyteexcess where porefill is set
+def batch_elytevolume(p, capacity, porevolume):
+    porefill = p.get('porefill', 0)
+    if np.ndim(porefill) == 0: #one fill mode for the whole batch
+        if porefill < 0.5:
+            return p['ecapratio']*capacity
+        return porevolume*(1+p.get('elyteexcess', 0))
+    fill = porevolume*(1+p.get('elyteexcess', 0))
+    return np.where(porefill >= 0.5, fill, p.get('ecapratio', np.nan)*capacity)
+
+
+#Capacity, energy and component masses shared by every cell format
+def batch_cellchain(p, area, ncoat, posthick, posdens, negthick, negdens):
+    capacity = np.minimum(p['pos_arealcap'],batch_hostcap(p))*p['llifactor']*ncoat*area/1000 #mAh -> Ah
+    avgE = batch_avgE(p)
+    energy = capacity*avgE
+    elytevolume = batch_elytevolume(p, capacity, batch_porevolume(p, area, ncoat, posthick, negthick))
+    elytemass = elytevolume*p['elyte_density']
+    posmass = area*(ncoat*posthick*posdens)
+    posccmass = area*(p['pos_ccthick']*p['pos_ccdens'])
+    negmass = area*(ncoat*negthick*negdens)
+    negccmass = area*(p['neg_ccthick']*p['neg_ccdens'])
+    sepmass = area*(ncoat*p['sep_thick']*p['sep_density'])
+    jellymass = posmass + posccmass + negmass + negccmass + sepmass + elytemass
+    out = {
+        "jlarea": area,
+        "capacity": capacity,
+        "energy": energy,
+        "NPratio": p['neg_arealcap']/p['pos_arealcap'],
+        "avgE": avgE,
+        "elytevolume": elytevolume,
+        "mass_jellyroll": jellymass,
+        "mass_electrolyte": elytemass,
+        "mass_positive": posmass,
+        "mass_positivecc": posccmass,
+        "mass_negative": negmass,
+        "mass_negativecc": negccmass,
+        "mass_separator": sepmass,
+    }
+    return out
+
+
+def batch_stackthick(p, ncoat, posthick, negthick):
+    stackthick = ncoat*posthick + p['pos_ccthick'] + ncoat*negthick + p['neg_ccthick'] + ncoat*p['sep_thick']
+    return stackthick
+
+
+def batch_energydensity(out):
+    out['gravimetric_energy'] = 1000*out['energy']/out['mass_total'] #Wh/g -> Wh/kg
+    out['volumetric_energy'] = 1000*out['energy']/out['volume'] #Wh/cm3 -> Wh/L
+    return out
+
+
+#Evaluate a cell format on a dict of kernel inputs (floats or broadcastable arrays)
+@profiled
+def batch_cell(format, p):
+    if format not in CELL_FORMATS:
+        raise ValueError('Unknown cell format: ' + str(format))
+    if profiling_enabled(): #designs per call, to read the stage times as throughput
+        count('kernel cells ' + format, max([np.size(p[key]) for key in numeric_keys(p)]))
+    geometry = CELL_FORMATS[format]
+    ncoat = geometry['ncoat']
+    posthick, posdens = batch_composite(p, 'pos')
+    negthick, negdens = batch_composite(p, 'neg')
+    stackthick = batch_stackthick(p, ncoat, posthick, negthick+batch_growth(p)) #at full charge
+    area = geometry['area'](p, stackthick)
+
+    poscoat = batch_coatdens(p, 'pos', posdens)
+    negcoat = batch_coatdens(p, 'neg', negdens)
+    out = batch_cellchain(p, area, ncoat, posthick, poscoat, negthick, negcoat)
+    casemass = geometry['case'](p) + p['extramass']
+    out['mass_case'] = casemass
+    out['mass_total'] = casemass + out['mass_jellyroll']
+    out['volume'] = geometry['volume'](p, stackthick)
+    out['stackthick'] = stackthick
+    if geometry['extras'] is not None:
+        out.update(geometry['extras'](p, stackthick))
+    return batch_energydensity(out)
+
+
+#Expand a dict of scalar kernel inputs into arrays of length n
+def batch_inputs(p, n):
+    inputs = {key: np.full(n, p[key], dtype=float) for key in numeric_keys(p)}
+    inputs.update({key: p[key] for key in p if key not in inputs}) #curves are shared by all rows
+    return inputs
+
+
+#Kernel inputs with a solid electrolyte separator: thickness (cm), dense density (g/cm3), liquid catholyte
+#volume fraction and conductivity (mS/cm), all broadcastable (as make_solidseparator)
+def solidseparator_inputs(p, thick, density, catholyte=0, conductivity=1.0):
+    inputs = dict(p)
+    inputs['sep_thick'] = thick
+    inputs['sep_porosity'] = catholyte
+    inputs['sep_density'] = density*(1-np.asarray(catholyte))
+    inputs['sep_solid'] = 1.0
+    inputs['sep_conductivity'] = conductivity
+    return inputs
+
+
+#Energy densities of a format over a grid of solid electrolyte thicknesses and densities
+def solidseparator_sweep(format, p, thick, density, catholyte=0, conductivity=1.0):
+    thick, density = np.meshgrid(np.atleast_1d(thick), np.atleast_1d(density), indexing='ij')
+    out = batch_cell(format, solidseparator_inputs(p, thick.ravel(), density.ravel(), catholyte, conductivity))
+    sweep = pd.DataFrame({'sep_thick': thick.ravel(), 'sep_density': density.ravel()})
+    for key in ['capacity', 'energy', 'mass_total', 'mass_separator', 'mass_electrolyte', 'volume',
+                'gravimetric_energy', 'volumetric_energy']:
+        sweep[key] = np.broadcast_to(out[key], thick.size)
+    return sweep
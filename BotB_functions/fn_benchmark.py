@@ -0,0 +1,256 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.pyplot import figure
+import pandas as pd
+import pickle
+from pint import UnitRegistry
+import os
+from dotmap import DotMap
+import sys
+
+from BotB_functions.fn_theoreticalcap import *
+from BotB_functions.fn_cellstack import *
+from BotB_functions.fn_cellformat import *
+from BotB_functions.fn_24M import *
+from BotB_functions.fn_cellanalysis import *
+from BotB_functions.fn_batch import *
+
+
+# BENCHMARKS OF THE CALCULATION CORE
+# The cases are run by pytest-benchmark (benchmarks/test_core.py):
+#   python -m pytest benchmarks --benchmark-autosave --benchmark-compare --benchmark-compare-fail=median:20%
+# or without it by timeit:  python -m BotB_functions.fn_benchmark [results_dir]  (default .benchmarks/botb)
+# Every run is saved and compared against the previous one, so a slowdown in any hot path shows up
+# before upgrading.
+
+#NMC811 | graphite stack from the BotB notebooks
+def reference_cellstack(unit):
+    NMC = make_active(name='NMC811',
+                      speccap=195*unit.mA*unit.hr/unit.g,
+                      avgE=3.86*unit.V,
+                      density=4.7*unit.g/unit.cm**3,
+                      unit=unit)
+    Gr = make_active(name='Graphite',
+                     speccap=344*unit.mA*unit.hr/unit.g,
+                     avgE=0.17*unit.V,
+                     density=2.24*unit.g/unit.cm**3,
+                     unit=unit)
+    pos_composite = make_composite(active=NMC,
+                                   arealcap=(4.5*unit.mA*unit.hr/unit.cm**2).plus_minus(0.1),
+                                   activefrac=(0.95*unit.dimensionless).plus_minus(0.02),
+                                   density=(3.4*unit.g/unit.cm**3).plus_minus(0.1),
+                                   unit=unit)
+    neg_composite = make_composite(active=Gr,
+                                   arealcap=pos_composite.arealcap*1.1, #NP RATIO
+                                   activefrac=(0.95*unit.dimensionless).plus_minus(0.01),
+                                   density=(1.6*unit.g/unit.cm**3).plus_minus(0.1),
+                                   unit=unit)
+    cc_Al = make_currentcollector(name='Al', thick=16*unit.um, unit=unit)
+    cc_Cu = make_currentcollector(name='Cu', thick=12*unit.um, unit=unit)
+    electrolyte = make_electrolyte(name="LiPF6:EC:EMC 3:7",
+                                   concentration=(1.1*unit.mol/unit.L).plus_minus(0.05),
+                                   unit=unit)
+    celgard = make_separator(name="PP:PE", porosity=0.44, thick=12*unit.um,
+                             density=0.9*unit.g/unit.cm**3, unit=unit)
+    pos_electrode = make_electrode(composite=pos_composite, currentcollector=cc_Al, unit=unit)
+    neg_electrode = make_electrode(composite=neg_composite, currentcollector=cc_Cu, unit=unit)
+    cellstack = make_cellstack(positive=pos_electrode,
+                               negative=neg_electrode,
+                               separator=celgard,
+                               electrolyte=electrolyte,
+                               unit=unit)
+    return cellstack
+
+
+def reference_cylindrical(cellstack, unit):
+    return dict(name='21700 cell',
+                cellstack=cellstack,
+                ecapratio=(1.6*unit.mL/(unit.A*unit.hr)),
+                diameter=2.1*unit.cm,
+                height=7.0*unit.cm,
+                canthick=0.165*unit.mm,
+                candens=(7.9*unit.g/unit.cm**3).plus_minus(0.2),
+                mandreldiam=2.5*unit.mm,
+                headspace=0.6*unit.cm,
+                llifactor=0.95,
+                extramass=(4*unit.g).plus_minus(2),
+                unit=unit)
+
+
+def reference_pouch(cellstack, unit):
+    return dict(name='Pouch cell',
+                cellstack=cellstack,
+                ecapratio=(1.6*unit.mL/(unit.A*unit.hr)),
+                height=22*unit.cm,
+                width=16*unit.cm,
+                nlayers=20,
+                pouchthick=1*unit.mm,
+                pouchdens=1.8*unit.g/unit.cm**3,
+                pouchclearance=0.5*unit.cm,
+                tabh=2*unit.cm,
+                tabw=4*unit.cm,
+                tabt=0.05*unit.cm,
+                tabdenspos=2.7*unit.g/unit.cm**3,
+                tabdensneg=8.9*unit.g/unit.cm**3,
+                tabloc='top',
+                llifactor=0.95,
+                extramass=(10*unit.g).plus_minus(10),
+                unit=unit)
+
+
+#Best and median time per call (s) of fn(), repeating until each sample takes ~mintime
+def time_call(fn, repeat=5, mintime=0.05):
+    import timeit
+    timer = timeit.Timer(fn)
+    number = 1
+    while True:
+        t = timer.timeit(number)
+        if t >= mintime or number >= 10**6:
+            break
+        number *= 10
+    times = [t/number] + [timer.timeit(number)/number for i in range(repeat-1)]
+    return min(times), float(np.median(times)), number
+
+
+def benchmark_cases(unit, nbatch=10**4):
+    import itertools
+    import matplotlib
+    matplotlib.use('Agg')
+
+    cellstack = reference_cellstack(unit)
+    cylkwargs = reference_cylindrical(cellstack, unit)
+    pouchkwargs = reference_pouch(cellstack, unit)
+    cylcell = make_cylindrical(**cylkwargs)
+    pouchcell = make_pouch(**pouchkwargs)
+    cases = {}
+
+    cases['molmass'] = lambda: molmass('LiNi0.8Mn0.1Co0.1O2')
+    cases['theorycap'] = lambda: theorycap('LiNi0.8Mn0.1Co0.1O2', 1)
+
+    #make_composite for every combination of given composite properties that can be completed,
+    #with the active fraction given and with it left to the binder and carbon phases
+    composite = cellstack.positive.composite
+    given = {key: composite[key] for key in ['arealcap','thick','arealload','porosity','density']}
+    phases = [make_phase(name='PVDF', massfrac=0.03, density=1.78*unit.g/unit.cm**3, unit=unit),
+              make_phase(name='Carbon black', massfrac=0.02, density=1.9*unit.g/unit.cm**3, unit=unit)]
+    for r in range(2, len(given)+1):
+        for combo in itertools.combinations(given, r):
+            for mix, extra in [('', dict(activefrac=composite.activefrac)), ('+phases', dict(phases=phases))]:
+                kwargs = dict(extra, **{key: given[key] for key in combo})
+                try:
+                    make_composite(active=composite.active, unit=unit, **kwargs)
+                except (ValueError, IndexError): #underdetermined or, with phases, inconsistent combination
+                    continue
+                cases['make_composite[' + '+'.join(combo) + mix + ']'] = \
+                    lambda kwargs=kwargs: make_composite(active=composite.active, unit=unit, **kwargs)
+
+    cases['make_electrolyte'] = lambda: make_electrolyte(name="LiPF6:EC:EMC 3:7",
+                                                         concentration=(1.1*unit.mol/unit.L).plus_minus(0.05),
+                                                         unit=unit)
+    cases['make_cylindrical'] = lambda: make_cylindrical(**cylkwargs)
+    cases['make_pouch'] = lambda: make_pouch(**pouchkwargs)
+    cases['make_24Mpouch'] = lambda: make_24Mpouch(**dict(pouchkwargs, nlayers=1))
+    cases['gravimetric_energy'] = lambda: gravimetric_energy(cylcell)
+    cases['volumetric_energy'] = lambda: volumetric_energy(cylcell)
+
+    def plotted(plot, cell):
+        plot(cell)
+        plt.close('all')
+    cases['plot_thickbreakdown'] = lambda: plotted(plot_thickbreakdown, cylcell)
+    cases['plot_massbreakdown'] = lambda: plotted(plot_massbreakdown, cylcell)
+    cases['plot_2D_cylindrical'] = lambda: plotted(plot_2D_cylindrical, cylcell)
+    cases['plot_3D_cylindrical'] = lambda: plotted(plot_3D_cylindrical, cylcell)
+    cases['plot_3D_pouch'] = lambda: plotted(plot_3D_pouch, pouchcell)
+
+    #Throughput of the float kernel over nbatch cells
+    for format, cell in [('cylindrical', cylcell), ('pouch stacked', pouchcell)]:
+        batch = batch_inputs(cell_inputs(cell), nbatch)
+        key = 'diameter' if format == 'cylindrical' else 'width'
+        batch[key] = batch[key]*np.linspace(0.5, 2, nbatch)
+        cases['batch_cell[' + format + ']x' + str(nbatch)] = lambda format=format, batch=batch: batch_cell(format, batch)
+
+    #Throughput of the pint builders over the same nbatch designs, one cell at a time
+    scales = np.linspace(0.5, 2, nbatch)
+    def built(builder, kwargs, key):
+        for scale in scales:
+            builder(**dict(kwargs, **{key: kwargs[key]*scale}))
+    cases['make_cylindrical[diameter]x' + str(nbatch)] = lambda: built(make_cylindrical, cylkwargs, 'diameter')
+    cases['make_pouch[width]x' + str(nbatch)] = lambda: built(make_pouch, pouchkwargs, 'width')
+    return cases
+
+
+#Cells evaluated by one call of a case: nbatch for the throughput cases ('...]x10000'), else 1
+def case_cells(name):
+    return int(name.rsplit(']x', 1)[1]) if ']x' in name else 1
+
+
+def run_benchmarks(unit=None, nbatch=10**4, repeat=5, select=None):
+    if unit is None:
+        unit = UnitRegistry()
+    cases = benchmark_cases(unit, nbatch=nbatch)
+    rows = []
+    for name, fn in cases.items():
+        if select is not None and select not in name:
+            continue
+        ncells = case_cells(name)
+        best, median, number = time_call(fn, repeat=repeat if name.startswith('batch_cell') or ncells == 1
+                                         else min(repeat, 3)) #cell by cell builds take seconds
+        rows.append({'case': name, 'best': best, 'median': median, 'number': number,
+                     'throughput': ncells/best})
+    results = pd.DataFrame(rows).set_index('case')
+    return results
+
+
+def save_benchmarks(results, path=os.path.join('.benchmarks', 'botb')):
+    import json
+    import time
+    import platform
+    import pint
+    os.makedirs(path, exist_ok=True)
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    record = {
+        'time': stamp,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'numpy': np.__version__,
+        'pint': pint.__version__,
+        'results': results.to_dict(orient='index'),
+    }
+    filename = os.path.join(path, 'bench-' + stamp + '.json')
+    with open(filename, 'w') as f:
+        json.dump(record, f, indent=1)
+    return filename
+
+
+def load_benchmarks(filename):
+    import json
+    with open(filename) as f:
+        record = json.load(f)
+    return pd.DataFrame.from_dict(record['results'], orient='index')
+
+
+#Ratio of median times new/old; cases slower by more than tolerance are flagged
+def compare_benchmarks(old, new, tolerance=0.2):
+    both = old.index.intersection(new.index)
+    comparison = pd.DataFrame(index=both)
+    comparison['old'] = old.loc[both, 'median']
+    comparison['new'] = new.loc[both, 'median']
+    comparison['ratio'] = comparison['new']/comparison['old']
+    comparison['regression'] = comparison['ratio'] > 1+tolerance
+    return comparison
+
+
+if __name__ == '__main__':
+    import glob
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join('.benchmarks', 'botb')
+    previous = sorted(glob.glob(os.path.join(path, 'bench-*.json')))
+    results = run_benchmarks()
+    print(results.to_string())
+    print('saved to ' + save_benchmarks(results, path))
+    if previous:
+        comparison = compare_benchmarks(load_benchmarks(previous[-1]), results)
+        print(comparison.to_string())
+        if comparison['regression'].any():
+            print('Regressions against ' + previous[-1] + ':')
+            print(comparison[comparison['regression']].to_string())
+            sys.exit(1)
@@ -0,0 +1,142 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.pyplot import figure
+import pandas as pd
+import pickle
+from pint import UnitRegistry
+import os
+from dotmap import DotMap
+import sys
+
+from BotB_functions.fn_cellstack import *
+from BotB_functions.fn_batch import *
+
+
+# CALENDERING: POROSITY VS PRESSURE
+# Empirical compaction curves giving the coating porosity after calendering at a pressure (MPa).
+# Each curve is a numpy function of the pressure array and its parameters, so a whole set of press
+# settings is evaluated at once. Add new curves with register_calendering.
+CALENDERING_CURVES = {}
+CALENDERING_UNITS = {
+    "pressure": 'MPa',
+}
+
+
+def register_calendering(name, curve, defaults):
+    CALENDERING_CURVES[name] = {
+        "curve": curve,
+        "defaults": defaults,
+    }
+
+
+#Exponential approach to a limiting porosity: eps = eps_inf + (eps0-eps_inf)*exp(-k*P)
+def exponential_porosity(pressure, eps0, epsinf, k):
+    return epsinf + (eps0-epsinf)*np.exp(-k*pressure)
+
+register_calendering('exponential', exponential_porosity,
+                     {"eps0": 0.50, #as-coated porosity
+                      "epsinf": 0.18, #porosity the coating tends to at high pressure
+                      "k": 0.012}) #1/MPa
+
+
+#Heckel: ln(1/eps) = k*P + ln(1/eps0)
+def heckel_porosity(pressure, eps0, k):
+    return eps0*np.exp(-k*pressure)
+
+register_calendering('heckel', heckel_porosity,
+                     {"eps0": 0.50,
+                      "k": 0.004}) #1/MPa
+
+
+#Kawakita: volume reduction C = a*b*P/(1+b*P), solid volume conserved
+def kawakita_porosity(pressure, eps0, a, b):
+    compaction = a*b*pressure/(1+b*pressure)
+    return 1-(1-eps0)/(1-compaction)
+
+register_calendering('kawakita', kawakita_porosity,
+                     {"eps0": 0.50,
+                      "a": 0.38, #maximum volume reduction, keeps the porosity above ~0.19
+                      "b": 0.02}) #1/MPa
+
+
+#Porosity after calendering, pressure in MPa (float or array)
+def calender_porosity(pressure, curve='exponential', **params):
+    if curve not in CALENDERING_CURVES:
+        raise ValueError('Unknown calendering curve: ' + str(curve))
+    model = CALENDERING_CURVES[curve]
+    args = dict(model['defaults'])
+    for key, value in params.items():
+        if key not in args:
+            raise ValueError('Unknown ' + curve + ' calendering parameter: ' + str(key))
+        args[key] = value
+    porosity = model['curve'](np.asarray(pressure, dtype=float), **args)
+    return np.clip(porosity, 0, 1)
+
+
+def pressure_magnitude(pressure, unit=None):
+    try:
+        pressure = pressure.to(unit(CALENDERING_UNITS['pressure']))
+    except AttributeError: #plain numbers are taken as MPa
+        return np.asarray(pressure, dtype=float)
+    return np.asarray(get_nominal(pressure), dtype=float)
+
+
+# CALENDERED COMPOSITE
+#Same arguments as make_composite, with pressure (pint quantity) and curve instead of porosity.
+#Curve parameters are passed as calendering={'eps0': 0.45, ...}
+def make_calendered_composite(**kwargs):
+    calendered = {
+        "pressure": 'missing',
+        "curve": 'exponential',
+        "calendering": {},
+    }
+    for key in list(calendered):
+        if key in kwargs:
+            calendered[key] = kwargs.pop(key)
+    if calendered['pressure'] == 'missing':
+        raise ValueError('Unspecified calendering properties.')
+    if 'porosity' in kwargs:
+        raise ValueError('Conflicting defined electrode composite properties.')
+    unit = kwargs['unit']
+
+    pressure = pressure_magnitude(calendered['pressure'], unit)
+    porosity = calender_porosity(pressure, calendered['curve'], **calendered['calendering'])
+    kwargs['porosity'] = float(porosity)*unit.dimensionless
+    composite = make_composite(**kwargs)
+    composite.pressure = float(pressure)*unit(CALENDERING_UNITS['pressure'])
+    composite.curve = calendered['curve']
+    return composite
+
+
+# COMPOSITE FAMILIES IN ONE BATCH
+#Kernel inputs with the prefix ('pos' or 'neg') porosity set from an array of pressures (MPa)
+def calender_inputs(p, prefix, pressure, curve='exponential', **params):
+    inputs = dict(p)
+    inputs[prefix+'_porosity'] = calender_porosity(pressure, curve, **params)
+    return inputs
+
+
+#Thickness, density, porosity and loading of one composite over many press settings (kernel units)
+def calender_family(p, prefix, pressure, curve='exponential', **params):
+    inputs = calender_inputs(p, prefix, pressure, curve, **params)
+    thick, density = batch_composite(inputs, prefix)
+    family = pd.DataFrame({
+        "pressure": np.broadcast_to(pressure, np.shape(thick)),
+        "porosity": np.broadcast_to(inputs[prefix+'_porosity'], np.shape(thick)),
+        "density": density,
+        "thick": thick,
+        "arealload": thick*density,
+    })
+    return family
+
+
+#Composite family from a built composite, e.g. calender_composite(cellstack.positive.composite, np.linspace(0,300,61))
+def calender_composite(composite, pressure, unit, curve='exponential', **params):
+    p = {
+        'c_speccap': to_kernel(composite.active.speccap, 'pos_speccap', unit),
+        'c_actdens': to_kernel(composite.active.density, 'pos_actdens', unit),
+        'c_activefrac': to_kernel(composite.activefrac, 'pos_activefrac', unit),
+        'c_arealcap': to_kernel(composite.arealcap, 'pos_arealcap', unit),
+    }
+    p.update(phase_inputs(composite, 'c', unit))
+    return calender_family(p, 'c', pressure_magnitude(pressure, unit), curve, **params)
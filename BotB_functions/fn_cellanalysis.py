@@ -12,7 +12,20 @@ def volumetric_energy(cell):
 
 #print
 def print_cellresults(cell):
+    from BotB_functions.fn_cellbatch import CellBatch
     print('\033[1m' + str(cell.name) + '\033[0m' + '   (' + str(cell.format) + ')')
+    if isinstance(cell, CellBatch): #structure of arrays: one line per result, arrays summarized by numpy
+        print(str(len(cell)) + ' cells')
+        print('============================================================')
+        print('grav. energy dens.:' + str(gravimetric_energy(cell)))
+        print('vol energy dens.:' + str(volumetric_energy(cell)))
+        print('------------------------------------------------------------')
+        print('Avg. cell voltage: '   + str(cell.avgE))
+        print('cell energy: '   + str(cell.energy))
+        print('cell capacity: '   + str(cell.capacity))
+        print('cell mass: ' + str(cell.mass.total))
+        print('np ratio: ' + str(cell['NPratio']))
+        return
     poscc = str(cell.cellstack.positive.currentcollector.name)
     pos = str(cell.cellstack.positive.composite.active.name)
     sep = str(cell.cellstack.separator.name)
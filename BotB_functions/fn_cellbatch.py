@@ -0,0 +1,136 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.pyplot import figure
+import pandas as pd
+import pickle
+from pint import UnitRegistry
+import os
+from dotmap import DotMap
+import sys
+import functools
+
+from BotB_functions.fn_batch import *
+
+
+# CELL RESULTS AS A STRUCTURE OF ARRAYS
+# A CellBatch holds the results of many cells as one contiguous float64 array per field, each field in
+# one unit (the kernel units of fn_batch): jlarea, capacity, energy, volume, stackthick, NPratio, avgE,
+# elytevolume, every mass component (mass_total, mass_case, ...) and any format extras (depth, turns).
+# A million cells take ~16 floats each instead of a DotMap of pint Measurements per cell.
+# Fields read like a cell built by make_cell: batch.energy and batch.mass.total are pint arrays in the
+# batch registry, so gravimetric_energy(batch) and volumetric_energy(batch) (fn_cellanalysis) work as for
+# one cell. batch['energy'] is the bare float array.
+#   batch = kernel_batch('cylindrical', p)
+#   good = batch[batch['gravimetric_energy'] > 250]
+#   frame = concat_batches([good, other]).to_frame()
+CELL_FIELDS = ['jlarea', 'capacity', 'energy', 'volume', 'stackthick', 'NPratio', 'avgE', 'elytevolume']
+CELL_MASSES = ['total', 'jellyroll', 'case', 'electrolyte', 'positive', 'positivecc', 'negative',
+               'negativecc', 'separator']
+
+
+#Shared registry of batches made without one (a UnitRegistry takes long to build)
+@functools.lru_cache(maxsize=None)
+def batch_registry():
+    return UnitRegistry()
+
+
+class CellBatch:
+    def __init__(self, fields, format=None, name=None, unit=None, units=None):
+        lengths = set(np.shape(value)[0] for value in fields.values() if np.ndim(value) > 0)
+        if len(lengths) > 1:
+            raise ValueError('Cell batch fields of different lengths.')
+        n = lengths.pop() if lengths else 1
+        self.fields = {}
+        for key, value in fields.items(): #contiguous rows stay views, slices copy nothing
+            value = np.asarray(value, dtype=np.float64)
+            self.fields[key] = value if np.shape(value) == (n,) else np.ascontiguousarray(np.broadcast_to(value, (n,)))
+        self.units = {key: (units or {}).get(key) or kernel_unit(key) for key in self.fields}
+        self.format = format
+        self.name = name
+        self.unit = unit if unit is not None else batch_registry()
+
+    def __len__(self):
+        return len(next(iter(self.fields.values()))) if self.fields else 0
+
+    #Field arrays by name; rows by integer, slice (a view), boolean mask or index array
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.fields[key]
+        if isinstance(key, (int, np.integer)):
+            key = slice(key, key+1 if key != -1 else None)
+        return CellBatch({field: value[key] for field, value in self.fields.items()}, self.format, self.name,
+                         self.unit, self.units)
+
+    def __contains__(self, key):
+        return key in self.fields
+
+    def keys(self):
+        return self.fields.keys()
+
+    #Fields as pint arrays, masses grouped like cell.mass
+    def __getattr__(self, key):
+        if key in ('fields', 'units', 'unit'): #not yet set (copy, pickle)
+            raise AttributeError(key)
+        if key == 'mass':
+            return DotMap({field[5:]: self.quantity(field) for field in self.fields if field.startswith('mass_')},
+                          _dynamic=False)
+        if key in self.fields:
+            return self.quantity(key)
+        raise AttributeError(key)
+
+    def quantity(self, key):
+        return self.unit.Quantity(self.fields[key], self.units[key])
+
+    def to_frame(self, units=False):
+        if units:
+            return pd.DataFrame({key + ' [' + self.units[key] + ']': value for key, value in self.fields.items()})
+        return pd.DataFrame(self.fields)
+
+    #Registries do not pickle: unpickled batches (e.g. from worker processes) use the shared one
+    def __getstate__(self):
+        return dict(self.__dict__, unit=None)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.unit = batch_registry()
+
+    def __repr__(self):
+        return 'CellBatch(' + str(len(self)) + ' cells, ' + str(self.format) + ': ' + ', '.join(self.fields) + ')'
+
+
+#Batch of kernel results, e.g. of batch_cell (scalar results are repeated for every cell)
+def kernel_batch(format, p, name=None, unit=None):
+    out = batch_cell(format, p)
+    n = max([np.size(value) for key, value in out.items()])
+    return CellBatch({key: np.broadcast_to(value, n) for key, value in out.items()}, format, name, unit)
+
+
+#Batch of cells built by make_cell (nominal values, in the kernel units)
+def cells_batch(cells, name=None):
+    cells = list(cells)
+    if len(cells) == 0:
+        raise ValueError('Unspecified cells.')
+    unit = cells[0].unit
+    fields = {}
+    for key in CELL_FIELDS:
+        fields[key] = [to_kernel(cell[key], key, unit) for cell in cells]
+    for key in CELL_MASSES:
+        fields['mass_'+key] = [to_kernel(cell.mass[key], 'mass_'+key, unit) for cell in cells]
+    formats = set(cell.format for cell in cells)
+    return CellBatch(fields, formats.pop() if len(formats) == 1 else None, name, unit)
+
+
+#One batch of the rows of several (fields common to all batches)
+def concat_batches(batches):
+    batches = list(batches)
+    if len(batches) == 0:
+        raise ValueError('Unspecified cell batches.')
+    first = batches[0]
+    keys = [key for key in first.fields if all(key in batch.fields for batch in batches)]
+    for batch in batches[1:]:
+        for key in keys:
+            if batch.units[key] != first.units[key]:
+                raise ValueError('Cell batches with different units: ' + key)
+    formats = set(batch.format for batch in batches)
+    return CellBatch({key: np.concatenate([batch.fields[key] for batch in batches]) for key in keys},
+                     formats.pop() if len(formats) == 1 else None, first.name, first.unit, first.units)
@@ -6,145 +6,126 @@ import pickle
 from pint import UnitRegistry
 import os
 from dotmap import DotMap
-import sys  
+import sys
+from BotB_functions.fn_profile import stage, profiled, count
+from BotB_functions.fn_cellstack import coating_density, charged_thickness, hosting_arealcap
+from BotB_functions.fn_ocv import window_voltage
 
 
-# MAKE CYLINDRICAL CELL
-def make_cylindrical(**kwargs):
+# CELL FORMAT GEOMETRY PLUGINS
+# The electrochemistry (capacity, energy, electrolyte/electrode/separator masses) is the same for
+# every cell format. A format only supplies its geometry:
+#   defaults  cell properties and their default values ('missing' if they must be given)
+#   ncoat     coated sides per electrode layer (also the number of separator layers per stack)
+#   area(cell, stackthick)    electrode area
+#   case(cell)                casing mass (extramass is added by the engine)
+#   volume(cell, stackthick)  cell volume
+#   extras(cell, stackthick)  optional dict of extra results, e.g. pouch depth
+#   units     float kernel units of inputs/results not already in KERNEL_UNITS (fn_batch)
+# Geometry functions only use arithmetic, so they run unchanged on a pint cell DotMap (make_cell)
+# and on dicts of float arrays in kernel units (batch_cell in fn_batch).
+CELL_FORMATS = {}
 
-    import numpy as np
-    
-    def get_nominal(value):
-        try:
-            nominal = value.n
-        except AttributeError:
-            nominal = value.magnitude
+#Electrolyte fill, shared by every format: 'ecapratio' fills ecapratio*capacity, 'porevolume' fills the
+#pore volume of the positive, negative and separator plus an excess fraction (ecapratio is then a result)
+ELECTROLYTE_FILL_DEFAULTS = {
+    "elytefill": 'ecapratio',
+    "elyteexcess": 0, #extra electrolyte as a fraction of the pore volume
+}
 
-        return nominal
-    
-    
-    cell = {
-        "name": 'name',
-        "format": 'cylindrical',
-        "cellstack": 'missing',
-        "ecapratio": 'missing', #electrolyte:capacity ratio (mL/Ah) ~1.8 mL/Ah
-        
-        "diameter": 'missing',
-        "height": 'missing',
-        
-        "canthick": 'missing',
-        "candens": 'missing',
-        
-        "mandreldiam": 'missing', #void diameter
-        "headspace": 'missing',
-        
-        "llifactor": 0.95, #formation losses
-        "extramass": 'missing', #unaccounted for mass like tabs etc
+
+def register_cellformat(name, defaults, ncoat, area, case, volume, extras=None, units=None):
+    defaults = dict(defaults)
+    for key, value in ELECTROLYTE_FILL_DEFAULTS.items():
+        defaults.setdefault(key, value)
+    defaults['format'] = name
+    CELL_FORMATS[name] = {
+        "defaults": defaults,
+        "ncoat": ncoat,
+        "area": area,
+        "case": case,
+        "volume": volume,
+        "extras": extras,
+        "units": units or {},
     }
-    
+    return CELL_FORMATS[name]
+
+
+#Numeric geometry inputs of a format (what the float kernel needs)
+def cellformat_keys(format):
+    defaults = CELL_FORMATS[format]['defaults']
+    keys = [key for key, value in defaults.items()
+            if key != 'cellstack' and (isinstance(value, str) is False or value == 'missing')]
+    return keys
+
+
+#Plain number of a dimensionless ratio (pint quantities are reduced and uncertainties dropped)
+def nominal_ratio(value):
+    try:
+        value = value.to('dimensionless')
+    except AttributeError:
+        return value
+    try:
+        return value.n
+    except AttributeError:
+        return value.magnitude
+
+
+#Average cell voltage: avgE of the positive minus the negative, or integrated over the N/P balanced window
+#when an active carries an OCV curve (fn_ocv)
+def cell_voltage(cell, positive, negative):
+    posactive = positive.composite.active
+    negactive = negative.composite.active
+    if 'ocv' not in posactive and 'ocv' not in negactive:
+        return posactive.avgE-negactive.avgE
+    unit = cell.unit
+    def nominal(value, units):
+        return nominal_ratio(value/unit(units))
+    voltage = window_voltage(posactive.get('ocv'), negactive.get('ocv'),
+                             nominal(posactive.avgE, 'V'), nominal(negactive.avgE, 'V'),
+                             nominal(positive.composite.arealcap, 'mA*hr/cm**2'),
+                             nominal(hosting_arealcap(negative.composite, positive.composite), 'mA*hr/cm**2'),
+                             nominal_ratio(cell.llifactor))
+    return float(voltage)*unit.V
+
+
+# SHARED CELL ENGINE
+def make_cell(format, **kwargs):
+    if format not in CELL_FORMATS:
+        raise ValueError('Unknown cell format: ' + str(format))
+    count('cells ' + format)
+    cell = dict(CELL_FORMATS[format]['defaults'])
     for key, value in kwargs.items(): #Load specified properties from arguments
         cell[key] = value
-    cell = DotMap(cell)
-    unit = cell.unit
+    if cell['elytefill'] not in ['ecapratio', 'porevolume']:
+        raise ValueError('Unknown electrolyte fill: ' + str(cell['elytefill']))
+    if cell['elytefill'] == 'porevolume' and cell['ecapratio'] == 'missing':
+        cell['ecapratio'] = None #calculated from the fill
+    with stage('dotmap'):
+        cell = DotMap(cell)
     if any(x == 'missing' for x in cell.values()): #Check if any are unspecified
      raise ValueError('Unspecified cell properties.')
-    
-    #Calculate: jellyroll area, cell mass, cell capacity, cell energy, cell volume,
-    
-    stackthick = 2*cell.cellstack.positive.composite.thick + cell.cellstack.positive.currentcollector.thick  \
-                    + 2*cell.cellstack.negative.composite.thick + cell.cellstack.negative.currentcollector.thick  \
-                        + 2*cell.cellstack.separator.thick
-    #Component geometries
-    stackthick.ito(unit.cm)
-    cell.height.ito(unit.cm)
-    h_cell = cell.height
-    cell.mandreldiam.ito(unit.cm)
-    d_mandrel = cell.mandreldiam
-    cell.headspace.ito(unit.cm)
-    headspace = cell.headspace
-    cell.canthick.ito(unit.cm)
-    canthick = cell.canthick
-    cell.diameter.ito(unit.cm)
-    d_cell = cell.diameter-2*canthick
-    
-    #Jelly roll area via Archimedes spiral maths
-    a = stackthick/(2*np.pi)
-    theta = (d_cell/2)*(2*np.pi)/stackthick
-    l_all = (a/2)*(theta*(1+theta**2)**0.5 + np.log(theta.n + (1+theta.n**2)**0.5))
-    theta_mandrel = (d_mandrel/2)*(2*np.pi)/stackthick
-    l_inner = (a/2)*(theta_mandrel*(1+theta_mandrel**2)**0.5 + np.log(theta_mandrel.n + (1+theta_mandrel.n**2)**0.5))
-    l_winding = l_all-l_inner
-    h = h_cell-headspace-2*canthick
-    area = h*l_winding
-    area.ito(unit.cm**2)
-    
-    
-    #Capacity
-    capacity = min(cell.cellstack.positive.composite.arealcap,cell.cellstack.negative.composite.arealcap) * cell.llifactor * 2*area #double coat
-    capacity.ito(unit.A*unit.hr)
-    
-    #Energy
-    energy = capacity*(cell.cellstack.positive.composite.active.avgE-cell.cellstack.negative.composite.active.avgE)
-    energy.ito(unit.W*unit.hr)
-    
-    #Assign component and cell masses
-    elytemass = cell.ecapratio*capacity*cell.cellstack.electrolyte.density
-    elytemass.ito(unit.g)
-    posmass = area*(2*cell.cellstack.positive.composite.thick*cell.cellstack.positive.composite.density) #double coated
-    posmass.ito(unit.g)
-    posccmass = area*(cell.cellstack.positive.currentcollector.thick*cell.cellstack.positive.currentcollector.density)
-    posccmass.ito(unit.g)
-    negmass = area*(2*cell.cellstack.negative.composite.thick*cell.cellstack.negative.composite.density) #double coated
-    negmass.ito(unit.g)
-    negccmass = area*(cell.cellstack.negative.currentcollector.thick*cell.cellstack.negative.currentcollector.density)
-    negccmass.ito(unit.g)
-    sepmass = area*(2*cell.cellstack.separator.thick*cell.cellstack.separator.density) #2 sided
-    sepmass.ito(unit.g)
-    jellymass = posmass + posccmass + negmass + negccmass + sepmass + elytemass
-    jellymass.ito(unit.g)
-    d_cell = cell.diameter
-    canmass = cell.candens*cell.canthick*(np.pi*(d_cell*h_cell) + 2*np.pi*(d_cell/2)**2) + cell.extramass
-    canmass.ito(unit.g)
-    cellmass = canmass + jellymass
-    
-    #Cell volume
-    volume = (np.pi*(d_cell/2)**2)*h_cell
-    volume.ito(unit.cm**3)
-    
-    #Stack thickness
-    stackthick.ito(unit.um)
-    
-    #NP Ratio
-    cell.cellstack.positive.composite.arealcap.ito(unit.mA*unit.hr/unit.cm**2)
-    cell.cellstack.negative.composite.arealcap.ito(unit.mA*unit.hr/unit.cm**2)
-    NPratio = get_nominal(cell.cellstack.negative.composite.arealcap)/get_nominal(cell.cellstack.positive.composite.arealcap)
-    
-    #Assign dict
-    cell.jlarea = area
-    cell.capacity = capacity
-    cell.energy = energy
-    cell.volume = volume
-    cell.stackthick = stackthick
-    cell.NPratio = NPratio
-    
-    cell.mass.total = cellmass
-    cell.mass.jellyroll = jellymass
-    cell.mass.case = canmass
-    cell.mass.electrolyte = elytemass
-    cell.mass.positive = posmass
-    cell.mass.positivecc = posccmass
-    cell.mass.negative = negmass
-    cell.mass.negativecc = negccmass
-    cell.mass.separator = sepmass
-    cell.avgE = cell.cellstack.positive.composite.active.avgE-cell.cellstack.negative.composite.active.avgE
-    
-    return cell
-    
-# MAKE POUCH CELL
-def make_pouch(**kwargs):
+    return build_cell(cell, format)
+
+
+#Electrolyte filled pore volume of the electrodes and separators
+def stack_porevolume(cellstack, area, ncoat):
+    positive = cellstack.positive.composite
+    negative = cellstack.negative.composite
+    separator = cellstack.separator
+    return area*ncoat*(positive.thick*positive.porosity + negative.thick*negative.porosity
+                       + separator.thick*separator.porosity)
+
+
+def electrolyte_volume(cell, capacity, area, ncoat):
+    if cell.elytefill == 'porevolume':
+        return stack_porevolume(cell.cellstack, area, ncoat)*(1+cell.elyteexcess)
+    return cell.ecapratio*capacity
+
+
+#Calculate: electrode area, cell mass, cell capacity, cell energy, cell volume
+def build_cell(cell, format):
 
-    import numpy as np
-    
     def get_nominal(value):
         try:
             nominal = value.n
@@ -152,95 +133,74 @@ def make_pouch(**kwargs):
             nominal = value.magnitude
 
         return nominal
-    
-    
-    cell = {
-        "name": 'name',
-        "format": 'pouch stacked',
-        "cellstack": 'missing',
-        "ecapratio": 'missing', #electrolyte:capacity ratio (~ 1.8 mL/Ah)
-        
-        "height": 'missing',
-        "width": 'missing',
-        "nlayers": 'missing', #depth is set by number of layers as pouch cell is unconstrained
-        
-        "pouchthick": 'missing',
-        "pouchdens": 'missing',
-        "pouchclearance": 'missing', #clearance on edges for sealing pouch cell (~ 1 mm)
-        
-        "tabh": 'missing', #tab dimensions
-        "tabw": 'missing',
-        "tabt": 'missing',
-        "tabloc": 'top',
-        
-        "tabdenspos": 'missing', #2.7 g/cm3 for aluminum
-        "tabdensneg": 'missing', #8.9 g/cm3 for nickel/copper
-    
-        "llifactor": 0.95, #formation losses
-        "extramass": 'missing', #unaccounted for mass like tabs etc
-    }
-    
-    for key, value in kwargs.items(): #Load specified properties from arguments
-        cell[key] = value
-    cell = DotMap(cell)
+
     unit = cell.unit
-    if any(x == 'missing' for x in cell.values()): #Check if any are unspecified
-     raise ValueError('Unspecified cell properties.')
+    geometry = CELL_FORMATS[format]
+    ncoat = geometry['ncoat']
+    positive = cell.cellstack.positive
+    negative = cell.cellstack.negative
+
+    with stage('stackthick'):
+        stackthick = ncoat*positive.composite.thick + positive.currentcollector.thick  \
+                        + ncoat*charged_thickness(negative.composite) + negative.currentcollector.thick  \
+                            + ncoat*cell.cellstack.separator.thick
+        stackthick.ito(unit.cm)
+
+    with stage('area'):
+        area = geometry['area'](cell, stackthick)
+        area.ito(unit.cm**2)
+
+    with stage('capacity'):
+        #Capacity
+        capacity = min(positive.composite.arealcap,hosting_arealcap(negative.composite,positive.composite)) * cell.llifactor * ncoat*area
+        capacity.ito(unit.A*unit.hr)
+
+        #Energy
+        avgE = cell_voltage(cell, positive, negative)
+        energy = capacity*avgE
+        energy.ito(unit.W*unit.hr)
+
+    with stage('masses'):
+        #Assign component and cell masses
+        elytevolume = electrolyte_volume(cell, capacity, area, ncoat)
+        elytemass = elytevolume*cell.cellstack.electrolyte.density
+        elytemass.ito(unit.g)
+        elytevolume.ito(unit.mL)
+        if cell.elytefill == 'porevolume':
+            cell.ecapratio = elytevolume/capacity
+            cell.ecapratio.ito(unit.mL/(unit.A*unit.hr))
+        posmass = area*(ncoat*positive.composite.thick*coating_density(positive.composite))
+        posmass.ito(unit.g)
+        posccmass = area*(positive.currentcollector.thick*positive.currentcollector.density)
+        posccmass.ito(unit.g)
+        negmass = area*(ncoat*negative.composite.thick*coating_density(negative.composite))
+        negmass.ito(unit.g)
+        negccmass = area*(negative.currentcollector.thick*negative.currentcollector.density)
+        negccmass.ito(unit.g)
+        sepmass = area*(ncoat*cell.cellstack.separator.thick*cell.cellstack.separator.density)
+        sepmass.ito(unit.g)
+        jellymass = posmass + posccmass + negmass + negccmass + sepmass + elytemass
+        jellymass.ito(unit.g)
+
+        casemass = geometry['case'](cell) + cell.extramass
+        casemass.ito(unit.g)
+        cellmass = casemass + jellymass
+
+    with stage('volume'):
+        volume = geometry['volume'](cell, stackthick)
+        volume.ito(unit.cm**3)
+        if geometry['extras'] is not None:
+            for key, value in geometry['extras'](cell, stackthick).items():
+                cell[key] = value
 
-    area = cell.nlayers*cell.width*cell.height #jelly roll area#
-
-    #Capacity
-    capacity = min(cell.cellstack.positive.composite.arealcap,cell.cellstack.negative.composite.arealcap) * cell.llifactor * 2*area #double coated
-    capacity.ito(unit.A*unit.hr)
-    
-    #Energy
-    energy = capacity*(cell.cellstack.positive.composite.active.avgE-cell.cellstack.negative.composite.active.avgE)
-    energy.ito(unit.W*unit.hr)
-    
-    #Assign component and cell masses
-    elytemass = cell.ecapratio*capacity*cell.cellstack.electrolyte.density
-    elytemass.ito(unit.g)
-    posmass = area*(2*cell.cellstack.positive.composite.thick*cell.cellstack.positive.composite.density) #double coated
-    posmass.ito(unit.g)
-    posccmass = area*(cell.cellstack.positive.currentcollector.thick*cell.cellstack.positive.currentcollector.density)
-    posccmass.ito(unit.g)
-    negmass = area*(2*cell.cellstack.negative.composite.thick*cell.cellstack.negative.composite.density) #double coated
-    negmass.ito(unit.g)
-    negccmass = area*(cell.cellstack.negative.currentcollector.thick*cell.cellstack.negative.currentcollector.density)
-    negccmass.ito(unit.g)
-    sepmass = area*(2*cell.cellstack.separator.thick*cell.cellstack.separator.density) #2 sided
-    sepmass.ito(unit.g)
-    jellymass = posmass + posccmass + negmass + negccmass + sepmass + elytemass
-    jellymass.ito(unit.g)
-    
-    pouchmass = cell.pouchdens*cell.pouchthick*(cell.width+cell.pouchclearance)*(cell.height+cell.pouchclearance)*2 #2 layer pouch sealed together
-    tabmass = (cell.tabh+cell.pouchclearance)*cell.tabw*cell.tabt*cell.tabdenspos + (cell.tabh+cell.pouchclearance)*cell.tabw*cell.tabt*cell.tabdensneg
-    casemass = pouchmass + tabmass + cell.extramass
-    casemass.ito(unit.g)
-    
-    cellmass = casemass + jellymass
-    #Stackthick
-    stackthick = 2*cell.cellstack.positive.composite.thick + cell.cellstack.positive.currentcollector.thick  \
-                    + 2*cell.cellstack.negative.composite.thick + cell.cellstack.negative.currentcollector.thick  \
-                        + 2*cell.cellstack.separator.thick
-    stackthick.ito(unit.cm)
-    
-    #Cell volume
-    depth = cell.nlayers*stackthick + 2*cell.pouchthick
-    pouchvol = (cell.width + cell.pouchclearance) * (cell.height + cell.pouchclearance) *  depth
-    
-    tabvol = (cell.tabh+cell.pouchclearance)*cell.tabw*cell.tabt*2
-    volume = pouchvol + tabvol
-    volume.ito(unit.cm**3)
-    
     #Stack thickness
     stackthick.ito(unit.um)
-    
+
     #NP Ratio
-    cell.cellstack.positive.composite.arealcap.ito(unit.mA*unit.hr/unit.cm**2)
-    cell.cellstack.negative.composite.arealcap.ito(unit.mA*unit.hr/unit.cm**2)
-    NPratio = get_nominal(cell.cellstack.negative.composite.arealcap)/get_nominal(cell.cellstack.positive.composite.arealcap)
-    
+    positive.composite.arealcap.ito(unit.mA*unit.hr/unit.cm**2)
+    negative.composite.arealcap.ito(unit.mA*unit.hr/unit.cm**2)
+    NPratio = get_nominal(negative.composite.arealcap)/get_nominal(positive.composite.arealcap)
+
     #Assign dict
     cell.jlarea = area
     cell.capacity = capacity
@@ -248,8 +208,8 @@ def make_pouch(**kwargs):
     cell.volume = volume
     cell.stackthick = stackthick
     cell.NPratio = NPratio
-    cell.depth = depth
-    
+    cell.elytevolume = elytevolume
+
     cell.mass.total = cellmass
     cell.mass.jellyroll = jellymass
     cell.mass.case = casemass
@@ -259,6 +219,248 @@ def make_pouch(**kwargs):
     cell.mass.negative = negmass
     cell.mass.negativecc = negccmass
     cell.mass.separator = sepmass
-    cell.avgE = cell.cellstack.positive.composite.active.avgE-cell.cellstack.negative.composite.active.avgE
-    
-    return cell
\ No newline at end of file
+    cell.avgE = avgE
+
+    return cell
+
+
+# CYLINDRICAL GEOMETRY
+#Jelly roll area via Archimedes spiral maths
+def cylindrical_area(cell, stackthick):
+    with stage('spiral'):
+        d_cell = cell['diameter']-2*cell['canthick']
+        a = stackthick/(2*np.pi)
+        theta = (d_cell/2)*(2*np.pi)/stackthick
+        theta_n = nominal_ratio(theta)
+        l_all = (a/2)*(theta*(1+theta**2)**0.5 + np.log(theta_n + (1+theta_n**2)**0.5))
+        theta_mandrel = (cell['mandreldiam']/2)*(2*np.pi)/stackthick
+        theta_mandrel_n = nominal_ratio(theta_mandrel)
+        l_inner = (a/2)*(theta_mandrel*(1+theta_mandrel**2)**0.5 + np.log(theta_mandrel_n + (1+theta_mandrel_n**2)**0.5))
+        l_winding = l_all-l_inner
+        h = cell['height']-cell['headspace']-2*cell['canthick']
+        area = h*l_winding
+    return area
+
+
+def cylindrical_case(cell):
+    d_cell = cell['diameter']
+    canmass = cell['candens']*cell['canthick']*(np.pi*(d_cell*cell['height']) + 2*np.pi*(d_cell/2)**2)
+    return canmass
+
+
+def cylindrical_volume(cell, stackthick):
+    return (np.pi*(cell['diameter']/2)**2)*cell['height']
+
+
+register_cellformat('cylindrical',
+    defaults={
+        "name": 'name',
+        "cellstack": 'missing',
+        "ecapratio": 'missing', #electrolyte:capacity ratio (mL/Ah) ~1.8 mL/Ah
+
+        "diameter": 'missing',
+        "height": 'missing',
+
+        "canthick": 'missing',
+        "candens": 'missing',
+
+        "mandreldiam": 'missing', #void diameter
+        "headspace": 'missing',
+
+        "llifactor": 0.95, #formation losses
+        "extramass": 'missing', #unaccounted for mass like tabs etc
+    },
+    ncoat=2, #double coated electrodes
+    area=cylindrical_area,
+    case=cylindrical_case,
+    volume=cylindrical_volume)
+
+
+# STACKED POUCH GEOMETRY
+def pouch_area(cell, stackthick):
+    return cell['nlayers']*cell['width']*cell['height'] #electrode area
+
+
+def pouch_case(cell):
+    clearance = cell['pouchclearance']
+    pouchmass = cell['pouchdens']*cell['pouchthick']*(cell['width']+clearance)*(cell['height']+clearance)*2 #2 layer pouch sealed together
+    tabmass = (cell['tabh']+clearance)*cell['tabw']*cell['tabt']*cell['tabdenspos'] + (cell['tabh']+clearance)*cell['tabw']*cell['tabt']*cell['tabdensneg']
+    return pouchmass + tabmass
+
+
+def pouch_depth(cell, stackthick):
+    return cell['nlayers']*stackthick + 2*cell['pouchthick'] #depth is set by number of layers
+
+
+def pouch_volume(cell, stackthick):
+    clearance = cell['pouchclearance']
+    pouchvol = (cell['width'] + clearance) * (cell['height'] + clearance) * pouch_depth(cell, stackthick)
+    tabvol = (cell['tabh']+clearance)*cell['tabw']*cell['tabt']*2
+    return pouchvol + tabvol
+
+
+def pouch_extras(cell, stackthick):
+    return {"depth": pouch_depth(cell, stackthick)}
+
+
+POUCH_DEFAULTS = {
+    "name": 'name',
+    "cellstack": 'missing',
+    "ecapratio": 'missing', #electrolyte:capacity ratio (~ 1.8 mL/Ah)
+
+    "height": 'missing',
+    "width": 'missing',
+    "nlayers": 'missing', #depth is set by number of layers as pouch cell is unconstrained
+
+    "pouchthick": 'missing',
+    "pouchdens": 'missing',
+    "pouchclearance": 'missing', #clearance on edges for sealing pouch cell (~ 1 mm)
+
+    "tabh": 'missing', #tab dimensions
+    "tabw": 'missing',
+    "tabt": 'missing',
+    "tabloc": 'top',
+
+    "tabdenspos": 'missing', #2.7 g/cm3 for aluminum
+    "tabdensneg": 'missing', #8.9 g/cm3 for nickel/copper
+
+    "llifactor": 0.95, #formation losses
+    "extramass": 'missing', #unaccounted for mass like tabs etc
+}
+
+register_cellformat('pouch stacked',
+    defaults=POUCH_DEFAULTS,
+    ncoat=2, #double coated electrodes
+    area=pouch_area,
+    case=pouch_case,
+    volume=pouch_volume,
+    extras=pouch_extras)
+
+
+# PRISMATIC GEOMETRY
+#Electrode space inside the can
+def prismatic_inner(cell):
+    width = cell['width']-2*cell['canthick']
+    thickness = cell['thickness']-2*cell['canthick']
+    height = cell['height']-cell['headspace']-cell['canthick']-cell['lidthick']
+    return width, thickness, height
+
+
+#Turns of a flat wound (racetrack) jelly roll: each turn adds one stack layer on either side
+def racetrack_turns(cell, stackthick):
+    width, thickness, height = prismatic_inner(cell)
+    r_outer = thickness/(2*cell['nrolls'])
+    r_inner = cell['mandrelthick']/2
+    return (r_outer-r_inner)/stackthick
+
+
+#Electrode length of a racetrack winding: straight sections plus an Archimedes spiral at the ends
+def racetrack_area(cell, stackthick):
+    with stage('racetrack'):
+        width, thickness, height = prismatic_inner(cell)
+        r_outer = thickness/(2*cell['nrolls'])
+        r_inner = cell['mandrelthick']/2
+        l_straight = width-2*r_outer
+        l_winding = 2*l_straight*racetrack_turns(cell, stackthick) + np.pi*(r_outer**2-r_inner**2)/stackthick
+        area = cell['nrolls']*height*l_winding
+    return area
+
+
+def racetrack_extras(cell, stackthick):
+    return {"turns": nominal_ratio(racetrack_turns(cell, stackthick))} #per jelly roll
+
+
+#Whole number of Z-stacked layers that fit in the can thickness
+def zstack_layers(cell, stackthick):
+    width, thickness, height = prismatic_inner(cell)
+    return np.floor(nominal_ratio(thickness/stackthick))
+
+
+def zstack_area(cell, stackthick):
+    width, thickness, height = prismatic_inner(cell)
+    return zstack_layers(cell, stackthick)*width*height
+
+
+def zstack_extras(cell, stackthick):
+    return {"nlayers": zstack_layers(cell, stackthick)}
+
+
+#Can walls and bottom plus the lid
+def prismatic_case(cell):
+    width = cell['width']
+    thickness = cell['thickness']
+    canmass = cell['candens']*cell['canthick']*(2*(width+thickness)*(cell['height']-cell['lidthick']) + width*thickness)
+    lidmass = cell['liddens']*cell['lidthick']*width*thickness
+    return canmass + lidmass
+
+
+def prismatic_volume(cell, stackthick):
+    return cell['width']*cell['thickness']*cell['height']
+
+
+PRISMATIC_DEFAULTS = {
+    "name": 'name',
+    "cellstack": 'missing',
+    "ecapratio": 'missing', #electrolyte:capacity ratio (~ 1.8 mL/Ah)
+
+    "width": 'missing', #outer can dimensions
+    "thickness": 'missing',
+    "height": 'missing',
+
+    "canthick": 'missing', #can walls and bottom (~ 0.6-0.8 mm aluminum)
+    "candens": 'missing',
+    "lidthick": 'missing', #cap plate carrying the terminals (~ 1.5-2 mm)
+    "liddens": 'missing',
+    "headspace": 'missing', #space above the electrodes for tabs and terminals
+
+    "llifactor": 0.95, #formation losses
+    "extramass": 'missing', #unaccounted for mass like terminals, vent etc
+}
+
+PRISMATIC_UNITS = {
+    "thickness": 'cm',
+    "lidthick": 'cm',
+    "liddens": 'g/cm**3',
+    "nrolls": 'dimensionless',
+    "mandrelthick": 'cm',
+    "turns": 'dimensionless',
+}
+
+register_cellformat('prismatic wound',
+    defaults=dict(PRISMATIC_DEFAULTS,
+                  nrolls=1, #jelly rolls side by side across the can thickness
+                  mandrelthick=0), #flat mandrel (core) thickness
+    ncoat=2, #double coated electrodes
+    area=racetrack_area,
+    case=prismatic_case,
+    volume=prismatic_volume,
+    extras=racetrack_extras,
+    units=PRISMATIC_UNITS)
+
+register_cellformat('prismatic stacked',
+    defaults=PRISMATIC_DEFAULTS,
+    ncoat=2, #double coated electrodes, Z-folded separator
+    area=zstack_area,
+    case=prismatic_case,
+    volume=prismatic_volume,
+    extras=zstack_extras,
+    units=PRISMATIC_UNITS)
+
+
+# MAKE CYLINDRICAL CELL
+@profiled
+def make_cylindrical(**kwargs):
+    return make_cell('cylindrical', **kwargs)
+
+
+# MAKE POUCH CELL
+@profiled
+def make_pouch(**kwargs):
+    return make_cell('pouch stacked', **kwargs)
+
+
+# MAKE PRISMATIC CELL
+#winding: 'wound' (flat racetrack jelly roll) or 'stacked' (Z-stacked sheets)
+@profiled
+def make_prismatic(winding='wound', **kwargs):
+    return make_cell('prismatic ' + winding, **kwargs)
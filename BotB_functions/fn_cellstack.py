@@ -7,6 +7,9 @@ from pint import UnitRegistry
 import os
 from dotmap import DotMap
 import sys  
+from BotB_functions.fn_profile import stage, profiled, count
+from BotB_functions.fn_electrolyte import lookup_electrolyte
+from BotB_functions.fn_ocv import ocv_curve, curve_average
 
 
 #Print out the structure of any battery dictionary/dotmap
@@ -35,6 +38,7 @@ def make_cellstack(**kwargs):
 
 
 # ACTIVE MATERIAL STRUCTURE
+#Optional ocv=(soc, voltage) gives the open circuit voltage curve (fn_ocv); avgE defaults to its average
 def make_active(**kwargs):
     active = {
         "name": 'missing', #string
@@ -44,10 +48,17 @@ def make_active(**kwargs):
     }
     for key, value in kwargs.items(): #Load specified properties from arguments
         active[key] = value
+    ocv = active.pop('ocv', None)
     active = DotMap(active)
     unit = active.unit
+    if ocv is not None:
+        ocv = ocv_curve(*ocv)
+        if active.avgE == 'missing':
+            active.avgE = curve_average(ocv)*unit.V
     if any(x == 'missing' for x in active.values()): #Check if any are unspecified
      raise ValueError('Unspecified active material properties.')
+    if ocv is not None:
+        active.ocv = ocv
     del active.unit
     return active
 
@@ -109,7 +120,38 @@ def make_separator(**kwargs):
     del separator.unit
     return separator
 
+# SOLID ELECTROLYTE SEPARATOR
+#Dense solid electrolyte layer in place of a porous separator. catholyte is the volume fraction of the
+#layer filled with liquid (0 for none). It is carried as the separator porosity, so with
+#elytefill='porevolume' on the cell only that fraction takes electrolyte. density is the dense solid
+#electrolyte density; the separator density becomes the apparent density of the solid part.
+def make_solidseparator(**kwargs):
+    separator = {
+        "name": 'missing', #string
+        "thick": 'missing', #um
+        "density": 'missing', #g/cm3 dense solid electrolyte
+        "catholyte": 0, #liquid volume fraction
+        "conductivity": 'missing' #mS/cm ionic conductivity of the solid electrolyte
+    }
+    for key, value in kwargs.items(): #Load specified properties from arguments
+        separator[key] = value
+    separator = DotMap(separator)
+    unit = separator.unit
+
+    if any(x == 'missing' for x in separator.values()): #Check if any are unspecified
+     raise ValueError('Unspecified separator properties.')
+    separator.type = 'solid'
+    separator.sedensity = separator.density
+    separator.porosity = separator.catholyte*unit.dimensionless
+    separator.density = separator.sedensity*(1-separator.porosity)
+    del separator.unit
+    return separator
+
+
 # ELECTROLYTE
+#Optional salt=, solvent= (and temperature=, default 25 degC) take density, viscosity and conductivity
+#from the property library in fn_electrolyte instead of the linear density fit
+@profiled
 def make_electrolyte(**kwargs):
     electrolyte = {
         "name": 'missing', #string
@@ -119,32 +161,153 @@ def make_electrolyte(**kwargs):
     for key, value in kwargs.items(): #Load specified properties from arguments
         electrolyte[key] = value
     
-    electrolyte = DotMap(electrolyte)
+    with stage('dotmap'):
+        electrolyte = DotMap(electrolyte)
     unit = electrolyte.unit
     electrolyte.concentration.ito(unit.mol/unit.L)
 
-    dens = 0.091*(unit.L/unit.mol)*(unit.g/unit.cm**3)*(electrolyte.concentration) + 1.1*unit.g/unit.cm**3 #Typical density vs conc function
-    electrolyte.density = dens
+    if 'salt' in electrolyte and 'solvent' in electrolyte:
+        if 'temperature' not in electrolyte:
+            electrolyte.temperature = unit.Quantity(25, unit.degC)
+        electrolyte = lookup_electrolyte(electrolyte, unit)
+    else:
+        dens = 0.091*(unit.L/unit.mol)*(unit.g/unit.cm**3)*(electrolyte.concentration) + 1.1*unit.g/unit.cm**3 #Typical density vs conc function
+        electrolyte.density = dens
     
     if any(x == 'missing' for x in electrolyte.values()): #Check if any are unspecified
      raise ValueError('Unspecified electrolyte properties.')
     del electrolyte.unit
     return electrolyte
 
+# NON-ACTIVE COMPOSITE PHASE (binder, conductive carbon)
+def make_phase(**kwargs):
+    phase = {
+        "name": 'missing', #string
+        "massfrac": 'missing', #mass fraction of the dry coating
+        "density": 'missing' #g/cm3
+    }
+    for key, value in kwargs.items(): #Load specified properties from arguments
+        phase[key] = value
+    phase = DotMap(phase)
+    unit = phase.unit
+    if any(x == 'missing' for x in phase.values()): #Check if any are unspecified
+     raise ValueError('Unspecified composite phase properties.')
+    del phase.unit
+    return phase
+
+
+#Skeletal (solid) density of the coating, 1/sum(w/rho) over the active and the non-active phases.
+#Mass not assigned to any phase is taken at the active density, so without phases this is the active density
+def skeletal_density(composite):
+    actdens = composite.active.density
+    if len(composite.phases) == 0:
+        return actdens
+    inactive = sum([phase.massfrac for phase in composite.phases])
+    specvol = (1-inactive)/actdens
+    for phase in composite.phases:
+        specvol = specvol + phase.massfrac/phase.density
+    return 1/specvol
+
+
+#Density of the whole coating used for the electrode mass
+def coating_density(composite):
+    if 'coatdens' in composite:
+        return composite.coatdens
+    return composite.density
+
+
+#Thickness of a negative coating at full charge (lithium metal grows by the plated lithium)
+def charged_thickness(composite):
+    if composite.get('type') == 'lithium':
+        return composite.thick + composite.growth
+    return composite.thick
+
+
+#Areal capacity a negative can take from the positive: lithium metal plates everything the positive gives
+def hosting_arealcap(composite, positive):
+    if composite.get('type') == 'lithium':
+        return positive.arealcap + composite.arealcap
+    return composite.arealcap
+
+
+# LITHIUM METAL NEGATIVE (Li foil or anode-free)
+#Dense lithium on the negative current collector, used in place of a negative composite. The lithium
+#inventory is excess times the positive areal capacity (excess=0 is anode-free), or give the foil thick
+#instead. On charge the lithium from the positive plates on top, so the layer grows by growth.
+def make_lithium(**kwargs):
+    lithium = {
+        "positive": 'missing', #positive composite dotmap
+        "excess": 0, #N/P excess: lithium inventory / positive areal capacity
+        "thick": 'missing', #cm, calculated from excess if not given
+    }
+    for key, value in kwargs.items(): #Load specified properties from arguments
+        lithium[key] = value
+    lithium = DotMap(lithium)
+    unit = lithium.unit
+    if lithium.positive == 'missing':
+     raise ValueError('Unspecified lithium electrode properties.')
+    if 'active' not in lithium:
+        lithium.active = make_active(name='Li', speccap=3861*unit.mA*unit.hr/unit.g, avgE=0*unit.V,
+                                     density=0.534*unit.g/unit.cm**3, unit=unit) #activesDB.csv
+    active = lithium.active
+    positive = lithium.positive
+
+    if 'thick' in kwargs:
+        arealcap = lithium.thick*active.density*active.speccap
+        arealcap.ito(unit.mA*unit.hr/unit.cm**2)
+        excess = arealcap/positive.arealcap
+        excess.ito(unit.dimensionless)
+    else:
+        excess = lithium.excess*unit.dimensionless
+        arealcap = excess*positive.arealcap
+        arealcap.ito(unit.mA*unit.hr/unit.cm**2)
+    thick = arealcap/active.speccap/active.density
+    thick.ito(unit.um)
+    growth = positive.arealcap/active.speccap/active.density #plated at full charge
+    growth.ito(unit.um)
+
+    composite = DotMap({
+        "type": 'lithium',
+        "active": active,
+        "excess": excess,
+        "arealcap": arealcap,
+        "thick": thick,
+        "growth": growth,
+        "arealload": (arealcap/active.speccap).to(unit.g/unit.cm**2),
+        "activefrac": 1*unit.dimensionless,
+        "phases": [],
+        "porosity": 0*unit.dimensionless, #dense, no electrolyte
+        "density": active.density,
+        "skeletal": active.density,
+        "coatdens": active.density,
+        "porevol": 0*unit.uL/unit.cm**2,
+        "uptake": 0*unit.mL/unit.g,
+    })
+    return composite
+
+
 # COMPOSITE ELECTRODE STRUCTURE
+@profiled
 def make_composite(**kwargs):
     composite = {
         "active": 'missing', #active dict/dotmap
         "arealcap": 'missing', #mAh/cm2
         "thick": 'missing', #cm
         "arealload": 'missing', #g/cm2
-        "activefrac": 0.95, #default 95% active frac - build in binder domain next (avg PVDF + SBR is 1.45 g/cc)
+        "activefrac": 0.95, #default 95% active frac, the rest at the active density unless phases are given
+        "phases": [], #non-active phases from make_phase, e.g. binder (avg PVDF + SBR is 1.45 g/cc) and carbon
         "porosity": 'missing',
         "density": 'missing' #g/cm3
     }
     for key, value in kwargs.items(): #Load specified properties from arguments
         composite[key] = value  
-    composite = DotMap(composite)
+    inactive = sum([phase.massfrac for phase in composite['phases']])
+    if len(composite['phases']) > 0 and 'activefrac' not in kwargs:
+        composite['activefrac'] = 1-inactive #active is whatever the phases leave
+    if composite['activefrac']+inactive > 1+1e-6:
+        raise ValueError('Conflicting defined electrode composite properties.')
+    with stage('dotmap'):
+        composite = DotMap(composite)
     unit = composite.unit
     keylist = list(kwargs)
     composite = complete_composite(composite,keylist,unit)
@@ -155,6 +318,7 @@ def make_composite(**kwargs):
     return composite
 
 
+@profiled
 def complete_composite(composite,keylist,unit): #Checks provided properties and tries to fill the gaps
     
     def average(lst):
@@ -170,7 +334,8 @@ def complete_composite(composite,keylist,unit): #Checks provided properties and
     thick = composite.thick
     compdens = composite.density
     
-    actdens = actdens*activefrac #No binder densities yet so this will suffice
+    skeletal = skeletal_density(composite)
+    actdens = activefrac*skeletal #active mass per volume of solid
     
     #POROSITY SWEEP ==============================   
     porosity_array = []
@@ -191,21 +356,23 @@ def complete_composite(composite,keylist,unit): #Checks provided properties and
         except TypeError:
             pass
         array = porosity_array
-        witherror = (0*array[0].units).plus_minus(0) #make sure everything has uncertainty
-        array = [x+witherror for x in array]
-        if len(array)==0: #No value calculated
-            raise ValueError('Unspecified electrode composite properties.')
-        elif  abs(1-average([x / array[0] for x in array]))>0.001: #Different values calculated
-            raise ValueError('Conflicting defined electrode composite properties.')
-        else:
-            units = array[0].units
-            try:
-                value = array[0].n
-                error = max([x.s for x in array]) #choose the biggest uncertainty from the array
-                prop = unit.Measurement(value,error,units)
-            except AttributeError:
-                prop = unit.Measurement(array[0],units)
-            porosity = prop
+        count('composite estimates', len(array))
+        with stage('uncertainty'): #merge the estimates and their uncertainties
+            witherror = (0*array[0].units).plus_minus(0) #make sure everything has uncertainty
+            array = [x+witherror for x in array]
+            if len(array)==0: #No value calculated
+                raise ValueError('Unspecified electrode composite properties.')
+            elif  abs(1-average([x / array[0] for x in array]))>0.001: #Different values calculated
+                raise ValueError('Conflicting defined electrode composite properties.')
+            else:
+                units = array[0].units
+                try:
+                    value = array[0].n
+                    error = max([x.s for x in array]) #choose the biggest uncertainty from the array
+                    prop = unit.Measurement(value,error,units)
+                except AttributeError:
+                    prop = unit.Measurement(array[0],units)
+                porosity = prop
     
     #AREALLOAD SWEEP ==============================
     arealload_array = []
@@ -229,21 +396,23 @@ def complete_composite(composite,keylist,unit): #Checks provided properties and
         except TypeError:
             pass
         array = arealload_array
-        witherror = (0*array[0].units).plus_minus(0) #make sure everything has uncertainty, even if it is 0
-        array = [x+witherror for x in array]
-        if len(array)==0: #No value calculated
-            raise ValueError('Unspecified electrode composite properties.')
-        elif  abs(1-average([x / array[0] for x in array]))>0.001: #Different values calculated
-            raise ValueError('Conflicting defined electrode composite properties.')
-        else:
-            units = array[0].units
-            try:
-                value = array[0].n
-                error = max([x.s for x in array]) #choose the biggest uncertainty from the array
-                prop = unit.Measurement(value,error,units)
-            except AttributeError:
-                prop = unit.Measurement(array[0],units)
-            arealload = prop
+        count('composite estimates', len(array))
+        with stage('uncertainty'): #merge the estimates and their uncertainties
+            witherror = (0*array[0].units).plus_minus(0) #make sure everything has uncertainty, even if it is 0
+            array = [x+witherror for x in array]
+            if len(array)==0: #No value calculated
+                raise ValueError('Unspecified electrode composite properties.')
+            elif  abs(1-average([x / array[0] for x in array]))>0.001: #Different values calculated
+                raise ValueError('Conflicting defined electrode composite properties.')
+            else:
+                units = array[0].units
+                try:
+                    value = array[0].n
+                    error = max([x.s for x in array]) #choose the biggest uncertainty from the array
+                    prop = unit.Measurement(value,error,units)
+                except AttributeError:
+                    prop = unit.Measurement(array[0],units)
+                arealload = prop
             
 
     
@@ -270,21 +439,23 @@ def complete_composite(composite,keylist,unit): #Checks provided properties and
             pass
 
         array = arealcap_array
-        witherror = (0*array[0].units).plus_minus(0) #make sure everything has uncertainty, even if it is 0
-        array = [x+witherror for x in array]
-        if len(array)==0: #No value calculated
-            raise ValueError('Unspecified electrode composite properties.')
-        elif  abs(1-average([x / array[0] for x in array]))>0.001: #Different values calculated
-            raise ValueError('Conflicting defined electrode composite properties.')
-        else:
-            units = array[0].units
-            try:
-                value = array[0].n
-                error = max([x.s for x in array]) #choose the biggest uncertainty from the array
-                prop = unit.Measurement(value,error,units)
-            except AttributeError:
-                prop = unit.Measurement(array[0],units)
-            arealcap = prop
+        count('composite estimates', len(array))
+        with stage('uncertainty'): #merge the estimates and their uncertainties
+            witherror = (0*array[0].units).plus_minus(0) #make sure everything has uncertainty, even if it is 0
+            array = [x+witherror for x in array]
+            if len(array)==0: #No value calculated
+                raise ValueError('Unspecified electrode composite properties.')
+            elif  abs(1-average([x / array[0] for x in array]))>0.001: #Different values calculated
+                raise ValueError('Conflicting defined electrode composite properties.')
+            else:
+                units = array[0].units
+                try:
+                    value = array[0].n
+                    error = max([x.s for x in array]) #choose the biggest uncertainty from the array
+                    prop = unit.Measurement(value,error,units)
+                except AttributeError:
+                    prop = unit.Measurement(array[0],units)
+                arealcap = prop
             
     #COMPDENS SWEEP ==============================
     compdens_array = []
@@ -308,21 +479,23 @@ def complete_composite(composite,keylist,unit): #Checks provided properties and
         except TypeError:
             pass
         array = compdens_array
-        witherror = (0*array[0].units).plus_minus(0) #make sure everything has uncertainty, even if it is 0
-        array = [x+witherror for x in array]
-        if len(array)==0: #No value calculated
-            raise ValueError('Unspecified electrode composite properties.')
-        elif  abs(1-average([x / array[0] for x in array]))>0.001: #Different values calculated
-            raise ValueError('Conflicting defined electrode composite properties.')
-        else:
-            units = array[0].units
-            try:
-                value = array[0].n
-                error = max([x.s for x in array]) #choose the biggest uncertainty from the array
-                prop = unit.Measurement(value,error,units)
-            except AttributeError:
-                prop = unit.Measurement(array[0],units)
-            compdens = prop
+        count('composite estimates', len(array))
+        with stage('uncertainty'): #merge the estimates and their uncertainties
+            witherror = (0*array[0].units).plus_minus(0) #make sure everything has uncertainty, even if it is 0
+            array = [x+witherror for x in array]
+            if len(array)==0: #No value calculated
+                raise ValueError('Unspecified electrode composite properties.')
+            elif  abs(1-average([x / array[0] for x in array]))>0.001: #Different values calculated
+                raise ValueError('Conflicting defined electrode composite properties.')
+            else:
+                units = array[0].units
+                try:
+                    value = array[0].n
+                    error = max([x.s for x in array]) #choose the biggest uncertainty from the array
+                    prop = unit.Measurement(value,error,units)
+                except AttributeError:
+                    prop = unit.Measurement(array[0],units)
+                compdens = prop
             
             
             
@@ -350,26 +523,42 @@ def complete_composite(composite,keylist,unit): #Checks provided properties and
             pass
 
         array = thick_array
-        witherror = (0*array[0].units).plus_minus(0) #make sure everything has uncertainty, even if it is 0
-        array = [x+witherror for x in array]
-        if len(array)==0: #No value calculated
-            raise ValueError('Unspecified electrode composite properties.')
-        elif  abs(1-average([x / array[0] for x in array]))>0.001: #Different values calculated
-            raise ValueError('Conflicting defined electrode composite properties.')
-        else:
-            units = array[0].units
-            try:
-                value = array[0].n
-                error = max([x.s for x in array]) #choose the biggest uncertainty from the array
-                prop = unit.Measurement(value,error,units)
-            except AttributeError:
-                prop = unit.Measurement(array[0],units)
-            thick = prop
+        count('composite estimates', len(array))
+        with stage('uncertainty'): #merge the estimates and their uncertainties
+            witherror = (0*array[0].units).plus_minus(0) #make sure everything has uncertainty, even if it is 0
+            array = [x+witherror for x in array]
+            if len(array)==0: #No value calculated
+                raise ValueError('Unspecified electrode composite properties.')
+            elif  abs(1-average([x / array[0] for x in array]))>0.001: #Different values calculated
+                raise ValueError('Conflicting defined electrode composite properties.')
+            else:
+                units = array[0].units
+                try:
+                    value = array[0].n
+                    error = max([x.s for x in array]) #choose the biggest uncertainty from the array
+                    prop = unit.Measurement(value,error,units)
+                except AttributeError:
+                    prop = unit.Measurement(array[0],units)
+                thick = prop
     
+    #PHASE DOMAIN ==============================
+    if len(composite.phases) > 0:
+        coatdens = skeletal*(1-porosity) #active, binder and carbon mass per coating volume
+    else:
+        coatdens = compdens #no phases: only the active mass is counted, as before
+    porevol = thick*porosity #electrolyte filled pore volume per coated area
+    porevol.ito(unit.uL/unit.cm**2)
+    uptake = porosity/coatdens #electrolyte volume taken up per mass of coating
+    uptake.ito(unit.mL/unit.g)
+
     #WRITE RESULTS
     composite.porosity = porosity
     composite.arealcap = arealcap
     composite.arealload = arealload
     composite.thick = thick
     composite.density = compdens
+    composite.skeletal = skeletal
+    composite.coatdens = coatdens
+    composite.porevol = porevol
+    composite.uptake = uptake
     return composite
\ No newline at end of file
@@ -0,0 +1,358 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.pyplot import figure
+import pandas as pd
+import pickle
+from pint import UnitRegistry
+import os
+from dotmap import DotMap
+import sys
+
+from BotB_functions.fn_batch import *
+
+
+# COMMAND LINE BATCH EVALUATOR
+#   python -m BotB_functions designs.csv -o results.csv --format cylindrical --workers 4
+# Every row of a design file is one cell. Columns are kernel inputs (fn_batch), in KERNEL_UNITS or in
+# the units given in the header, e.g. 'diameter [mm]'. Inputs that are not in the file come from the
+# reference NMC811 | graphite design of fn_benchmark (or --set key=value). A 'format' column can mix
+# cell formats in one file.
+# Files are read and written a chunk of rows at a time, so only a few chunks are ever in memory:
+#   .csv            pandas chunked reader
+#   .yaml/.yml      stream of documents, each one design (mapping) or a list of designs
+#   .parquet        record batches (needs pyarrow)
+
+
+#Reference kernel inputs of a format: fn_benchmark cellstack with its cylindrical or pouch geometry,
+#numeric format defaults otherwise
+def reference_inputs(format, unit=None):
+    from BotB_functions.fn_benchmark import reference_cellstack, reference_cylindrical, reference_pouch
+    if format not in CELL_FORMATS:
+        raise ValueError('Unknown cell format: ' + str(format))
+    if unit is None:
+        unit = UnitRegistry()
+    cellstack = reference_cellstack(unit)
+    if format == 'cylindrical':
+        return cell_inputs(make_cell(format, **reference_cylindrical(cellstack, unit)))
+    if format in ['pouch stacked', 'single layer pouch']:
+        return cell_inputs(make_cell(format, **reference_pouch(cellstack, unit)))
+    inputs = cellstack_inputs(cellstack, unit)
+    for key in cellformat_keys(format):
+        value = CELL_FORMATS[format]['defaults'][key]
+        if value != 'missing':
+            inputs[key] = to_kernel(value, key, unit)
+    inputs['ecapratio'] = 1.6 #mL/Ah
+    inputs['extramass'] = 0
+    inputs['porefill'] = 0.0
+    return inputs
+
+
+#Column name and factor to kernel units of a header like 'diameter [mm]'
+def parse_column(column, unit):
+    column = str(column).strip()
+    if not column.endswith(']') or '[' not in column:
+        return column, 1.0
+    key, units = column[:-1].split('[', 1)
+    key = key.strip()
+    factor = (1*unit(units.strip())).to(unit(kernel_unit(key))).magnitude
+    return key, float(factor)
+
+
+# READERS
+def read_csv(path, chunksize):
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        yield chunk
+
+
+def read_yaml(path, chunksize):
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    rows = []
+    with open(path) as f:
+        for document in yaml.load_all(f, Loader=loader):
+            if document is None:
+                continue
+            rows.extend(document if isinstance(document, list) else [document])
+            while len(rows) >= chunksize:
+                yield pd.DataFrame(rows[:chunksize])
+                rows = rows[chunksize:]
+    if rows:
+        yield pd.DataFrame(rows)
+
+
+def read_parquet(path, chunksize):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError('Parquet files need pyarrow.')
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+        yield batch.to_pandas()
+
+
+DESIGN_READERS = {
+    ".csv": read_csv,
+    ".yaml": read_yaml,
+    ".yml": read_yaml,
+    ".parquet": read_parquet,
+}
+
+
+def file_type(path, handlers):
+    extension = os.path.splitext(str(path))[1].lower()
+    if extension not in handlers:
+        raise ValueError('Unknown file type: ' + str(path))
+    return extension
+
+
+#Chunks of a design file as DataFrames
+def read_designs(path, chunksize=100000):
+    return DESIGN_READERS[file_type(path, DESIGN_READERS)](path, chunksize)
+
+
+# WRITERS
+#Columns of a chunk: the columns of the file so far, then those the chunk adds
+def result_columns(columns, added):
+    columns = list(columns or [])
+    return columns + [column for column in added if column not in columns]
+
+
+#Results in the columns of the file and those the chunk adds: csv text without header or a DataFrame
+#for parquet, with its columns. Runs in the workers, as formatting csv costs more than evaluating the designs.
+def encode_results(frame, columns, type):
+    columns = result_columns(columns, frame.columns)
+    frame = frame.reindex(columns=columns)
+    if type == '.csv':
+        return frame.to_csv(index=False, header=False), columns
+    return frame, columns
+
+
+#Columns are the union over the chunks (YAML designs of several formats differ in their inputs and
+#extras). Chunks are written as they come, each with its own columns; if the columns grew, the file
+#is rewritten once on close, blank where a design has no value.
+class ResultWriter:
+    def __init__(self, path):
+        self.path = path
+        self.type = file_type(path, {".csv": None, ".parquet": None})
+        self.columns = None
+        self.blocks = [] #rows and columns of every chunk, in file order
+        self.parts = [] #parquet files, a new one whenever the schema changes
+        self.writer = None
+        self.rows = 0
+        if self.type == '.parquet':
+            try:
+                import pyarrow
+            except ImportError:
+                raise ValueError('Parquet files need pyarrow.')
+
+    def write(self, frame):
+        if self.columns is None:
+            self.columns = list(frame.columns)
+            if self.type == '.csv':
+                with open(self.path, 'w') as f:
+                    f.write(frame.iloc[:0].to_csv(index=False))
+        self.write_encoded(*encode_results(frame, self.columns, self.type), len(frame))
+
+    def write_encoded(self, encoded, columns, nrows):
+        self.columns = result_columns(self.columns, columns)
+        self.blocks.append((nrows, columns))
+        if self.type == '.csv':
+            with open(self.path, 'a') as f:
+                f.write(encoded)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(encoded, preserve_index=False)
+            if self.writer is None or not table.schema.equals(self.writer.schema):
+                if self.writer is not None:
+                    self.writer.close()
+                part = self.path if len(self.parts) == 0 else self.path + '.part' + str(len(self.parts))
+                self.parts.append(part)
+                self.writer = pq.ParquetWriter(part, table.schema)
+            self.writer.write_table(table)
+        self.rows += nrows
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.type == '.csv' and any(columns != self.columns for nrows, columns in self.blocks):
+            self.rewrite_csv()
+        if self.type == '.parquet' and len(self.parts) > 1:
+            self.merge_parquet()
+
+    #Read back one chunk at a time in its own columns and write it in the columns of the file
+    def rewrite_csv(self):
+        import io
+        import itertools
+        temporary = self.path + '.tmp'
+        with open(self.path) as source, open(temporary, 'w') as target:
+            next(source) #header of the first chunk
+            target.write(pd.DataFrame(columns=self.columns).to_csv(index=False))
+            for nrows, columns in self.blocks:
+                if nrows == 0:
+                    continue
+                block = pd.read_csv(io.StringIO(''.join(itertools.islice(source, nrows))), header=None,
+                                    names=columns)
+                target.write(block.reindex(columns=self.columns).to_csv(index=False, header=False))
+        os.replace(temporary, self.path)
+
+    #One parquet file from the parts a row group at a time, columns missing from a part as nulls
+    #(float64 where the parts disagree on the type of a column)
+    def merge_parquet(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        parts = [self.path + '.part0'] + self.parts[1:]
+        os.replace(self.path, parts[0])
+        types = {}
+        for part in parts:
+            for field in pq.read_schema(part):
+                types[field.name] = field.type if types.get(field.name, field.type) == field.type else pa.float64()
+        schema = pa.schema([(column, types[column]) for column in self.columns])
+        with pq.ParquetWriter(self.path, schema) as writer:
+            for part in parts:
+                source = pq.ParquetFile(part)
+                for i in range(source.num_row_groups):
+                    table = source.read_row_group(i)
+                    writer.write_table(pa.table([table.column(field.name).cast(field.type)
+                                                 if field.name in table.column_names
+                                                 else pa.nulls(len(table), field.type) for field in schema],
+                                                schema=schema))
+            for part in parts:
+                os.remove(part)
+        self.parts = [self.path]
+
+
+# EVALUATION
+#True for any key with a kernel unit
+def kernel_key(key):
+    try:
+        kernel_unit(key)
+    except (KeyError, IndexError):
+        return False
+    return True
+
+
+#Kernel results of one chunk of designs, appended to its columns. bases maps each format to its
+#reference inputs, columns maps each header to its (kernel key, factor to kernel units).
+def evaluate_chunk(chunk, format, bases, columns, outputs=None):
+    if 'format' in chunk:
+        formats = chunk['format'].fillna(format)
+    else:
+        formats = pd.Series(format, index=chunk.index)
+    results = []
+    for name, rows in chunk.groupby(formats, sort=False):
+        if name not in bases:
+            raise ValueError('Unknown cell format: ' + str(name))
+        p = dict(bases[name])
+        for column in rows.columns:
+            key, factor = columns[column]
+            if key == 'format':
+                continue
+            values = rows[column].to_numpy(dtype=float)*factor
+            blank = np.isnan(values)
+            if blank.all() and key not in p: #a field of designs in other formats (YAML)
+                continue
+            if key in p and blank.any(): #blank fields keep the reference value
+                values = np.where(blank, p[key], values)
+            p[key] = values
+        missing = [key for key in cellformat_keys(name) if key not in p]
+        if missing:
+            raise ValueError('Unspecified cell properties: ' + ', '.join(missing))
+        out = batch_cell(name, p)
+        result = rows.drop(columns=['format'], errors='ignore')
+        result['format'] = name
+        for key in (outputs if outputs is not None else out.keys()):
+            result[key] = np.broadcast_to(out[key], len(rows))
+        results.append(result)
+    return pd.concat(results).sort_index()
+
+
+#Worker task: evaluate a chunk and encode it for the results file
+def evaluate_encoded(chunk, format, bases, columns, outputs, header, type):
+    return encode_results(evaluate_chunk(chunk, format, bases, columns, outputs), header, type) + (len(chunk),)
+
+
+#Evaluate a design file into a results file, `workers` processes evaluating chunks in file order.
+#At most 2*workers chunks are in flight, so memory stays bounded whatever the file size.
+def run_designs(path, output, format='cylindrical', workers=1, chunksize=100000, settings=None,
+                outputs=None, unit=None):
+    import time
+    if unit is None:
+        unit = UnitRegistry()
+    settings = settings or {}
+    for key in settings:
+        if kernel_key(key) is False:
+            raise ValueError('Unknown kernel input: ' + str(key))
+    bases = {name: dict(reference_inputs(name, unit), **settings) for name in CELL_FORMATS}
+    writer = ResultWriter(output)
+    parsed = {}
+    start = time.perf_counter()
+
+    #Headers are parsed once per set of columns (YAML designs may differ in their keys)
+    def chunk_columns(chunk):
+        header = tuple(chunk.columns)
+        if header not in parsed:
+            found = {}
+            for column in header:
+                key, factor = parse_column(column, unit)
+                if key != 'format' and kernel_key(key) is False:
+                    raise ValueError('Unknown design column: ' + str(column))
+                found[column] = (key, factor)
+            parsed[header] = found
+        return parsed[header]
+
+    try:
+        designs = read_designs(path, chunksize)
+        if workers <= 1:
+            for chunk in designs:
+                writer.write(evaluate_chunk(chunk, format, bases, chunk_columns(chunk), outputs))
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            from collections import deque
+            for chunk in designs: #the first chunk sets the columns the workers start from
+                writer.write(evaluate_chunk(chunk, format, bases, chunk_columns(chunk), outputs))
+                break
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                pending = deque()
+                for chunk in designs:
+                    pending.append(pool.submit(evaluate_encoded, chunk, format, bases, chunk_columns(chunk),
+                                               outputs, writer.columns, writer.type))
+                    if len(pending) >= 2*workers:
+                        writer.write_encoded(*pending.popleft().result())
+                while pending:
+                    writer.write_encoded(*pending.popleft().result())
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+    return {'designs': writer.rows, 'seconds': elapsed, 'throughput': writer.rows/max(elapsed, 1e-12)}
+
+
+def parse_setting(text):
+    if '=' not in text:
+        raise ValueError('Settings are key=value: ' + str(text))
+    key, value = text.split('=', 1)
+    return key.strip(), float(value)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='botb',
+                                     description='Evaluate a file of cell designs with the BotB batch engine.')
+    parser.add_argument('designs', help='design file (.csv, .yaml, .yml or .parquet)')
+    parser.add_argument('-o', '--output', default='results.csv', help='results file (.csv or .parquet)')
+    parser.add_argument('-f', '--format', default='cylindrical', choices=sorted(CELL_FORMATS),
+                        help='cell format of rows without a format column')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='worker processes')
+    parser.add_argument('-c', '--chunksize', type=int, default=100000, help='designs per chunk')
+    parser.add_argument('-s', '--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='kernel input for every design, in KERNEL_UNITS')
+    parser.add_argument('--outputs', help='comma separated results to write (default all)')
+    args = parser.parse_args(argv)
+
+    settings = dict(parse_setting(text) for text in args.set)
+    outputs = args.outputs.split(',') if args.outputs else None
+    stats = run_designs(args.designs, args.output, format=args.format, workers=args.workers,
+                        chunksize=args.chunksize, settings=settings, outputs=outputs)
+    print(str(stats['designs']) + ' designs in ' + format(stats['seconds'], '.2f') + ' s ('
+          + format(stats['throughput'], '.0f') + ' designs/s) -> ' + args.output, file=sys.stderr)
+    return 0
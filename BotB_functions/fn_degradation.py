@@ -0,0 +1,133 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.pyplot import figure
+import pandas as pd
+import pickle
+from pint import UnitRegistry
+import os
+from dotmap import DotMap
+import sys
+
+from BotB_functions.fn_batch import *
+
+
+# CAPACITY FADE OVER CYCLES
+# Empirical fade laws give the retained fraction of the initial capacity after n cycles, on top of the
+# formation loss already in llifactor. Mass and volume do not change, so capacity, energy, Wh/kg and
+# Wh/L all scale with the retention.
+# Trajectories are float32 arrays of shape (cells, cycles), filled a chunk of cells at a time so the
+# only full size arrays are the requested outputs: 10^5 cells x 3000 cycles is 1.2 GB per output.
+FADE_LAWS = {}
+
+
+def register_fade(name, law, defaults):
+    FADE_LAWS[name] = {
+        "law": law,
+        "defaults": defaults,
+    }
+
+
+#Retention 1 - rate*n
+def linear_fade(cycles, rate):
+    return 1 - rate*cycles
+
+register_fade('linear', linear_fade, {"rate": 1e-4}) #1/cycle
+
+
+#Retention 1 - b*sqrt(n), SEI growth limited
+def sqrt_fade(cycles, b):
+    return 1 - b*np.sqrt(cycles)
+
+register_fade('sqrt', sqrt_fade, {"b": 4e-3}) #1/sqrt(cycle)
+
+
+#Linear fade with an accelerating loss after the knee: 1 - rate*n - c*(n-knee)**2 for n > knee
+def knee_fade(cycles, rate, knee, c):
+    return 1 - rate*cycles - c*np.maximum(cycles-knee, 0)**2
+
+register_fade('knee', knee_fade, {"rate": 5e-5, #1/cycle
+                                  "knee": 1500, #cycles
+                                  "c": 1e-7}) #1/cycle**2
+
+
+def fade_params(law, ncells, params):
+    if law not in FADE_LAWS:
+        raise ValueError('Unknown fade law: ' + str(law))
+    args = dict(FADE_LAWS[law]['defaults'])
+    for key, value in params.items():
+        if key not in args:
+            raise ValueError('Unknown ' + law + ' fade parameter: ' + str(key))
+        args[key] = value
+    return {key: np.broadcast_to(np.asarray(value, dtype=np.float32), (ncells,)) for key, value in args.items()}
+
+
+#Retention over cycles; parameters are scalars or per cell arrays, giving shape (cells, cycles)
+def fade_retention(cycles, law='sqrt', **params):
+    if law not in FADE_LAWS:
+        raise ValueError('Unknown fade law: ' + str(law))
+    cycles = np.asarray(cycles, dtype=np.float32)
+    args = dict(FADE_LAWS[law]['defaults'])
+    args.update(params)
+    args = {key: np.asarray(value, dtype=np.float32)[..., None] if np.ndim(value) > 0 else np.float32(value)
+            for key, value in args.items()}
+    return np.clip(FADE_LAWS[law]['law'](cycles, **args), 0, 1).astype(np.float32, copy=False)
+
+
+#Trajectories of kernel results (batch_cell output) over cycles, as float32 (cells, cycles) arrays.
+#buffers can hold preallocated arrays (e.g. np.memmap) per output to fill in place.
+def fade_trajectories(out, cycles, law='sqrt', outputs=('gravimetric_energy',), chunk=1024, buffers=None,
+                      **params):
+    cycles = np.asarray(cycles, dtype=np.float32)
+    ncells = max([np.size(out[key]) for key in outputs])
+    prm = fade_params(law, ncells, params)
+    base = {key: np.broadcast_to(np.asarray(out[key], dtype=np.float32), (ncells,)) for key in outputs}
+    if buffers is None:
+        buffers = {}
+    result = {}
+    for key in outputs:
+        if key in buffers:
+            result[key] = buffers[key]
+        else:
+            result[key] = np.empty((ncells, len(cycles)), dtype=np.float32)
+    for start in range(0, ncells, chunk):
+        rows = slice(start, min(start+chunk, ncells))
+        retention = fade_retention(cycles, law, **{key: value[rows] for key, value in prm.items()})
+        for key in outputs:
+            np.multiply(base[key][rows, None], retention, out=result[key][rows])
+    return result
+
+
+#Cycle at which the retention reaches eol (closed form, no trajectories needed)
+def cycles_to_eol(law='sqrt', eol=0.8, **params):
+    if law not in FADE_LAWS:
+        raise ValueError('Unknown fade law: ' + str(law))
+    args = dict(FADE_LAWS[law]['defaults'])
+    args.update(params)
+    loss = 1-eol
+    if law == 'linear':
+        return loss/np.asarray(args['rate'], dtype=float)
+    if law == 'sqrt':
+        return (loss/np.asarray(args['b'], dtype=float))**2
+    if law == 'knee':
+        rate = np.asarray(args['rate'], dtype=float)
+        knee = np.asarray(args['knee'], dtype=float)
+        c = np.asarray(args['c'], dtype=float)
+        linear = loss/rate
+        #after the knee: c*x**2 + rate*x - (loss - rate*knee) = 0 with x = n - knee
+        remaining = np.maximum(loss - rate*knee, 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x = np.where(c > 0, (-rate + np.sqrt(rate**2 + 4*c*remaining))/(2*c), remaining/rate)
+        return np.where(linear <= knee, linear, knee + x)
+    raise ValueError('No closed form end of life for fade law: ' + str(law))
+
+
+#Fade of one built cell as a table over cycles (units as KERNEL_UNITS)
+def cell_fade(cell, cycles, law='sqrt', **params):
+    out = batch_cell(cell.format, cell_inputs(cell))
+    outputs = ('capacity', 'energy', 'gravimetric_energy', 'volumetric_energy')
+    trajectories = fade_trajectories(out, cycles, law, outputs=outputs, **params)
+    fade = pd.DataFrame({'cycle': np.asarray(cycles)})
+    fade['retention'] = fade_retention(cycles, law, **params)
+    for key in outputs:
+        fade[key] = trajectories[key][0]
+    return fade
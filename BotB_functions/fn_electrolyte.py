@@ -0,0 +1,159 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.pyplot import figure
+import pandas as pd
+import pickle
+from pint import UnitRegistry
+import os
+from dotmap import DotMap
+import sys
+
+
+# ELECTROLYTE PROPERTY LIBRARY
+# Properties of a salt in a solvent blend tabulated over concentration (mol/L) and temperature (degC).
+# Tables are built once when an electrolyte is registered and read with vectorized bilinear
+# interpolation, so a lookup over any array of concentrations and temperatures is one numpy call.
+# Outside the table range the nearest edge value is used.
+ELECTROLYTES = {}
+ELECTROLYTE_UNITS = {
+    "concentration": 'mol/L',
+    "temperature": 'degC',
+    "density": 'g/cm**3',
+    "viscosity": 'mPa*s',
+    "conductivity": 'mS/cm',
+}
+ELECTROLYTE_PROPERTIES = ['density', 'viscosity', 'conductivity']
+
+CONCENTRATION_GRID = np.linspace(0, 3, 61) #mol/L
+TEMPERATURE_GRID = np.linspace(-30, 60, 19) #degC
+
+
+#Properties are arrays of shape (concentration, temperature) or functions f(conc, temp) tabulated on the grids
+def register_electrolyte(salt, solvent, density, viscosity=None, conductivity=None,
+                         concentration=CONCENTRATION_GRID, temperature=TEMPERATURE_GRID):
+    concentration = np.asarray(concentration, dtype=float)
+    temperature = np.asarray(temperature, dtype=float)
+    conc, temp = np.meshgrid(concentration, temperature, indexing='ij')
+    entry = {
+        "concentration": concentration,
+        "temperature": temperature,
+    }
+    for name, prop in zip(ELECTROLYTE_PROPERTIES, [density, viscosity, conductivity]):
+        if prop is None:
+            entry[name] = None
+        elif callable(prop):
+            entry[name] = np.asarray(prop(conc, temp), dtype=float)
+        else:
+            entry[name] = np.asarray(prop, dtype=float).reshape(conc.shape)
+    ELECTROLYTES[(salt, solvent)] = entry
+    return entry
+
+
+#Index of the lower grid point and the fraction towards the upper one
+def grid_position(grid, x):
+    x = np.clip(x, grid[0], grid[-1])
+    i = np.clip(np.searchsorted(grid, x, side='right')-1, 0, len(grid)-2)
+    frac = (x-grid[i])/(grid[i+1]-grid[i])
+    return i, frac
+
+
+def electrolyte_entry(salt, solvent):
+    if (salt, solvent) not in ELECTROLYTES:
+        raise ValueError('Unknown electrolyte: ' + str(salt) + ' in ' + str(solvent))
+    return ELECTROLYTES[(salt, solvent)]
+
+
+#Property of a registered electrolyte at concentrations (mol/L) and temperatures (degC), broadcast together
+def electrolyte_property(salt, solvent, prop, concentration, temperature=25):
+    entry = electrolyte_entry(salt, solvent)
+    if prop not in ELECTROLYTE_PROPERTIES:
+        raise ValueError('Unknown electrolyte property: ' + str(prop))
+    table = entry[prop]
+    if table is None:
+        raise ValueError('No ' + prop + ' data for ' + str(salt) + ' in ' + str(solvent))
+    concentration, temperature = np.broadcast_arrays(np.asarray(concentration, dtype=float),
+                                                     np.asarray(temperature, dtype=float))
+    i, fc = grid_position(entry['concentration'], concentration)
+    j, ft = grid_position(entry['temperature'], temperature)
+    value = (table[i, j]*(1-fc)*(1-ft) + table[i+1, j]*fc*(1-ft)
+             + table[i, j+1]*(1-fc)*ft + table[i+1, j+1]*fc*ft)
+    return value
+
+
+#All properties over a concentration x temperature grid for a list of (salt, solvent) pairs
+def electrolyte_table(electrolytes, concentration, temperature=25):
+    conc, temp = np.meshgrid(np.atleast_1d(concentration), np.atleast_1d(temperature), indexing='ij')
+    frames = []
+    for salt, solvent in electrolytes:
+        entry = electrolyte_entry(salt, solvent)
+        frame = pd.DataFrame({'salt': salt, 'solvent': solvent,
+                              'concentration': conc.ravel(), 'temperature': temp.ravel()})
+        for prop in ELECTROLYTE_PROPERTIES:
+            if entry[prop] is not None:
+                frame[prop] = electrolyte_property(salt, solvent, prop, conc.ravel(), temp.ravel())
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+
+#Kernel inputs (fn_batch) with the electrolyte density looked up for arrays of concentration/temperature
+def electrolyte_inputs(p, salt, solvent, concentration, temperature=25):
+    inputs = dict(p)
+    inputs['elyte_density'] = electrolyte_property(salt, solvent, 'density', concentration, temperature)
+    return inputs
+
+
+# PINT ELECTROLYTES (make_electrolyte with salt= and solvent=)
+#Sets the properties of an electrolyte dotmap from the library. The concentration uncertainty is carried
+#through the local slope of each property.
+def lookup_electrolyte(electrolyte, unit):
+    salt = electrolyte.salt
+    solvent = electrolyte.solvent
+    entry = electrolyte_entry(salt, solvent)
+    concentration = electrolyte.concentration.to(unit(ELECTROLYTE_UNITS['concentration']))
+    temperature = electrolyte.temperature
+    try:
+        temperature = temperature.to(unit.degC).magnitude
+    except AttributeError: #plain number in degC
+        pass
+    try:
+        conc = concentration.n
+    except AttributeError:
+        conc = concentration.magnitude
+    step = 1e-4
+    for prop in ELECTROLYTE_PROPERTIES:
+        if entry[prop] is None:
+            continue
+        value, upper = electrolyte_property(salt, solvent, prop, [conc, conc+step], temperature)
+        slope = (upper-value)/step
+        propunit = unit(ELECTROLYTE_UNITS[prop])
+        dconc = (concentration - conc*unit(ELECTROLYTE_UNITS['concentration'])).magnitude
+        electrolyte[prop] = (float(value) + float(slope)*dconc)*propunit
+    return electrolyte
+
+
+# LIBRARY
+#Density of carbonate blends: the linear fit of make_electrolyte at 25 degC with a thermal expansion term
+def carbonate_density(rho0, slope=0.091, expansion=1.1e-3):
+    return lambda conc, temp: rho0 + slope*conc - expansion*(temp-25)
+
+
+#LiPF6 conductivity in carbonate blends, Valoen & Reimers (2005) fit (mS/cm)
+def valoen_conductivity(conc, temp):
+    T = temp + 273.15
+    return conc*(-10.5 + 0.0740*T - 6.96e-5*T**2 + 0.668*conc - 0.0178*conc*T + 2.8e-5*conc*T**2
+                 + 0.494*conc**2 - 8.86e-4*conc**2*T)**2
+
+
+#Arrhenius viscosity with exponential salt thickening (mPa s), approximate for carbonate blends
+def carbonate_viscosity(eta0, b=1.2, tact=1900):
+    return lambda conc, temp: eta0*np.exp(b*conc)*np.exp(tact*(1/(temp+273.15) - 1/298.15))
+
+
+register_electrolyte('LiPF6', 'EC:EMC 3:7',
+                     density=carbonate_density(1.1),
+                     viscosity=carbonate_viscosity(0.8),
+                     conductivity=valoen_conductivity)
+register_electrolyte('LiPF6', 'EC:DMC 1:1',
+                     density=carbonate_density(1.21),
+                     viscosity=carbonate_viscosity(0.7),
+                     conductivity=valoen_conductivity)
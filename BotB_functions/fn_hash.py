@@ -0,0 +1,29 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.pyplot import figure
+import pandas as pd
+import pickle
+from pint import UnitRegistry
+import os
+from dotmap import DotMap
+import sys
+import hashlib
+
+
+# COUNTER BASED HASHING
+# 64 bit hashes shared by the checkpointed sweeps (design point ids, fn_store) and the counter based
+# samplers (random words, fn_sampling): the same inputs give the same words on any machine and run.
+
+
+#splitmix64 finalizer on uint64 arrays (wraps around by design)
+def mix64(x):
+    x = np.asarray(x, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+#64 bit hash of a string (first 8 bytes of its sha1)
+def text_hash(text):
+    return np.uint64(int.from_bytes(hashlib.sha1(text.encode()).digest()[:8], 'little'))
@@ -0,0 +1,81 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.pyplot import figure
+import pandas as pd
+import pickle
+from pint import UnitRegistry
+import os
+from dotmap import DotMap
+import sys
+
+
+# OPEN CIRCUIT VOLTAGE CURVES
+# An active can carry its OCV against state of charge, make_active(..., ocv=(soc, voltage)). For both
+# electrodes soc runs from 0 to 1 in the cell sense: 1 is charged (positive delithiated, negative
+# lithiated). Curves are stored as compact (2, n) float32 arrays [soc; voltage in V].
+# The cell voltage is integrated over the N/P balanced window: from full charge (positive at soc 1,
+# negative holding the lithium the positive gave) down to the cell capacity. Curves are piecewise
+# linear, so the window integral is exact from four lookups of the cumulative curve integral per
+# design, whatever the number of designs.
+
+
+def ocv_curve(soc, voltage):
+    soc = np.asarray(getattr(soc, 'magnitude', soc), dtype=float)
+    try:
+        voltage = voltage.to('V').magnitude
+    except AttributeError: #plain numbers in V
+        pass
+    voltage = np.asarray(voltage, dtype=float)
+    if soc.ndim != 1 or soc.shape != voltage.shape or len(soc) < 2:
+        raise ValueError('OCV curve needs matching 1D soc and voltage arrays.')
+    order = np.argsort(soc)
+    soc = soc[order]
+    if soc[0] < 0 or soc[-1] > 1:
+        raise ValueError('OCV curve soc must be within 0 and 1.')
+    return np.array([soc, voltage[order]], dtype=np.float32)
+
+
+#Voltage of a curve at any array of soc
+def curve_voltage(curve, soc):
+    return np.interp(soc, curve[0], curve[1])
+
+
+#Average voltage over the soc range of the curve
+def curve_average(curve):
+    soc = curve[0].astype(float)
+    voltage = curve[1].astype(float)
+    return float(np.sum((voltage[1:]+voltage[:-1])/2*np.diff(soc))/(soc[-1]-soc[0]))
+
+
+#Integral of a curve from its first soc to x (exact for the piecewise linear curve, constant beyond its ends)
+def curve_integral(curve, x):
+    soc = curve[0].astype(float)
+    voltage = curve[1].astype(float)
+    width = np.diff(soc)
+    cumulative = np.concatenate([[0], np.cumsum((voltage[1:]+voltage[:-1])/2*width)])
+    x = np.asarray(x, dtype=float)
+    i = np.clip(np.searchsorted(soc, x, side='right')-1, 0, len(soc)-2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(width > 0, np.diff(voltage)/width, 0)[i]
+    dx = np.clip(x, soc[0], soc[-1]) - soc[i]
+    inside = cumulative[i] + voltage[i]*dx + slope*dx**2/2
+    below = voltage[0]*np.minimum(x-soc[0], 0)
+    above = voltage[-1]*np.maximum(x-soc[-1], 0)
+    return inside + below + above
+
+
+#Average full cell voltage over the N/P balanced window. A missing curve (None) uses the constant avgE.
+#Capacities are areal (any unit, same for both), all arguments broadcast against each other.
+def window_voltage(poscurve, negcurve, posavgE, negavgE, posarealcap, negarealcap, llifactor=1):
+    ratio = np.asarray(negarealcap/posarealcap, dtype=float) #N/P
+    window = llifactor*np.minimum(1, ratio) #cell capacity per positive capacity
+    negtop = np.minimum(1, ratio)/ratio
+    if poscurve is None:
+        posV = posavgE
+    else:
+        posV = (curve_integral(poscurve, 1) - curve_integral(poscurve, 1-window))/window
+    if negcurve is None:
+        negV = negavgE
+    else:
+        negV = ratio*(curve_integral(negcurve, negtop) - curve_integral(negcurve, negtop-window/ratio))/window
+    return posV - negV
@@ -0,0 +1,413 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.pyplot import figure
+import pandas as pd
+import pickle
+from pint import UnitRegistry
+import os
+from dotmap import DotMap
+import sys
+import functools
+
+from BotB_functions.fn_batch import *
+from BotB_functions.fn_spec import complete_floats
+
+
+# STREAMING DESIGN PIPELINE
+#   source -> composite completion -> cell evaluation -> metric extraction -> sinks
+# Chunks are dicts of kernel input arrays (fn_batch) plus 'index', the position of each design in the
+# sweep. Sources yield chunks lazily and every stage is a function chunk -> chunk, so a chunk is pulled
+# through the whole pipeline only when the sinks ask for the next one: memory is a few chunks whatever
+# the sweep size. Sinks reduce the stream: a results file, the top k designs or the Pareto front.
+#
+#   source = GridSource(cell_inputs(cell), {'diameter': np.linspace(1.8, 4.6, 1000),
+#                                           'pos_arealcap': np.linspace(2, 6, 1000)})
+#   top, front = run_pipeline(source, [complete_stage, functools.partial(cell_stage, format='cylindrical')],
+#                             [TopKSink(100, 'gravimetric_energy'),
+#                              ParetoSink(['gravimetric_energy', 'volumetric_energy'])])
+COMPLETION_KEYS = ['thick', 'arealload', 'density']
+
+
+# SOURCES
+#Full factorial grid over the values of each key, on top of base kernel inputs. Chunk i is generated from
+#its flat indices alone, so chunks can be made in any order and in worker processes.
+class GridSource:
+    def __init__(self, base, grid, chunksize=100000):
+        self.base = dict(base)
+        self.keys = list(grid)
+        self.values = [np.asarray(grid[key], dtype=float) for key in self.keys]
+        self.shape = tuple(len(values) for values in self.values)
+        self.size = int(np.prod(self.shape, dtype=np.int64))
+        self.chunksize = chunksize
+        self.nchunks = -(-self.size//chunksize)
+
+    def chunk(self, i):
+        index = np.arange(i*self.chunksize, min((i+1)*self.chunksize, self.size), dtype=np.int64)
+        chunk = dict(self.base)
+        for key, values, position in zip(self.keys, self.values, np.unravel_index(index, self.shape)):
+            chunk[key] = values[position]
+        chunk['index'] = index
+        return chunk
+
+    def __iter__(self):
+        for i in range(self.nchunks):
+            yield self.chunk(i)
+
+    def __len__(self):
+        return self.size
+
+
+#Chunks of a design table (fn_cli readers: .csv, .yaml, .parquet) on top of base kernel inputs
+def table_source(path, base, chunksize=100000):
+    from BotB_functions.fn_cli import read_designs, parse_column
+    unit = UnitRegistry()
+    start = 0
+    for frame in read_designs(path, chunksize):
+        chunk = dict(base)
+        for column in frame.columns:
+            key, factor = parse_column(column, unit)
+            chunk[key] = frame[column].to_numpy(dtype=float)*factor
+        chunk['index'] = np.arange(start, start+len(frame), dtype=np.int64)
+        start += len(frame)
+        yield chunk
+
+
+# STAGES
+#Composite completion: designs given by electrode thick, arealload or density (pos_/neg_ prefixes) get
+#the arealcap and porosity of the kernel, as make_composite would. Swept keys take the place of the
+#base arealcap or porosity: a thick alone keeps the porosity and changes the areal capacity.
+def complete_stage(chunk):
+    for prefix in ['pos', 'neg']:
+        if not any(prefix+'_'+key in chunk for key in COMPLETION_KEYS):
+            continue
+        given = {key: chunk.pop(prefix+'_'+key) for key in COMPLETION_KEYS if prefix+'_'+key in chunk}
+        if 'arealload' not in given and 'density' not in given:
+            given['porosity'] = chunk[prefix+'_porosity'] #thick alone
+        elif 'arealload' not in given and 'thick' not in given:
+            given['arealcap'] = chunk[prefix+'_arealcap'] #density alone
+        elif 'density' not in given and 'thick' not in given:
+            given['porosity'] = chunk[prefix+'_porosity'] #arealload alone
+        solid = batch_skeletal(chunk, prefix)*chunk[prefix+'_activefrac']
+        chunk[prefix+'_arealcap'], chunk[prefix+'_porosity'] = complete_floats(given, chunk[prefix+'_speccap'], solid)
+    return chunk
+
+
+#Cell evaluation: kernel results of a format added to the chunk
+def cell_stage(chunk, format):
+    n = len(chunk['index'])
+    out = batch_cell(format, chunk)
+    for key, value in out.items():
+        chunk[key] = np.broadcast_to(value, n)
+    return chunk
+
+
+#Metric extraction: only index and the given keys (inputs or results) go on to the sinks
+def metric_stage(chunk, keys):
+    n = len(chunk['index'])
+    reduced = {"index": chunk['index']}
+    for key in keys:
+        reduced[key] = np.broadcast_to(chunk[key], n)
+    return reduced
+
+
+def apply_stages(chunk, stages):
+    for stage in stages:
+        chunk = stage(chunk)
+    return chunk
+
+
+#Worker task: a GridSource chunk made and processed in the worker
+def source_task(source, i, stages):
+    return apply_stages(source.chunk(i), stages)
+
+
+#Processed chunks, pulled lazily. With workers, at most inflight*workers chunks are queued or done but
+#not yet consumed; chunks come out in source order either way. chunks picks chunk numbers of a GridSource.
+def pipeline(source, stages, workers=1, inflight=2, chunks=None):
+    if chunks is not None:
+        chunks = list(chunks)
+    if workers <= 1:
+        for chunk in (source if chunks is None else (source.chunk(i) for i in chunks)):
+            yield apply_stages(chunk, stages)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    from collections import deque
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        if hasattr(source, 'chunk'): #only chunk numbers cross to the workers
+            tasks = (functools.partial(source_task, source, i, stages)
+                     for i in (range(source.nchunks) if chunks is None else chunks))
+        else:
+            tasks = (functools.partial(apply_stages, chunk, stages) for chunk in source)
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.submit(task))
+            if len(pending) >= inflight*workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def run_pipeline(source, stages, sinks, workers=1, inflight=2, chunks=None):
+    for chunk in pipeline(source, stages, workers, inflight, chunks):
+        for sink in sinks:
+            sink.consume(chunk)
+    for sink in sinks:
+        sink.close()
+    return sinks
+
+
+# SINKS
+def chunk_frame(chunk):
+    n = len(chunk['index'])
+    return pd.DataFrame({key: np.broadcast_to(value, n) for key, value in chunk.items()
+                         if np.ndim(value) <= 1 and not key.endswith('_ocv')})
+
+
+#Every design to a results file (.csv or .parquet), optionally only some keys
+class FileSink:
+    def __init__(self, path, keys=None):
+        from BotB_functions.fn_cli import ResultWriter
+        self.writer = ResultWriter(path)
+        self.keys = keys
+
+    def consume(self, chunk):
+        if self.keys is not None:
+            chunk = metric_stage(chunk, self.keys)
+        self.writer.write(chunk_frame(chunk))
+
+    def close(self):
+        self.writer.close()
+
+
+#The k designs with the largest (or smallest) value of key. Holds at most 2k rows.
+class TopKSink:
+    def __init__(self, k, key, largest=True, keys=None):
+        self.k = k
+        self.key = key
+        self.largest = largest
+        self.keys = keys
+        self.best = None
+
+    def score(self, values):
+        score = values if self.largest else -values
+        return np.where(np.isnan(score), -np.inf, score)
+
+    #Only the best k rows of a chunk are copied out of it
+    def consume(self, chunk):
+        n = len(chunk['index'])
+        keys = self.keys if self.keys is not None else [key for key in chunk if key != 'index']
+        keys = ['index'] + list(dict.fromkeys([self.key] + [key for key in keys if not key.endswith('_ocv')]))
+        rows = np.arange(n)
+        if n > self.k: #rows above the kth score, then the first rows at it
+            score = self.score(np.broadcast_to(chunk[self.key], n))
+            kth = np.partition(score, n-self.k)[n-self.k]
+            above = np.nonzero(score > kth)[0]
+            rows = np.concatenate([above, np.nonzero(score == kth)[0][:self.k-len(above)]])
+        self.merge({key: np.broadcast_to(chunk[key], n)[rows] for key in keys})
+
+    def merge(self, rows):
+        if self.best is not None:
+            rows = {key: np.concatenate([self.best[key], rows[key]]) for key in self.best}
+        score = self.score(rows[self.key])
+        if len(score) > self.k:
+            keep = np.argpartition(-score, self.k-1)[:self.k]
+            rows = {key: value[keep] for key, value in rows.items()}
+            score = score[keep]
+        order = np.lexsort((rows['index'], -score)) #best first, ties by design index
+        self.best = {key: value[order] for key, value in rows.items()}
+
+    def result(self):
+        if self.best is None:
+            return pd.DataFrame()
+        return pd.DataFrame(self.best).set_index('index')
+
+    def close(self):
+        pass
+
+
+#Rows of values (n x m) not dominated by any other row, every objective maximized
+def pareto_mask(values):
+    n, m = values.shape
+    keep = np.zeros(n, dtype=bool)
+    valid = ~np.isnan(values).any(axis=1)
+    if m == 2: #sweep: sorted by the first objective, a point is on the front if it beats every point before
+        order = np.lexsort((-values[:, 1], -values[:, 0]))
+        order = order[valid[order]]
+        second = values[order, 1]
+        best = np.maximum.accumulate(np.concatenate([[-np.inf], second[:-1]]))
+        front = second > best
+        #equal points are all kept
+        same = np.concatenate([[False], (values[order[1:]] == values[order[:-1]]).all(axis=1)])
+        for i in np.nonzero(same)[0]:
+            front[i] = front[i-1]
+        keep[order[front]] = True
+        return keep
+    #a point can only be dominated by one with a larger sum: blocks in order of decreasing sum
+    order = np.argsort(-np.where(valid[:, None], values, 0).sum(axis=1), kind='stable')
+    order = order[valid[order]]
+    front = np.empty((0, m))
+    for start in range(0, len(order), 1024):
+        block = order[start:start+1024]
+        candidates = values[block]
+        dominated = np.zeros(len(block), dtype=bool)
+        for others in [front, candidates]:
+            if len(others) == 0:
+                continue
+            geq = (others[None, :, :] >= candidates[:, None, :]).all(axis=2)
+            gt = (others[None, :, :] > candidates[:, None, :]).any(axis=2)
+            dominated |= (geq & gt).any(axis=1)
+        keep[block[~dominated]] = True
+        front = np.concatenate([front, candidates[~dominated]])
+    return keep
+
+
+#Pareto front of the stream over objectives (maximized; 'min' in senses for minimized ones)
+class ParetoSink:
+    def __init__(self, objectives, senses=None, keys=None):
+        self.objectives = list(objectives)
+        self.signs = np.array([-1.0 if (senses or {}).get(key) == 'min' else 1.0 for key in self.objectives])
+        self.keys = keys
+        self.front = None
+
+    def consume(self, chunk):
+        keys = self.keys if self.keys is not None else [key for key in chunk if key != 'index']
+        chunk = metric_stage(chunk, list(dict.fromkeys(self.objectives + list(keys))))
+        rows = {key: np.asarray(value) for key, value in chunk.items()}
+        if self.front is not None:
+            rows = {key: np.concatenate([self.front[key], rows[key]]) for key in self.front}
+        values = np.stack([rows[key] for key in self.objectives], axis=1)*self.signs
+        keep = pareto_mask(values)
+        self.front = {key: value[keep] for key, value in rows.items()}
+
+    def result(self):
+        if self.front is None:
+            return pd.DataFrame()
+        return pd.DataFrame(self.front).set_index('index').sort_values(self.objectives[0], ascending=False)
+
+    def close(self):
+        pass
+
+
+#Sinks keep their reduced results; save them to csv or parquet
+def save_sink(sink, path):
+    from BotB_functions.fn_cli import ResultWriter
+    writer = ResultWriter(path)
+    writer.write(sink.result().reset_index())
+    writer.close()
+    return path
+
+
+# TOP-K SWEEPS
+#   best = sweep(source, 'cylindrical', 'gravimetric_energy', ['volumetric_energy >= 700', 'diameter <= 2.2'], k=100)
+# Objective and constraints are expressions over kernel inputs and results (kernel units) and numpy (np).
+# Constraints on inputs alone drop designs before the kernel runs, the others before any row is copied
+# out of the chunk. Each worker keeps its own top k over its share of the chunks; they are merged at the
+# end, so memory and output do not depend on the sweep size.
+SWEEP_NAMES = {"np": np, "abs": abs, "min": min, "max": max}
+
+
+#Compiled expression and the kernel names it uses (compiled once per process: selections only carry text)
+@functools.lru_cache(maxsize=None)
+def sweep_expression(text):
+    try:
+        code = compile(str(text), '<sweep>', 'eval')
+    except SyntaxError:
+        raise ValueError('Invalid sweep expression: ' + str(text))
+    names = [name for name in code.co_names if name not in SWEEP_NAMES]
+    return code, names
+
+
+def evaluate_expression(text, chunk):
+    n = len(chunk['index'])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.broadcast_to(eval(sweep_expression(text)[0], {"__builtins__": {}}, dict(SWEEP_NAMES, **chunk)), n)
+
+
+#Rows of a chunk where mask is true (shared inputs and OCV curves are kept as they are)
+def mask_chunk(chunk, mask):
+    n = len(chunk['index'])
+    return {key: value[mask] if np.ndim(value) == 1 and len(value) == n and not key.endswith('_ocv') else value
+            for key, value in chunk.items()}
+
+
+#Objective, constraints and what to keep for a top-k sweep
+class Selection:
+    def __init__(self, objective, constraints=(), k=100, largest=True, keys=None):
+        self.objective = str(objective)
+        self.constraints = [str(constraint) for constraint in constraints]
+        self.k = k
+        self.largest = largest
+        self.keys = keys
+        for text in [self.objective] + self.constraints:
+            sweep_expression(text)
+
+    #Constraints that only use the given (input) names, and the others
+    def split(self, names):
+        early = [text for text in self.constraints if all(name in names for name in sweep_expression(text)[1])]
+        return early, [text for text in self.constraints if text not in early]
+
+    def unknown(self, names):
+        used = [name for text in [self.objective] + self.constraints for name in sweep_expression(text)[1]]
+        return [name for name in dict.fromkeys(used) if name not in names]
+
+    def passing(self, chunk, constraints):
+        mask = np.ones(len(chunk['index']), dtype=bool)
+        for text in constraints:
+            mask &= evaluate_expression(text, chunk).astype(bool)
+        return mask
+
+    def sink(self):
+        return TopKSink(self.k, 'objective', self.largest, keys=self.keys)
+
+
+#A worker's top k over some chunks of a source: stages up to the kernel, then the selection
+def select_chunks(chunks, format, selection, stages=()):
+    sink = selection.sink()
+    for chunk in chunks:
+        chunk = apply_stages(chunk, stages)
+        early, late = selection.split(chunk)
+        chunk = mask_chunk(chunk, selection.passing(chunk, early))
+        if len(chunk['index']) == 0:
+            continue
+        chunk = cell_stage(chunk, format)
+        missing = selection.unknown(chunk)
+        if missing:
+            raise ValueError('Unknown sweep variables: ' + ', '.join(missing))
+        chunk = mask_chunk(chunk, selection.passing(chunk, late))
+        if len(chunk['index']) == 0:
+            continue
+        chunk['objective'] = evaluate_expression(selection.objective, chunk)
+        sink.consume(chunk)
+    return sink.best
+
+
+#Worker task: one chunk of a table source reduced to its top k
+def select_rows(chunk, format, selection, stages):
+    return select_chunks([chunk], format, selection, stages)
+
+
+#Worker task: every workers-th chunk of a GridSource, from chunk first
+def select_task(source, first, workers, format, selection, stages):
+    return select_chunks((source.chunk(i) for i in range(first, source.nchunks, workers)), format, selection, stages)
+
+
+#Best k designs of a source under constraints, as a DataFrame by design index (objective column included).
+#stages run before the kernel, e.g. [complete_stage]; keys are the columns kept (default all).
+def sweep(source, format, objective, constraints=(), k=100, largest=True, keys=None, stages=(), workers=1):
+    selection = Selection(objective, constraints, k, largest, keys)
+    sink = selection.sink()
+    if workers <= 1 or not hasattr(source, 'chunk'):
+        if workers > 1: #table sources: chunks are reduced to their own top k in the workers
+            results = [rows for rows in pipeline(source, [functools.partial(select_rows, format=format,
+                       selection=selection, stages=stages)], workers) if rows is not None]
+        else:
+            results = [select_chunks(source, format, selection, stages)]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(select_task, [source]*workers, range(workers), [workers]*workers,
+                                    [format]*workers, [selection]*workers, [stages]*workers))
+    for rows in results:
+        if rows is not None:
+            sink.merge(rows)
+    return sink.result()
@@ -0,0 +1,225 @@
+import numpy as np
+import pandas as pd
+import os
+import sys
+import time
+import json
+import functools
+import contextlib
+
+
+# OPTIONAL INSTRUMENTATION OF THE CELL BUILDERS
+# Stages are timed with `with stage('name'):` blocks or the @profiled decorator. While profiling is
+# disabled (the default) stage() hands back a shared no-op context and @profiled calls straight
+# through, so the builders pay one flag check per stage. count('name', n) adds to a named counter:
+# the builders count the cells of each format, kernel designs and composite estimates merged
+# (the merge of their uncertainties is the 'uncertainty' stage). Every pint unit conversion made while
+# profiling, wherever it happens, is timed as a 'pint conversions' stage under the stage that made it
+# (enable_profiling(conversions=False) leaves pint untouched).
+#
+#   enable_profiling(allocations=True)
+#   cell = make_cylindrical(...)
+#   print(profile_report())
+#   export_trace('cell.json')  #open in https://ui.perfetto.dev or chrome://tracing
+
+_state = {
+    "enabled": False,
+    "allocations": False, #track net allocated memory blocks and bytes (tracemalloc) per stage
+    "tracemalloc": False, #tracemalloc was started here, not by the caller
+    "stack": [],
+    "children": [], #time (ns) spent in the children of each open stage
+    "events": [],
+    "counts": {},
+    "conversions": {}, #original pint conversion methods while they are timed
+}
+CONVERSION_METHODS = ['to', 'ito', '_convert_magnitude', '_convert_magnitude_not_inplace']
+_nullstage = contextlib.nullcontext()
+
+
+def enable_profiling(allocations=False, conversions=True):
+    _state['enabled'] = True
+    _state['allocations'] = allocations
+    if conversions:
+        time_conversions(True)
+    if allocations:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _state['tracemalloc'] = True
+
+
+def disable_profiling():
+    _state['enabled'] = False
+    time_conversions(False)
+    if _state['tracemalloc']:
+        import tracemalloc
+        tracemalloc.stop()
+    _state['allocations'] = False
+    _state['tracemalloc'] = False
+
+
+def reset_profiling():
+    _state['stack'] = []
+    _state['children'] = []
+    _state['events'] = []
+    _state['counts'] = {}
+
+
+def profiling_enabled():
+    return _state['enabled']
+
+
+class _Stage:
+    __slots__ = ('name', 'start', 'blocks', 'bytes')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        _state['stack'].append(self.name)
+        _state['children'].append(0)
+        if _state['allocations']:
+            import tracemalloc
+            self.blocks = sys.getallocatedblocks()
+            self.bytes = tracemalloc.get_traced_memory()[0]
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        children = _state['children'].pop()
+        if _state['children']:
+            _state['children'][-1] += end-self.start
+        event = {
+            "name": self.name,
+            "path": ';'.join(_state['stack']),
+            "start": self.start,
+            "duration": end-self.start,
+            "self": end-self.start-children,
+            "depth": len(_state['stack'])-1,
+        }
+        if _state['allocations']:
+            import tracemalloc
+            event['blocks'] = sys.getallocatedblocks()-self.blocks
+            event['bytes'] = tracemalloc.get_traced_memory()[0]-self.bytes
+        _state['stack'].pop()
+        _state['events'].append(event)
+        return False
+
+
+#Pint unit conversions, explicit (to, ito) or inside arithmetic on mixed units, timed as one
+#'pint conversions' stage by wrapping the conversion methods of pint quantities while profiling
+def pint_quantity():
+    try:
+        from pint.quantity import Quantity
+    except ImportError: #pint >= 0.20
+        from pint.facets.plain import PlainQuantity as Quantity
+    return Quantity
+
+
+def time_conversions(on):
+    Quantity = pint_quantity()
+    if not on:
+        for method, original in _state['conversions'].items():
+            setattr(Quantity, method, original)
+        _state['conversions'] = {}
+        return
+    for method in CONVERSION_METHODS:
+        if method in _state['conversions'] or not hasattr(Quantity, method):
+            continue
+        original = getattr(Quantity, method)
+
+        def timed(self, *args, original=original, **kwargs):
+            if not _state['enabled'] or (_state['stack'] and _state['stack'][-1] == 'pint conversions'):
+                return original(self, *args, **kwargs) #a conversion within a conversion
+            with _Stage('pint conversions'):
+                return original(self, *args, **kwargs)
+        _state['conversions'][method] = original
+        setattr(Quantity, method, functools.wraps(original)(timed))
+
+
+#Context manager timing a named stage
+def stage(name):
+    if not _state['enabled']:
+        return _nullstage
+    return _Stage(name)
+
+
+#Increment a named counter (cells built, estimates merged, ...), reported next to the stages
+def count(name, n=1):
+    if _state['enabled']:
+        _state['counts'][name] = _state['counts'].get(name, 0) + n
+
+
+#Decorator timing every call of a function as a stage
+def profiled(fn=None, name=None):
+    if fn is None:
+        return lambda fn: profiled(fn, name=name)
+    stagename = name or fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not _state['enabled']:
+            return fn(*args, **kwargs)
+        with _Stage(stagename):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+# REPORTING
+#Per stage: calls, total/self/mean/max time (ms) and, when tracked, net allocations
+def profile_report(by='name'):
+    events = _state['events']
+    if len(events) == 0:
+        return pd.DataFrame(columns=['calls','total_ms','self_ms','mean_ms','max_ms'])
+    frame = pd.DataFrame(events)
+    grouped = frame.groupby(by)
+    report = pd.DataFrame({
+        "calls": grouped['duration'].count(),
+        "total_ms": grouped['duration'].sum()/1e6,
+        "self_ms": grouped['self'].sum()/1e6,
+        "mean_ms": grouped['duration'].mean()/1e6,
+        "max_ms": grouped['duration'].max()/1e6,
+    })
+    if 'blocks' in frame:
+        report['blocks'] = grouped['blocks'].sum()
+        report['bytes'] = grouped['bytes'].sum()
+    if by == 'name':
+        for name, n in _state['counts'].items(): #counters without a stage get a row of their own
+            report.loc[name, 'count'] = n
+    return report.sort_values('total_ms', ascending=False)
+
+
+def profile_counts():
+    return dict(_state['counts'])
+
+
+#Chrome trace event format (Perfetto, chrome://tracing, speedscope)
+def export_trace(filename):
+    events = _state['events']
+    t0 = min([event['start'] for event in events]) if events else 0
+    trace = []
+    for event in events:
+        entry = {
+            "name": event['name'],
+            "ph": 'X',
+            "ts": (event['start']-t0)/1e3, #us
+            "dur": event['duration']/1e3,
+            "pid": os.getpid(),
+            "tid": 0,
+        }
+        if 'blocks' in event:
+            entry['args'] = {'blocks': event['blocks'], 'bytes': event['bytes']}
+        trace.append(entry)
+    with open(filename, 'w') as f:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+    return filename
+
+
+#Collapsed stacks ("a;b;c self_us") for flamegraph.pl / speedscope
+def export_collapsed(filename):
+    report = profile_report(by='path')
+    with open(filename, 'w') as f:
+        for path, row in report.iterrows():
+            f.write(path + ' ' + str(int(round(row['self_ms']*1e3))) + '\n')
+    return filename
@@ -0,0 +1,177 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.pyplot import figure
+import pandas as pd
+import pickle
+from pint import UnitRegistry
+import os
+from dotmap import DotMap
+import sys
+
+from BotB_functions.fn_batch import *
+
+
+# RATE CAPABILITY AND POWER
+# Transport limited estimate on top of the float kernel (batch_cell):
+#   tortuosity      Bruggeman, tau = eps**(1-b), effective conductivity kappa*eps**b
+#   rate limit      salt depletion across each electrode, i_lim = 2*eps*D*c*F/(tau*L*(1-t+)),
+#                   C_lim = i_lim/areal capacity; above C_lim only C_lim/C of the capacity is usable
+#   power           pulse power at vmin through the area specific resistance of one
+#                   positive | separator | negative stack: L*tau/(3*kappa*eps) per electrode
+#                   (uniform reaction), L*tau/(kappa*eps) for the separator (L/sigma for a solid
+#                   electrolyte separator), plus asrextra (charge transfer, SEI, contacts)
+# Every input can be an array, so thickness/porosity grids give energy vs power maps in one call.
+RATE_DEFAULTS = {
+    "conductivity": 10.0, #mS/cm
+    "diffusivity": 3e-6, #cm2/s salt diffusivity
+    "transference": 0.38, #Li+ transference number
+    "elyte_conc": 1.1, #mol/L
+    "bruggeman": 1.5,
+    "asrextra": 10.0, #ohm cm2
+    "vmin": 2.5, #V
+    "crate": 1.0, #1/hr
+}
+
+RATE_UNITS = {
+    "conductivity": 'mS/cm',
+    "diffusivity": 'cm**2/s',
+    "transference": 'dimensionless',
+    "elyte_conc": 'mol/L',
+    "bruggeman": 'dimensionless',
+    "asrextra": 'ohm*cm**2',
+    "vmin": 'V',
+    "crate": '1/hr',
+    "tau_pos": 'dimensionless',
+    "tau_neg": 'dimensionless',
+    "tau_sep": 'dimensionless',
+    "climit_pos": '1/hr',
+    "climit_neg": '1/hr',
+    "climit": '1/hr',
+    "usable_fraction": 'dimensionless',
+    "usable_capacity": 'A*hr',
+    "usable_energy": 'W*hr',
+    "asr": 'ohm*cm**2',
+    "power": 'W',
+    "gravimetric_power": 'W/kg',
+    "volumetric_power": 'W/L',
+}
+
+FARADAY = 96485.33 #C/mol
+
+
+def rate_unit(key):
+    if key in RATE_UNITS:
+        return RATE_UNITS[key]
+    return kernel_unit(key)
+
+
+def bruggeman_tortuosity(porosity, b=1.5):
+    return np.asarray(porosity, dtype=float)**(1-b)
+
+
+#Salt depletion limited C-rate (1/hr) of one electrode; thick in cm, arealcap in mAh/cm2
+def limiting_crate(thick, porosity, arealcap, r):
+    tau = bruggeman_tortuosity(porosity, r['bruggeman'])
+    conc = r['elyte_conc']/1000 #mol/cm3
+    ilim = 2*porosity*r['diffusivity']*conc*FARADAY/(tau*thick*(1-r['transference'])) #A/cm2
+    return ilim/(arealcap/1000) #A/cm2 / Ah/cm2
+
+
+#Usable fraction of the capacity at a C-rate
+def usable_fraction(crate, climit):
+    return np.minimum(1, climit/np.maximum(crate, 1e-12))
+
+
+def batch_rate(format, p):
+    r = dict(RATE_DEFAULTS)
+    r.update({key: p[key] for key in RATE_DEFAULTS if key in p})
+    out = batch_cell(format, p)
+    ncoat = CELL_FORMATS[format]['ncoat']
+    b = r['bruggeman']
+    kappa = r['conductivity']/1000 #S/cm
+    posthick, posdens = batch_composite(p, 'pos')
+    negthick, negdens = batch_composite(p, 'neg')
+
+    #Rate limit. A lithium metal negative is dense: no salt depletion and no pore resistance in it
+    lithium = np.asarray(p.get('neg_lithium', 0)) >= 0.5
+    negporosity = np.asarray(p['neg_porosity'], dtype=float)
+    climit_pos = limiting_crate(posthick, p['pos_porosity'], p['pos_arealcap'], r)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        climit_neg = np.where(lithium, np.inf, limiting_crate(negthick, negporosity, p['neg_arealcap'], r))
+        negasr = np.where(lithium, 0, negthick/(3*kappa*negporosity**b))
+        tau_neg = bruggeman_tortuosity(negporosity, b)
+    climit = np.minimum(climit_pos, climit_neg)
+    fraction = usable_fraction(r['crate'], climit)
+
+    #Area specific resistance and pulse power
+    #A solid electrolyte separator conducts through the solid (sep_conductivity)
+    solid = np.asarray(p.get('sep_solid', 0)) >= 0.5
+    sepporosity = np.asarray(p['sep_porosity'], dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sepasr = np.where(solid, p['sep_thick']/(p.get('sep_conductivity', np.nan)/1000),
+                          p['sep_thick']/(kappa*sepporosity**b))
+        tau_sep = bruggeman_tortuosity(sepporosity, b)
+    asr = posthick/(3*kappa*p['pos_porosity']**b) + negasr + sepasr + r['asrextra']
+    current = np.maximum(out['avgE']-r['vmin'], 0)/asr #A/cm2
+    power = r['vmin']*current*ncoat*out['jlarea']
+
+    out['tau_pos'] = bruggeman_tortuosity(p['pos_porosity'], b)
+    out['tau_neg'] = tau_neg
+    out['tau_sep'] = tau_sep
+    out['climit_pos'] = climit_pos
+    out['climit_neg'] = climit_neg
+    out['climit'] = climit
+    out['usable_fraction'] = fraction
+    out['usable_capacity'] = fraction*out['capacity']
+    out['usable_energy'] = fraction*out['energy']
+    out['asr'] = asr
+    out['power'] = power
+    out['gravimetric_power'] = 1000*power/out['mass_total'] #W/g -> W/kg
+    out['volumetric_power'] = 1000*power/out['volume'] #W/cm3 -> W/L
+    return out
+
+
+#Usable capacity of one design over a list of C-rates
+def rate_curve(format, p, crates):
+    crates = np.asarray(crates, dtype=float)
+    out = batch_rate(format, dict(p, crate=crates))
+    curve = pd.DataFrame({
+        "crate": crates,
+        "usable_fraction": np.broadcast_to(out['usable_fraction'], crates.shape),
+        "usable_capacity": np.broadcast_to(out['usable_capacity'], crates.shape),
+        "usable_energy": np.broadcast_to(out['usable_energy'], crates.shape),
+    })
+    return curve
+
+
+#Rate inputs of a built cell: the electrolyte concentration and, if the electrolyte came from the
+#property library (fn_electrolyte), its conductivity
+def rate_inputs(cell):
+    unit = cell.unit
+    p = cell_inputs(cell)
+    electrolyte = cell.cellstack.electrolyte
+    p['elyte_conc'] = float(get_nominal(electrolyte.concentration.to(unit(RATE_UNITS['elyte_conc']))))
+    if 'conductivity' in electrolyte:
+        p['conductivity'] = float(get_nominal(electrolyte.conductivity.to(unit(RATE_UNITS['conductivity']))))
+    return p
+
+
+#Rate capability of a built cell. Options are pint quantities or numbers in RATE_UNITS, e.g. crate=3/unit.hr
+def cell_rate(cell, **kwargs):
+    unit = cell.unit
+    p = rate_inputs(cell)
+    for key, value in kwargs.items():
+        if key not in RATE_DEFAULTS:
+            raise ValueError('Unknown rate property: ' + str(key))
+        try:
+            value = value.to(unit(RATE_UNITS[key]))
+        except AttributeError: #plain number in RATE_UNITS
+            p[key] = value
+            continue
+        p[key] = get_nominal(value)
+    out = batch_rate(cell.format, p)
+    rate = DotMap()
+    for key in RATE_UNITS:
+        if key in out:
+            rate[key] = out[key]*unit(rate_unit(key))
+    return rate
@@ -0,0 +1,276 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.pyplot import figure
+import pandas as pd
+import pickle
+from pint import UnitRegistry
+import os
+from dotmap import DotMap
+import sys
+
+from BotB_functions.fn_batch import *
+from BotB_functions.fn_hash import mix64, text_hash
+
+
+# DESIGN OF EXPERIMENTS SAMPLERS
+# Designs spread over ranges of kernel inputs instead of a full factorial grid:
+#   'uniform'   independent uniform random
+#   'lhs'       Latin hypercube: each input hits every one of the n strata exactly once
+#   'sobol'     Sobol low discrepancy sequence (Joe-Kuo direction numbers), scrambled by a random linear
+#               matrix and digital shift; balanced for n a power of 2, up to 32 inputs
+# Every sampler is counter based: row i of a seeded sample is the same whatever the chunk it is made in,
+# so 10^7 designs come in chunks (SampleSource, fn_pipeline) or at once, vectorized, without loops over rows.
+# seed=None draws a fresh seed for each sample (SampleSource keeps it as .seed to reproduce the sample).
+# bounds map kernel inputs to (low, high) in kernel units (pint quantities are converted), (low, high, 'log')
+# samples evenly in log. Integer inputs (nlayers, nrolls) take whole values from low to high.
+#   p = sample_designs(reference_inputs('cylindrical'), {'diameter': (1.8, 4.6), 'height': (6, 14),
+#                      'pos_arealcap': (2, 6), 'pos_porosity': (0.2, 0.4)}, 2**20, 'sobol', seed=1)
+#   out = batch_cell('cylindrical', p)
+SAMPLERS = ['uniform', 'lhs', 'sobol']
+INTEGER_KEYS = ['nlayers', 'nrolls']
+
+#Joe-Kuo new-joe-kuo-6.21201 direction numbers of dimensions 2 to 32: degree s, coefficients a, initial m
+SOBOL_DIRECTIONS = [
+    (1, 0, [1]),
+    (2, 1, [1, 3]),
+    (3, 1, [1, 3, 1]),
+    (3, 2, [1, 1, 1]),
+    (4, 1, [1, 1, 3, 3]),
+    (4, 4, [1, 3, 5, 13]),
+    (5, 2, [1, 1, 5, 5, 17]),
+    (5, 4, [1, 1, 5, 5, 5]),
+    (5, 7, [1, 1, 7, 11, 19]),
+    (5, 11, [1, 1, 5, 1, 1]),
+    (5, 13, [1, 1, 1, 3, 11]),
+    (5, 14, [1, 3, 5, 5, 31]),
+    (6, 1, [1, 3, 3, 9, 7, 49]),
+    (6, 13, [1, 1, 1, 15, 21, 21]),
+    (6, 16, [1, 3, 1, 13, 27, 49]),
+    (6, 19, [1, 1, 1, 15, 7, 5]),
+    (6, 22, [1, 3, 1, 15, 13, 25]),
+    (6, 25, [1, 1, 5, 5, 19, 61]),
+    (7, 1, [1, 3, 7, 11, 23, 15, 103]),
+    (7, 4, [1, 3, 7, 13, 13, 15, 69]),
+    (7, 7, [1, 1, 3, 13, 7, 35, 63]),
+    (7, 8, [1, 3, 5, 9, 1, 25, 53]),
+    (7, 14, [1, 3, 1, 13, 9, 35, 107]),
+    (7, 19, [1, 3, 1, 5, 27, 61, 31]),
+    (7, 21, [1, 1, 5, 11, 19, 41, 61]),
+    (7, 28, [1, 3, 5, 3, 3, 13, 69]),
+    (7, 31, [1, 1, 7, 13, 1, 19, 1]),
+    (7, 32, [1, 3, 7, 5, 13, 19, 59]),
+    (7, 37, [1, 1, 3, 9, 25, 29, 41]),
+    (7, 41, [1, 3, 5, 13, 23, 1, 55]),
+    (7, 42, [1, 3, 7, 3, 13, 59, 17]),
+]
+SOBOL_BITS = 32
+
+
+#Seed of a sample: seed=None draws a fresh 64 bit seed from OS entropy, once per sample (rows of a
+#sample made in parts, start/count, must share its seed)
+def sample_seed(seed, start=0, count=None):
+    if seed is not None:
+        return seed
+    if start or count is not None:
+        raise ValueError('Unspecified seed for part of a sample: pass the seed of the whole sample.')
+    return int(np.random.SeedSequence().entropy) & (2**64-1)
+
+
+#Random 64 bit words from a seed, a stream name and counters (splitmix64: same counters, same words)
+def random_words(seed, stream, counter):
+    key = mix64(np.uint64(seed) ^ text_hash(stream))
+    with np.errstate(over='ignore'):
+        return mix64(np.asarray(counter, dtype=np.uint64)*np.uint64(0x9e3779b97f4a7c15) + key)
+
+
+def random_unit(seed, stream, counter):
+    return (random_words(seed, stream, counter) >> np.uint64(11)).astype(np.float64)*2.0**-53
+
+
+def sample_rows(start, count, d):
+    return (np.arange(start, start+count, dtype=np.uint64)[:, None]*np.uint64(d)
+            + np.arange(d, dtype=np.uint64)[None, :])
+
+
+# UNIFORM
+def uniform_unit(n, d, seed=None, start=0, count=None):
+    seed = sample_seed(seed, start, count)
+    count = n-start if count is None else count
+    return random_unit(seed, 'uniform', sample_rows(start, count, d))
+
+
+# LATIN HYPERCUBE
+#Random permutation of range(n) at rows (a seeded Feistel network on 32 bit words, cycle walking back into range)
+def permute(rows, n, seed, stream):
+    if n > 2**32:
+        raise ValueError('Latin hypercube sampling supports up to 2**32 samples.')
+    half = max(1, (int(n-1).bit_length()+1)//2)
+    mask = np.uint32((1 << half) - 1)
+    keys = [np.uint32(int(random_words(seed, stream, r)) >> 32) for r in range(4)]
+    x = np.array(rows, dtype=np.uint32)
+    todo = np.arange(len(x))
+    first = True
+    while len(todo):
+        y = x if first else x[todo]
+        left, right = y >> np.uint32(half), y & mask
+        with np.errstate(over='ignore'):
+            for key in keys: #multiplicative hash rounds
+                left, right = right, left ^ (((right ^ key)*np.uint32(0x9e3779b9)) >> np.uint32(32-half))
+        y = (left << np.uint32(half)) | right
+        if first:
+            x = y
+            todo = np.nonzero(x >= n)[0]
+            first = False
+        else:
+            x[todo] = y
+            todo = todo[y >= n]
+    return x
+
+
+def lhs_unit(n, d, seed=None, start=0, count=None):
+    seed = sample_seed(seed, start, count)
+    count = n-start if count is None else count
+    rows = np.arange(start, start+count, dtype=np.uint64)
+    jitter = random_unit(seed, 'lhs jitter', sample_rows(start, count, d))
+    x = np.empty((count, d))
+    for j in range(d):
+        x[:, j] = (permute(rows, n, seed, 'lhs ' + str(j)).astype(np.float64) + jitter[:, j])/n
+    return x
+
+
+# SOBOL
+#Direction numbers (SOBOL_BITS bit fractions) of d dimensions, shape (bits, d)
+def sobol_directions(d):
+    if d > len(SOBOL_DIRECTIONS)+1:
+        raise ValueError('Sobol sampling supports up to ' + str(len(SOBOL_DIRECTIONS)+1) + ' parameters.')
+    v = np.zeros((SOBOL_BITS, d), dtype=np.uint64)
+    v[:, 0] = [1 << (SOBOL_BITS-1-b) for b in range(SOBOL_BITS)] #van der Corput
+    for j in range(1, d):
+        s, a, m = SOBOL_DIRECTIONS[j-1]
+        m = list(m)
+        for b in range(s, SOBOL_BITS):
+            value = m[b-s] ^ (m[b-s] << s)
+            for k in range(1, s):
+                if (a >> (s-1-k)) & 1:
+                    value ^= m[b-k] << k
+            m.append(value)
+        v[:, j] = [m[b] << (SOBOL_BITS-1-b) for b in range(SOBOL_BITS)]
+    return v
+
+
+#Linear matrix scrambling: a random lower triangular bit matrix with unit diagonal per dimension
+def scramble_directions(v, seed):
+    bits, d = v.shape
+    scrambled = np.zeros_like(v)
+    for j in range(d):
+        words = random_words(seed, 'sobol scramble ' + str(j), np.arange(SOBOL_BITS))
+        for k in range(SOBOL_BITS): #output bit k (from the top) mixes input bits above it, and bit k itself
+            above = (int(words[k]) >> (64-SOBOL_BITS)) & (((1 << k) - 1) << (SOBOL_BITS-k))
+            row = np.uint64(above | (1 << (SOBOL_BITS-1-k)))
+            masked = v[:, j] & row
+            for shift in [32, 16, 8, 4, 2, 1]:
+                masked = masked ^ (masked >> np.uint64(shift))
+            parity = masked & np.uint64(1)
+            scrambled[:, j] |= parity << np.uint64(SOBOL_BITS-1-k)
+    return scrambled
+
+
+def sobol_unit(n, d, seed=None, start=0, count=None, scramble=True):
+    seed = sample_seed(seed, start, count)
+    count = n-start if count is None else count
+    if start+count > 2**SOBOL_BITS:
+        raise ValueError('Sobol sampling supports up to 2**' + str(SOBOL_BITS) + ' samples.')
+    v = sobol_directions(d)
+    if scramble:
+        v = scramble_directions(v, seed)
+    index = np.arange(start, start+count, dtype=np.uint64)
+    x = np.zeros((count, d), dtype=np.uint64)
+    for byte in range(SOBOL_BITS//8): #xor of the directions of each set bit, 8 bits per table lookup
+        table = np.zeros((256, d), dtype=np.uint64)
+        for b in range(8):
+            has = ((np.arange(256) >> b) & 1).astype(bool)
+            table[has] ^= v[8*byte+b]
+        x ^= table[(index >> np.uint64(8*byte)) & np.uint64(255)]
+    if scramble:
+        x ^= random_words(seed, 'sobol shift', np.arange(d)) >> np.uint64(64-SOBOL_BITS)
+    return x.astype(np.float64)*2.0**-SOBOL_BITS
+
+
+SAMPLE_UNITS = {
+    "uniform": uniform_unit,
+    "lhs": lhs_unit,
+    "sobol": sobol_unit,
+}
+
+
+# KERNEL INPUTS
+#(low, high, scale) of each bound in kernel units
+def sample_bounds(bounds, unit=None):
+    parsed = {}
+    for key, bound in bounds.items():
+        if len(bound) not in [2, 3] or (len(bound) == 3 and bound[2] not in ['linear', 'log']):
+            raise ValueError('Sample bounds are (low, high) or (low, high, "log"): ' + str(key))
+        low, high = [to_kernel(value, key, unit or getattr(value, '_REGISTRY', None)) for value in bound[:2]]
+        scale = bound[2] if len(bound) == 3 else 'linear'
+        if high < low or (scale == 'log' and low <= 0):
+            raise ValueError('Invalid sample bounds: ' + str(key))
+        parsed[key] = (low, high, scale)
+    return parsed
+
+
+#Unit samples (n x d) mapped to the bounds, one array per input
+def scale_samples(x, bounds):
+    samples = {}
+    for j, (key, (low, high, scale)) in enumerate(bounds.items()):
+        if key in INTEGER_KEYS:
+            samples[key] = np.minimum(np.floor(low + (high-low+1)*x[:, j]), high)
+        elif scale == 'log':
+            samples[key] = np.exp(np.log(low) + (np.log(high)-np.log(low))*x[:, j])
+        else:
+            samples[key] = low + (high-low)*x[:, j]
+    return samples
+
+
+#Rows start to start+count of a seeded sample of n designs over bounds, in kernel units
+def sample_inputs(bounds, n, method='sobol', seed=None, start=0, count=None):
+    if method not in SAMPLE_UNITS:
+        raise ValueError('Unknown sampler: ' + str(method))
+    bounds = sample_bounds(bounds)
+    return scale_samples(SAMPLE_UNITS[method](n, len(bounds), seed, start, count), bounds)
+
+
+#Kernel inputs for batch_cell: base inputs with the sampled ones replaced
+def sample_designs(base, bounds, n, method='sobol', seed=None):
+    p = dict(base)
+    p.update(sample_inputs(bounds, n, method, seed))
+    return p
+
+
+#Sampled designs as chunks for fn_pipeline (run_pipeline, sweep), made from their row numbers alone
+class SampleSource:
+    def __init__(self, base, bounds, n, method='sobol', seed=None, chunksize=100000):
+        if method not in SAMPLE_UNITS:
+            raise ValueError('Unknown sampler: ' + str(method))
+        self.base = dict(base)
+        self.bounds = sample_bounds(bounds)
+        self.size = int(n)
+        self.method = method
+        self.seed = sample_seed(seed) #drawn here for seed=None, so every chunk is of the same sample
+        self.chunksize = chunksize
+        self.nchunks = -(-self.size//chunksize)
+
+    def chunk(self, i):
+        start = i*self.chunksize
+        count = min(self.chunksize, self.size-start)
+        chunk = dict(self.base)
+        chunk.update(scale_samples(SAMPLE_UNITS[self.method](self.size, len(self.bounds), self.seed, start, count),
+                                   self.bounds))
+        chunk['index'] = np.arange(start, start+count, dtype=np.int64)
+        return chunk
+
+    def __iter__(self):
+        for i in range(self.nchunks):
+            yield self.chunk(i)
+
+    def __len__(self):
+        return self.size
@@ -0,0 +1,104 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.pyplot import figure
+import pandas as pd
+import pickle
+from pint import UnitRegistry
+import os
+from dotmap import DotMap
+import sys
+
+from BotB_functions.fn_batch import *
+
+
+# LOCAL SENSITIVITY
+# Partial derivatives and normalised elasticities (dY/dX * X/Y) of the energy densities with respect
+# to every kernel input, from central finite differences evaluated as one batch.
+# Composite inputs are perturbed at fixed areal capacity: thickness and density follow from
+# activefrac and porosity as in complete_composite.
+def batch_sensitivity(format, p, params=None, relstep=1e-6,
+                      outputs=('gravimetric_energy','volumetric_energy')):
+    if params is None:
+        params = numeric_keys(p)
+    nparams = len(params)
+
+    #Row 0 is the nominal design, rows 2i+1 and 2i+2 are the +/- steps of parameter i
+    batch = batch_inputs(p, 2*nparams+1)
+    steps = np.zeros(nparams)
+    for i, key in enumerate(params):
+        x = p[key]
+        step = relstep*abs(x) if x != 0 else relstep
+        steps[i] = step
+        batch[key][2*i+1] = x + step
+        batch[key][2*i+2] = x - step
+    out = batch_cell(format, batch)
+
+    sens = pd.DataFrame(index=params)
+    sens['value'] = [p[key] for key in params]
+    sens['unit'] = [kernel_unit(key) for key in params]
+    for name in outputs:
+        y = out[name]
+        deriv = (y[1::2]-y[2::2])/(2*steps)
+        sens['d_'+name] = deriv
+        sens['e_'+name] = deriv*sens['value'].values/y[0]
+    sens = sens.reindex(sens['e_'+outputs[0]].abs().sort_values(ascending=False).index)
+    return sens
+
+
+def cell_sensitivity(cell, params=None, relstep=1e-6):
+    return batch_sensitivity(cell.format, cell_inputs(cell), params=params, relstep=relstep)
+
+
+# GLOBAL (VARIANCE-BASED) SENSITIVITY
+# First order and total Sobol indices (Saltelli 2010 / Jansen estimators). Every input in bounds is
+# sampled uniformly between (low, high) in kernel units, everything else stays at its value in p.
+# The N*(k+2) model evaluations are done in a single batch.
+def batch_sobol(format, p, bounds, nsamples=4096, seed=None,
+                outputs=('gravimetric_energy','volumetric_energy')):
+    params = list(bounds.keys())
+    nparams = len(params)
+    rng = np.random.default_rng(seed)
+    low = np.array([bounds[key][0] for key in params], dtype=float)
+    high = np.array([bounds[key][1] for key in params], dtype=float)
+    A = low + (high-low)*rng.random((nsamples, nparams))
+    B = low + (high-low)*rng.random((nsamples, nparams))
+
+    #Stack A, B and the k matrices AB_i (A with column i taken from B)
+    X = np.empty(((nparams+2)*nsamples, nparams))
+    X[:nsamples] = A
+    X[nsamples:2*nsamples] = B
+    for i in range(nparams):
+        AB = A.copy()
+        AB[:, i] = B[:, i]
+        X[(i+2)*nsamples:(i+3)*nsamples] = AB
+
+    batch = batch_inputs(p, len(X))
+    for i, key in enumerate(params):
+        batch[key] = X[:, i]
+    out = batch_cell(format, batch)
+
+    sobol = pd.DataFrame(index=params)
+    sobol['low'] = low
+    sobol['high'] = high
+    for name in outputs:
+        y = out[name].reshape(nparams+2, nsamples)
+        y = y - np.mean(y[:2]) #centring reduces the estimator variance
+        yA = y[0]
+        yB = y[1]
+        var = np.var(np.concatenate([yA, yB]))
+        S1 = np.empty(nparams)
+        ST = np.empty(nparams)
+        for i in range(nparams):
+            yAB = y[i+2]
+            S1[i] = np.mean(yB*(yAB-yA))/var
+            ST[i] = 0.5*np.mean((yA-yAB)**2)/var
+        sobol['S1_'+name] = S1
+        sobol['ST_'+name] = ST
+    return sobol
+
+
+#Sobol indices of a built cell, sampling each listed parameter within +/- spread (fraction) of its value
+def cell_sobol(cell, params, spread=0.1, nsamples=4096, seed=None):
+    p = cell_inputs(cell)
+    bounds = {key: (p[key]*(1-spread), p[key]*(1+spread)) for key in params}
+    return batch_sobol(cell.format, p, bounds, nsamples=nsamples, seed=seed)
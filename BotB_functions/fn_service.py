@@ -0,0 +1,408 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.pyplot import figure
+import pandas as pd
+import pickle
+from pint import UnitRegistry
+import os
+from dotmap import DotMap
+import sys
+import json
+import time
+import asyncio
+import collections
+
+from BotB_functions.fn_spec import *
+from BotB_functions.fn_cellanalysis import gravimetric_energy, volumetric_energy
+
+
+# LOCAL CALCULATION SERVICE
+#   python -m BotB_functions.fn_service serve [--port 8050]
+#   python -m BotB_functions.fn_service bench [--port 8050] [--concurrency 64] [--requests 20000] [--spawn]
+# A small HTTP/1.1 server (asyncio, no web framework needed) around the cell specs of fn_spec:
+#   POST /cell    a spec -> {"name", "format", results in KERNEL_UNITS}
+#   POST /cells   a list of specs -> list of results
+#   GET  /stats   requests, cache hits, batches and mean batch size
+#   GET  /health
+# Concurrent requests are queued and evaluated together: the batcher takes whatever is waiting, up to
+# max_batch designs, waiting at most max_wait seconds for more after the first, and runs them through
+# batch_cell in one call. Results are cached (LRU) on the compiled design, so the same cell written
+# with other units or key order is a hit.
+# With "uncertainty": true in a spec the cell is built with the pint builders (make_cylindrical,
+# make_pouch, make_24Mpouch through spec_cell) and the energy densities come from gravimetric_energy
+# and volumetric_energy as {"nominal", "std"}. These are not batched.
+SERVICE_OUTPUTS = ['capacity', 'energy', 'avgE', 'NPratio', 'mass_total', 'volume',
+                   'gravimetric_energy', 'volumetric_energy']
+
+HTTP_STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large'}
+
+
+#Cache key of a compiled cell: format and every input in kernel units
+def design_key(cell):
+    items = []
+    for key in sorted(cell['inputs']):
+        value = cell['inputs'][key]
+        items.append((key, value.tobytes() if key in cell['curves'] else value))
+    return (cell['format'],) + tuple(items)
+
+
+def measurement(value):
+    try:
+        return {"nominal": float(value.magnitude.n), "std": float(value.magnitude.s)}
+    except AttributeError:
+        return {"nominal": float(get_nominal(value)), "std": 0.0}
+
+
+class CellService:
+    def __init__(self, max_batch=1024, max_wait=0.002, cache_size=100000, outputs=SERVICE_OUTPUTS):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.cache_size = cache_size
+        self.outputs = list(outputs)
+        self.cache = collections.OrderedDict()
+        self.compiled = {} #compiled cell stacks (fn_spec), shared by all requests
+        self.unit = UnitRegistry()
+        self.queue = None
+        self.stats = {"requests": 0, "designs": 0, "cache_hits": 0, "batches": 0, "batched_designs": 0,
+                      "errors": 0}
+
+    # EVALUATION
+    def cached(self, key):
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.stats['cache_hits'] += 1
+            return self.cache[key]
+        return None
+
+    def store(self, key, result):
+        self.cache[key] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    #Result of one spec: from the cache, or queued for the next batch
+    async def evaluate(self, spec):
+        self.stats['designs'] += 1
+        if not isinstance(spec, dict):
+            raise ValueError('A cell spec must be a mapping.')
+        if spec.get('uncertainty'):
+            return await self.evaluate_uncertain(spec)
+        if len(self.compiled) > self.cache_size:
+            self.compiled.clear()
+        cell = compile_spec(spec, cache=self.compiled)
+        key = design_key(cell)
+        result = self.cached(key)
+        if result is None:
+            future = asyncio.get_running_loop().create_future()
+            await self.queue.put((cell, key, future))
+            result = await future
+        return dict(result, name=cell['name'])
+
+    #Pint cell with uncertainties, built in a worker thread so the event loop keeps serving
+    async def evaluate_uncertain(self, spec):
+        spec = {key: value for key, value in spec.items() if key != 'uncertainty'}
+        cell = compile_spec(spec, cache=self.compiled)
+        key = ('uncertainty',) + design_key(cell) + tuple(sorted(cell['std'].items()))
+        result = self.cached(key)
+        if result is None:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self.builder, self.build_uncertain, spec)
+            self.store(key, result)
+        return dict(result, name=cell['name'])
+
+    def build_uncertain(self, spec):
+        cell = spec_cell(spec, self.unit)
+        return {"format": cell.format,
+                "capacity": measurement(cell.capacity.to('A*hr')),
+                "energy": measurement(cell.energy.to('W*hr')),
+                "avgE": measurement(cell.avgE.to('V')),
+                "NPratio": float(cell.NPratio),
+                "mass_total": measurement(cell.mass.total.to('g')),
+                "volume": measurement(cell.volume.to('cm**3')),
+                "gravimetric_energy": measurement(gravimetric_energy(cell)),
+                "volumetric_energy": measurement(volumetric_energy(cell))}
+
+    #Collects queued designs into micro-batches for batch_cell
+    async def batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            self.run_batch(batch)
+
+    def run_batch(self, batch):
+        self.stats['batches'] += 1
+        self.stats['batched_designs'] += len(batch)
+        pending = {}
+        for cell, key, future in batch: #the same design twice in one batch is evaluated once
+            pending.setdefault(key, (cell, []))[1].append(future)
+        keys = list(pending)
+        try:
+            batches = cell_batches([pending[key][0] for key in keys])
+            for group in batches:
+                out = batch_cell(group['format'], group['inputs'])
+                for j, row in enumerate(group['rows']):
+                    result = {"format": group['format']}
+                    for name in self.outputs:
+                        result[name] = float(np.broadcast_to(out[name], len(group['rows']))[j])
+                    self.store(keys[row], result)
+                    for future in pending[keys[row]][1]:
+                        if not future.done():
+                            future.set_result(result)
+        except Exception as error:
+            for cell, key, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+
+    # HTTP
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, body, keepalive = request
+                if body is None: #body over MAX_BODY, left unread: answer and close the connection
+                    self.stats['requests'] += 1
+                    self.stats['errors'] += 1
+                    status, payload = 413, {"error": 'Request body over ' + str(MAX_BODY) + ' bytes.'}
+                else:
+                    status, payload = await self.route(method, path, body)
+                write_response(writer, status, payload, keepalive)
+                await writer.drain()
+                if body is None:
+                    await discard_body(reader, writer)
+                if not keepalive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        path = path.split('?', 1)[0]
+        self.stats['requests'] += 1
+        if path == '/health':
+            return 200, {"status": 'ok'}
+        if path == '/stats':
+            stats = dict(self.stats, cache_size=len(self.cache))
+            stats['mean_batch'] = stats['batched_designs']/max(stats['batches'], 1)
+            return 200, stats
+        if path not in ['/cell', '/cells']:
+            return 404, {"error": 'Unknown path: ' + path}
+        if method != 'POST':
+            return 405, {"error": 'Use POST with a JSON cell spec.'}
+        try:
+            spec = json.loads(body or b'null')
+            if path == '/cell':
+                return 200, await self.evaluate(spec)
+            if not isinstance(spec, list):
+                raise ValueError('/cells takes a list of cell specs.')
+            return 200, list(await asyncio.gather(*[self.evaluate(item) for item in spec]))
+        except (ValueError, KeyError, TypeError) as error: #invalid spec or json
+            self.stats['errors'] += 1
+            return 400, {"error": str(error)}
+
+    async def serve(self, host='127.0.0.1', port=8050):
+        from concurrent.futures import ThreadPoolExecutor
+        self.queue = asyncio.Queue()
+        self.builder = ThreadPoolExecutor(max_workers=1) #one pint registry, used by one thread
+        batcher = asyncio.create_task(self.batcher())
+        server = await asyncio.start_server(self.handle, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            self.builder.shutdown()
+
+
+MAX_BODY = 64*2**20
+
+
+#(method, path, body, keepalive) of the next request on a connection, None once it is closed. A body
+#over MAX_BODY is not read: body is None and keepalive False (the connection cannot be reused)
+async def read_request(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    parts = line.decode('latin-1').split()
+    if len(parts) < 2:
+        raise ConnectionError('Bad request line')
+    method, path = parts[0], parts[1]
+    version = parts[2] if len(parts) > 2 else 'HTTP/1.0'
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in [b'\r\n', b'\n', b'']:
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY:
+        return method, path, None, False
+    body = await reader.readexactly(length) if length else b''
+    connection = headers.get('connection', '').lower()
+    keepalive = connection == 'keep-alive' or (version == 'HTTP/1.1' and connection != 'close')
+    return method, path, body, keepalive
+
+
+#Half close after an early response and read away what the client still sends (up to timeout), so that
+#closing with unread data does not reset the connection before the client has read the response
+async def discard_body(reader, writer, timeout=1.0):
+    writer.write_eof()
+    try:
+        await asyncio.wait_for(discard(reader), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def discard(reader):
+    while await reader.read(2**16):
+        pass
+
+
+def write_response(writer, status, payload, keepalive):
+    body = json.dumps(payload).encode()
+    head = ('HTTP/1.1 ' + str(status) + ' ' + HTTP_STATUS.get(status, '') + '\r\n'
+            'Content-Type: application/json\r\n'
+            'Content-Length: ' + str(len(body)) + '\r\n'
+            'Connection: ' + ('keep-alive' if keepalive else 'close') + '\r\n\r\n')
+    writer.write(head.encode('latin-1') + body)
+
+
+def serve(host='127.0.0.1', port=8050, **kwargs):
+    asyncio.run(CellService(**kwargs).serve(host, port))
+
+
+# LOAD BENCHMARK CLIENT
+#NMC811 | graphite 21700 of the BotB notebooks as a spec (as the fn_benchmark reference cell)
+def reference_spec():
+    return {
+        "format": 'cylindrical',
+        "name": '21700 cell',
+        "positive": {"active": 'NMC811', "arealcap": '4.5 +/- 0.1 mA*hr/cm**2', "activefrac": '0.95 +/- 0.02',
+                     "density": '3.4 +/- 0.1 g/cm**3', "currentcollector": {"name": 'Al', "thick": '16 um'}},
+        "negative": {"active": {"name": 'Graphite', "speccap": '344 mA*hr/g', "avgE": '0.17 V',
+                                "density": '2.24 g/cm**3'},
+                     "npratio": 1.1, "activefrac": '0.95 +/- 0.01', "density": '1.6 +/- 0.1 g/cm**3',
+                     "currentcollector": {"name": 'Cu', "thick": '12 um'}},
+        "separator": {"name": 'PP:PE', "porosity": 0.44, "thick": '12 um', "density": '0.9 g/cm**3'},
+        "electrolyte": {"name": 'LiPF6:EC:EMC 3:7', "concentration": '1.1 +/- 0.05 mol/L'},
+        "ecapratio": '1.6 mL/(A*hr)',
+        "diameter": '2.1 cm',
+        "height": '7.0 cm',
+        "canthick": '0.165 mm',
+        "candens": '7.9 +/- 0.2 g/cm**3',
+        "mandreldiam": '2.5 mm',
+        "headspace": '0.6 cm',
+        "llifactor": 0.95,
+        "extramass": '4 +/- 2 g',
+    }
+
+
+async def post(reader, writer, path, payload):
+    body = json.dumps(payload).encode()
+    writer.write(('POST ' + path + ' HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+                  'Content-Length: ' + str(len(body)) + '\r\n\r\n').encode('latin-1') + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in [b'\r\n', b'\n', b'']:
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+#Throughput and latency of POST /cell with `concurrency` keep-alive connections. Designs vary in diameter
+#so that a fraction `repeat` of the requests hits the cache.
+async def load_test(host='127.0.0.1', port=8050, concurrency=64, requests=20000, repeat=0.0, seed=0):
+    rng = np.random.default_rng(seed)
+    spec = reference_spec()
+    unique = max(1, int(requests*(1-repeat)))
+    diameters = np.round(rng.uniform(1.8, 4.6, unique), 6)
+    latencies = []
+    errors = [0]
+    counter = iter(range(requests))
+
+    async def client():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for i in counter:
+                start = time.perf_counter()
+                status, result = await post(reader, writer, '/cell',
+                                            dict(spec, diameter=str(diameters[i % unique]) + ' cm'))
+                latencies.append(time.perf_counter()-start)
+                if status != 200:
+                    errors[0] += 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for i in range(concurrency)])
+    elapsed = time.perf_counter()-start
+    latencies = np.array(latencies)*1000 #ms
+    return {"requests": requests, "concurrency": concurrency, "errors": errors[0], "seconds": elapsed,
+            "throughput": requests/elapsed, "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)), "p99_ms": float(np.percentile(latencies, 99))}
+
+
+#Load test against a server, started in a subprocess when spawn is set
+def benchmark(host='127.0.0.1', port=8050, spawn=False, **kwargs):
+    import subprocess
+    process = None
+    if spawn:
+        process = subprocess.Popen([sys.executable, '-m', 'BotB_functions.fn_service', 'serve',
+                                    '--host', host, '--port', str(port)])
+        for attempt in range(200): #wait for the server to listen
+            try:
+                import socket
+                socket.create_connection((host, port), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+    try:
+        return asyncio.run(load_test(host, port, **kwargs))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(prog='botb-service', description='BotB local calculation service.')
+    parser.add_argument('command', choices=['serve', 'bench'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--max-batch', type=int, default=1024)
+    parser.add_argument('--max-wait', type=float, default=0.002, help='s')
+    parser.add_argument('--cache-size', type=int, default=100000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--repeat', type=float, default=0.0, help='fraction of repeated designs')
+    parser.add_argument('--spawn', action='store_true', help='start a server for the benchmark')
+    args = parser.parse_args()
+    if args.command == 'serve':
+        serve(args.host, args.port, max_batch=args.max_batch, max_wait=args.max_wait, cache_size=args.cache_size)
+    else:
+        result = benchmark(args.host, args.port, spawn=args.spawn, concurrency=args.concurrency,
+                           requests=args.requests, repeat=args.repeat)
+        print(json.dumps(result, indent=1))
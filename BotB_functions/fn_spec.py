@@ -0,0 +1,667 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.pyplot import figure
+import pandas as pd
+import pickle
+from pint import UnitRegistry
+import os
+from dotmap import DotMap
+import sys
+import re
+import json
+import functools
+import contextlib
+import gc
+
+from BotB_functions.fn_cellstack import *
+from BotB_functions.fn_batch import *
+from BotB_functions.fn_electrolyte import electrolyte_property
+from BotB_functions.fn_ocv import ocv_curve, curve_average
+
+
+# DECLARATIVE CELL SPECIFICATIONS
+# A whole cell as data (YAML, JSON or TOML) instead of make_active -> make_composite -> make_electrode
+# -> make_cellstack -> make_cylindrical calls:
+#
+#   format: cylindrical            #CELL_FORMATS name or builder alias (pouch, 24Mpouch, prismatic)
+#   name: 21700 cell
+#   positive:
+#     active: NMC811               #activesDB.csv name, an entry of materials, or a mapping
+#     arealcap: 4.5 +/- 0.1 mA*hr/cm**2
+#     activefrac: 0.95 +/- 0.02
+#     density: 3.4 +/- 0.1 g/cm**3
+#     currentcollector: {name: Al, thick: 16 um}
+#   negative:
+#     active: Gr
+#     npratio: 1.1                 #arealcap as a multiple of the positive arealcap
+#     activefrac: 0.95
+#     density: 1.6 g/cm**3
+#     currentcollector: {name: Cu, thick: 12 um}
+#   separator: {name: PP:PE, porosity: 0.44, thick: 12 um, density: 0.9 g/cm**3}
+#   electrolyte: {name: LiPF6:EC:EMC 3:7, concentration: 1.1 +/- 0.05 mol/L}
+#   ecapratio: 1.6 mL/(A*hr)       #every other key is a cell property of the format
+#   diameter: 2.1 cm
+#   ...
+#
+# Values are 'nominal [+/- std] [units]' strings or plain numbers in KERNEL_UNITS (fn_batch).
+# A negative can be lithium metal ({type: lithium, excess: 0} as make_lithium) and a separator a solid
+# electrolyte ({type: solid, ...} as make_solidseparator). Components given as a string are looked up in
+# the materials of the file (a top level 'materials' mapping) and then in the built in materials.
+#
+# compile_spec validates a spec once into kernel inputs (nominal values in KERNEL_UNITS, with the given
+# uncertainties alongside) for batch_cell. Components are compiled once per distinct sub-specification
+# and unit strings are parsed once, so large files of designs sharing a few cell stacks load quickly.
+# spec_cell builds the same cell with the pint builders, uncertainties included.
+SPEC_FORMATS = {
+    "pouch": 'pouch stacked',
+    "24Mpouch": 'single layer pouch',
+    "prismatic": 'prismatic wound',
+}
+SPEC_COMPONENTS = ['positive', 'negative', 'separator', 'electrolyte']
+SPEC_RESERVED = ['format', 'name', 'materials'] + SPEC_COMPONENTS
+
+#Built in current collector densities (as make_currentcollector) and the lithium of make_lithium
+CURRENTCOLLECTOR_DENSITIES = {"Al": 2.7, "Cu": 8.96} #g/cm3
+LITHIUM_ACTIVE = {"name": 'Li', "speccap": 3861, "avgE": 0, "density": 0.534}
+
+ACTIVE_KEYS = ['name', 'speccap', 'avgE', 'density', 'ocv']
+COMPOSITE_KEYS = ['active', 'currentcollector', 'arealcap', 'thick', 'arealload', 'porosity', 'density',
+                  'activefrac', 'phases', 'npratio']
+LITHIUM_KEYS = ['type', 'active', 'currentcollector', 'excess', 'thick']
+SEPARATOR_KEYS = ['name', 'thick', 'porosity', 'density']
+SOLIDSEPARATOR_KEYS = ['type', 'name', 'thick', 'density', 'catholyte', 'conductivity']
+ELECTROLYTE_KEYS = ['name', 'concentration', 'salt', 'solvent', 'temperature']
+
+#Units of spec values that are not kernel inputs (bare numbers are in these units)
+SPEC_UNITS = {
+    "thick": 'cm',
+    "arealload": 'g/cm**2',
+    "density": 'g/cm**3',
+    "massfrac": 'dimensionless',
+    "npratio": 'dimensionless',
+    "excess": 'dimensionless',
+    "catholyte": 'dimensionless',
+    "concentration": 'mol/L',
+    "temperature": 'degC',
+}
+
+_registry = {}
+
+
+def spec_registry():
+    if 'unit' not in _registry:
+        _registry['unit'] = UnitRegistry()
+    return _registry['unit']
+
+
+# VALUES
+QUANTITY_PATTERN = re.compile(r'^\s*([-+]?[0-9.]+(?:[eE][-+]?[0-9]+)?)\s*(?:(?:\+/-|±)\s*([0-9.]+(?:[eE][-+]?[0-9]+)?))?\s*(.*?)\s*$')
+
+
+#(nominal, std, units) of a value string like '4.5 +/- 0.1 mA*hr/cm**2'; units is '' for plain numbers
+@functools.lru_cache(maxsize=None)
+def parse_quantity(text):
+    match = QUANTITY_PATTERN.match(text)
+    if match is None:
+        raise ValueError('Cannot read quantity: ' + str(text))
+    nominal, std, units = match.groups()
+    return float(nominal), float(std or 0), units
+
+
+@functools.lru_cache(maxsize=None)
+def unit_factor(units, target):
+    unit = spec_registry()
+    try:
+        return float((1*unit(units)).to(target).magnitude)
+    except Exception as error:
+        raise ValueError('Cannot convert ' + str(units) + ' to ' + str(target) + ': ' + str(error))
+
+
+#Nominal and std of a spec value in target units
+def spec_value(value, target):
+    if isinstance(value, str):
+        return text_value(value, target)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError('Expected a quantity, got: ' + str(value))
+    return float(value), 0.0
+
+
+@functools.lru_cache(maxsize=None)
+def text_value(text, target):
+    nominal, std, units = parse_quantity(text)
+    if units == '': #plain number in target units
+        return nominal, std
+    if target == 'degC': #offset units are not a factor
+        unit = spec_registry()
+        low, high = unit.Quantity(np.array([nominal, nominal+std]), units).to(target).magnitude
+        return float(low), float(high-low)
+    factor = unit_factor(units, target)
+    return nominal*factor, std*factor
+
+
+#Pint quantity (a Measurement with an uncertainty) of a spec value, bare numbers in target units
+def spec_quantity(value, target, unit):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        nominal, std, units = float(value), 0.0, target
+    else:
+        nominal, std, units = parse_quantity(str(value))
+    units = units or target
+    if units in ['degC', 'degF']:
+        return unit.Quantity(nominal, units)
+    if std > 0:
+        return unit.Measurement(nominal, std, unit(units).units)*unit(units).magnitude
+    return nominal*unit(units)
+
+
+def check_keys(spec, keys, what):
+    if not isinstance(spec, dict):
+        raise ValueError('Expected a mapping of ' + what + ' properties, got: ' + str(spec))
+    for key in spec:
+        if key not in keys:
+            raise ValueError('Unknown ' + what + ' property: ' + str(key))
+
+
+# MATERIALS
+@functools.lru_cache(maxsize=None)
+def actives_database():
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'activesDB.csv')
+    actives = {}
+    if os.path.exists(path):
+        for row in pd.read_csv(path).itertuples():
+            actives[row.name] = {"name": row.name,
+                                 "speccap": str(row.cap) + ' mA*hr/g',
+                                 "avgE": str(row.V) + ' V',
+                                 "density": str(row.density) + ' g/cm**3'}
+    return actives
+
+
+#A component given by name: the materials of the spec first, then activesDB.csv for actives
+def resolve(component, materials, kind):
+    if not isinstance(component, str):
+        return component
+    if component in materials:
+        return materials[component]
+    if kind == 'active' and component in actives_database():
+        return actives_database()[component]
+    if kind == 'currentcollector' and component in CURRENTCOLLECTOR_DENSITIES:
+        raise ValueError('Current collector ' + component + ' needs a thick: {name: ' + component + ', thick: ...}')
+    raise ValueError('Unknown ' + kind + ': ' + str(component))
+
+
+# COMPILE COMPONENTS TO KERNEL INPUTS
+#Inputs and uncertainties of one compiled component, with the keys of its OCV curves
+def compiled(inputs, std):
+    return {"inputs": inputs,
+            "std": {key: value for key, value in std.items() if value > 0},
+            "curves": tuple(key for key in inputs if key.endswith('_ocv'))}
+
+
+def compile_active(spec, prefix):
+    check_keys(spec, ACTIVE_KEYS, 'active material')
+    inputs = {}
+    std = {}
+    if 'ocv' in spec:
+        ocv = spec['ocv']
+        inputs[prefix+'_ocv'] = ocv_curve(np.asarray(ocv['soc'], dtype=float), np.asarray(ocv['voltage'], dtype=float))
+    for key, kernelkey in [('speccap', 'speccap'), ('density', 'actdens'), ('avgE', 'avgE')]:
+        if key not in spec:
+            if key == 'avgE' and 'ocv' in spec:
+                inputs[prefix+'_avgE'] = curve_average(inputs[prefix+'_ocv'])
+                continue
+            raise ValueError('Unspecified active material properties.')
+        inputs[prefix+'_'+kernelkey], std[prefix+'_'+kernelkey] = spec_value(spec[key], KERNEL_UNITS[kernelkey])
+    return inputs, std
+
+
+def compile_currentcollector(spec, prefix, materials):
+    spec = resolve(spec, materials, 'currentcollector')
+    check_keys(spec, ['name', 'thick', 'density'], 'currentcollector')
+    if 'thick' not in spec:
+        raise ValueError('Unspecified currentcollector properties.')
+    inputs = {}
+    std = {}
+    inputs[prefix+'_ccthick'], std[prefix+'_ccthick'] = spec_value(spec['thick'], KERNEL_UNITS['ccthick'])
+    if spec.get('name') in CURRENTCOLLECTOR_DENSITIES: #as make_currentcollector, Al and Cu have fixed densities
+        inputs[prefix+'_ccdens'] = CURRENTCOLLECTOR_DENSITIES[spec['name']]
+    elif 'density' in spec:
+        inputs[prefix+'_ccdens'], std[prefix+'_ccdens'] = spec_value(spec['density'], KERNEL_UNITS['ccdens'])
+    else:
+        raise ValueError('Unspecified currentcollector properties.')
+    return inputs, std
+
+
+#Arealcap and porosity from any two of arealcap/arealload, thick, porosity/density (as complete_composite).
+#Values are floats or arrays in kernel units (thick cm, arealload g/cm2, density g/cm3).
+def complete_floats(given, speccap, solid):
+    arealcap = given.get('arealcap')
+    if arealcap is None and 'arealload' in given:
+        arealcap = given['arealload']*speccap
+    porosity = given.get('porosity')
+    if porosity is None and 'density' in given:
+        porosity = 1 - given['density']/solid
+    thick = given.get('thick')
+    if thick is not None:
+        if arealcap is None and porosity is not None:
+            arealcap = thick*solid*(1-porosity)*speccap
+        elif porosity is None and arealcap is not None:
+            porosity = 1 - arealcap/speccap/thick/solid
+    if arealcap is None or porosity is None:
+        raise ValueError('Unspecified electrode composite properties.')
+    density = solid*(1-porosity)
+    derived = {"arealcap": arealcap, "arealload": arealcap/speccap, "porosity": porosity, "density": density,
+               "thick": arealcap/speccap/density}
+    for key, value in given.items():
+        if np.any(np.abs(value - derived[key]) > 1e-3*np.maximum(np.maximum(np.abs(value), np.abs(derived[key])), 1e-12)):
+            raise ValueError('Conflicting defined electrode composite properties.')
+    return arealcap, porosity
+
+
+def compile_electrode(spec, prefix, materials, positive=None):
+    spec = resolve(spec, materials, 'electrode')
+    if spec.get('type') == 'lithium':
+        return compile_lithium(spec, prefix, materials, positive)
+    check_keys(spec, COMPOSITE_KEYS, 'electrode')
+    if 'active' not in spec or 'currentcollector' not in spec:
+        raise ValueError('Unspecified electrode properties.')
+    inputs, std = compile_active(resolve(spec['active'], materials, 'active'), prefix)
+    cc, ccstd = compile_currentcollector(spec['currentcollector'], prefix, materials)
+    inputs.update(cc)
+    std.update(ccstd)
+
+    phases = spec.get('phases', [])
+    inactivefrac = 0
+    specvol = 0
+    for phase in phases:
+        phase = resolve(phase, materials, 'phase')
+        check_keys(phase, ['name', 'massfrac', 'density'], 'composite phase')
+        if 'massfrac' not in phase or 'density' not in phase:
+            raise ValueError('Unspecified composite phase properties.')
+        massfrac = spec_value(phase['massfrac'], 'dimensionless')[0]
+        inactivefrac += massfrac
+        specvol += massfrac/spec_value(phase['density'], SPEC_UNITS['density'])[0]
+    if 'activefrac' in spec:
+        inputs[prefix+'_activefrac'], std[prefix+'_activefrac'] = spec_value(spec['activefrac'], 'dimensionless')
+    else:
+        inputs[prefix+'_activefrac'] = 1-inactivefrac if phases else 0.95
+    if inputs[prefix+'_activefrac'] + inactivefrac > 1+1e-6:
+        raise ValueError('Conflicting defined electrode composite properties.')
+    if phases:
+        inputs[prefix+'_inactivefrac'] = inactivefrac
+        inputs[prefix+'_inactivedens'] = inactivefrac/specvol
+
+    given = {}
+    for key in ['arealcap', 'thick', 'arealload', 'porosity', 'density']:
+        if key in spec:
+            given[key], std[prefix+'_'+key] = spec_value(spec[key], kernel_unit(prefix+'_'+key) if key in ['arealcap', 'porosity'] else SPEC_UNITS[key])
+    if 'npratio' in spec:
+        if positive is None or 'arealcap' in given:
+            raise ValueError('Conflicting defined electrode composite properties.')
+        given['arealcap'] = spec_value(spec['npratio'], 'dimensionless')[0]*positive['pos_arealcap']
+    solid = batch_skeletal(inputs, prefix)*inputs[prefix+'_activefrac']
+    inputs[prefix+'_arealcap'], inputs[prefix+'_porosity'] = complete_floats(given, inputs[prefix+'_speccap'], solid)
+    std = {key: value for key, value in std.items() if key in inputs} #uncertainties of kernel inputs only
+    return inputs, std
+
+
+#Lithium metal negative (as make_lithium)
+def compile_lithium(spec, prefix, materials, positive):
+    check_keys(spec, LITHIUM_KEYS, 'lithium electrode')
+    if positive is None or 'currentcollector' not in spec:
+        raise ValueError('Unspecified lithium electrode properties.')
+    inputs, std = compile_active(resolve(spec.get('active', LITHIUM_ACTIVE), materials, 'active'), prefix)
+    cc, ccstd = compile_currentcollector(spec['currentcollector'], prefix, materials)
+    inputs.update(cc)
+    std.update(ccstd)
+    if 'thick' in spec:
+        thick = spec_value(spec['thick'], SPEC_UNITS['thick'])[0]
+        inputs[prefix+'_arealcap'] = thick*inputs[prefix+'_actdens']*inputs[prefix+'_speccap']
+    else:
+        inputs[prefix+'_arealcap'] = spec_value(spec.get('excess', 0), 'dimensionless')[0]*positive['pos_arealcap']
+    inputs[prefix+'_activefrac'] = 1.0
+    inputs[prefix+'_porosity'] = 0.0
+    inputs[prefix+'_lithium'] = 1.0
+    return inputs, std
+
+
+def compile_separator(spec, materials):
+    spec = resolve(spec, materials, 'separator')
+    inputs = {}
+    std = {}
+    if spec.get('type') == 'solid': #as make_solidseparator
+        check_keys(spec, SOLIDSEPARATOR_KEYS, 'separator')
+        if any(key not in spec for key in ['thick', 'density', 'conductivity']):
+            raise ValueError('Unspecified separator properties.')
+        catholyte = spec_value(spec.get('catholyte', 0), 'dimensionless')[0]
+        inputs['sep_thick'], std['sep_thick'] = spec_value(spec['thick'], KERNEL_UNITS['thick'])
+        inputs['sep_porosity'] = catholyte
+        inputs['sep_density'] = spec_value(spec['density'], KERNEL_UNITS['density'])[0]*(1-catholyte)
+        inputs['sep_solid'] = 1.0
+        inputs['sep_conductivity'], std['sep_conductivity'] = spec_value(spec['conductivity'], KERNEL_UNITS['conductivity'])
+        return inputs, std
+    check_keys(spec, SEPARATOR_KEYS, 'separator')
+    if any(key not in spec for key in ['thick', 'porosity', 'density']):
+        raise ValueError('Unspecified separator properties.')
+    for key in ['thick', 'porosity', 'density']:
+        inputs['sep_'+key], std['sep_'+key] = spec_value(spec[key], kernel_unit('sep_'+key))
+    return inputs, std
+
+
+#Electrolyte density (as make_electrolyte): the linear fit, or the property library with salt and solvent
+def compile_electrolyte(spec, materials):
+    spec = resolve(spec, materials, 'electrolyte')
+    check_keys(spec, ELECTROLYTE_KEYS, 'electrolyte')
+    if 'concentration' not in spec:
+        raise ValueError('Unspecified electrolyte properties.')
+    concentration, deviation = spec_value(spec['concentration'], SPEC_UNITS['concentration'])
+    if 'salt' in spec and 'solvent' in spec:
+        temperature = spec_value(spec.get('temperature', '25 degC'), SPEC_UNITS['temperature'])[0]
+        density, upper = electrolyte_property(spec['salt'], spec['solvent'], 'density',
+                                              [concentration, concentration+1e-4], temperature)
+        density, slope = float(density), float(upper-density)/1e-4
+    else:
+        density, slope = 0.091*concentration + 1.1, 0.091
+    return {"elyte_density": density}, {"elyte_density": abs(slope)*deviation} #concentration uncertainty
+
+
+#Kernel inputs of a cell stack, compiled once per distinct positive/negative/separator/electrolyte.
+#Components shared as objects (YAML anchors, the same dict reused) are found by identity, equal ones
+#written out again by their serialization.
+def compile_cellstack(spec, materials, cache):
+    components = [spec.get(name) for name in SPEC_COMPONENTS]
+    ids = ('id', id(materials)) + tuple(id(component) for component in components)
+    if ids in cache:
+        return cache[ids][0]
+    key = (id(materials), repr(components))
+    if key not in cache:
+        if any(component is None for component in components):
+            raise ValueError('Unspecified cellstack properties.')
+        inputs = {}
+        std = {}
+        for part in [compile_electrode(spec['positive'], 'pos', materials),
+                     None,
+                     compile_separator(spec['separator'], materials),
+                     compile_electrolyte(spec['electrolyte'], materials)]:
+            if part is None: #the negative can depend on the positive (npratio, lithium excess)
+                part = compile_electrode(spec['negative'], 'neg', materials, positive=inputs)
+            inputs.update(part[0])
+            std.update(part[1])
+        cache[key] = (compiled(inputs, std), materials)
+    cache[ids] = (cache[key][0], components, materials) #holds the objects so their ids stay theirs
+    return cache[key][0]
+
+
+# COMPILE CELLS
+def spec_format(spec):
+    format = SPEC_FORMATS.get(spec.get('format'), spec.get('format'))
+    if format not in CELL_FORMATS:
+        raise ValueError('Unknown cell format: ' + str(spec.get('format')))
+    return format
+
+
+#Cell properties of a format: (key, kernel units, default in kernel units or None if it must be given)
+@functools.lru_cache(maxsize=None)
+def format_properties(format):
+    defaults = CELL_FORMATS[format]['defaults']
+    properties = []
+    for key in cellformat_keys(format):
+        default = defaults[key]
+        properties.append((key, kernel_unit(key),
+                           None if default == 'missing' else to_kernel(default, key, spec_registry())))
+    return tuple(properties)
+
+
+#Compiled cell: format, name, kernel inputs (nominal, KERNEL_UNITS) and std of the given uncertain inputs.
+#cache holds compiled cell stacks shared between calls.
+def compile_spec(spec, materials=None, cache=None):
+    if cache is None:
+        cache = {}
+    if materials is None:
+        materials = {}
+    if 'materials' in spec:
+        materials = cache.setdefault(('materials', id(materials), json.dumps(spec['materials'], default=str)),
+                                     dict(materials, **spec['materials']))
+    format = spec_format(spec)
+    defaults = CELL_FORMATS[format]['defaults']
+    for key in spec:
+        if key not in defaults and key not in SPEC_RESERVED or key == 'cellstack':
+            raise ValueError('Unknown cell property: ' + str(key))
+    elytefill = spec.get('elytefill', defaults['elytefill'])
+    if elytefill not in ['ecapratio', 'porevolume']:
+        raise ValueError('Unknown electrolyte fill: ' + str(elytefill))
+    stack = compile_cellstack(spec, materials, cache)
+    inputs = dict(stack['inputs'])
+    std = dict(stack['std'])
+    inputs['porefill'] = 1.0 if elytefill == 'porevolume' else 0.0
+    for key, target, default in format_properties(format):
+        value = spec.get(key)
+        if value is not None:
+            inputs[key], deviation = spec_value(value, target)
+            if deviation > 0:
+                std[key] = deviation
+        elif key == 'ecapratio' and elytefill == 'porevolume':
+            continue #calculated from the fill
+        elif default is None:
+            raise ValueError('Unspecified cell properties.')
+        else:
+            inputs[key] = default
+    return {"format": format,
+            "name": spec.get('name', defaults['name']),
+            "inputs": inputs,
+            "std": std,
+            "curves": stack['curves']}
+
+
+#Compiled specs as batch_cell inputs, one batch per format (and set of OCV curves):
+#[{"format", "rows", "names", "inputs", "std"}]. rows are the positions of the designs in specs;
+#inputs missing from some designs of a batch are NaN, uncertainties 0.
+def compile_specs(specs, materials=None):
+    with paused_gc():
+        return compile_batches(specs, materials)
+
+
+#Many small dicts are created and none freed while loading, so the cyclic garbage collector only costs time
+@contextlib.contextmanager
+def paused_gc():
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def compile_batches(specs, materials):
+    cache = {}
+    cells = []
+    for row, spec in enumerate(specs):
+        try:
+            cells.append(compile_spec(spec, materials, cache))
+        except ValueError as error:
+            raise ValueError('Spec ' + str(row) + ' (' + str(spec.get('name', '')) + '): ' + str(error))
+    return cell_batches(cells)
+
+
+#Batches (as compile_specs) of compiled cells, rows are positions in cells
+def cell_batches(cells):
+    import operator
+    groups = {}
+    for row, cell in enumerate(cells):
+        curves = tuple((key, id(cell['inputs'][key])) for key in cell['curves'])
+        group = groups.setdefault((cell['format'], curves), {"rows": [], "names": [], "cells": []})
+        group['rows'].append(row)
+        group['names'].append(cell['name'])
+        group['cells'].append(cell)
+
+    #Columns are filled one layout (ordered set of keys) at a time
+    def columns(dicts, fill):
+        layouts = {}
+        for i, values in enumerate(dicts):
+            layouts.setdefault(tuple(values), []).append(i)
+        keys = list(dict.fromkeys(key for layout in layouts for key in layout))
+        table = np.full((len(dicts), len(keys)), fill, dtype=float)
+        for layout, rows in layouts.items():
+            if len(layout) == 0:
+                continue
+            get = operator.itemgetter(*layout)
+            block = np.array([get(dicts[i]) for i in rows], dtype=float).reshape(len(rows), len(layout))
+            table[np.ix_(rows, [keys.index(key) for key in layout])] = block
+        return {key: table[:, j].copy() for j, key in enumerate(keys)}
+
+    batches = []
+    for (format, curves), group in groups.items():
+        cells = group['cells']
+        curvekeys = [key for key, ident in curves]
+        inputs = columns([{key: value for key, value in cell['inputs'].items() if key not in curvekeys}
+                          for cell in cells] if curvekeys else [cell['inputs'] for cell in cells], np.nan)
+        inputs.update({key: cells[0]['inputs'][key] for key in curvekeys}) #curves are shared by all rows
+        batches.append({"format": format,
+                        "rows": np.array(group['rows']),
+                        "names": group['names'],
+                        "inputs": inputs,
+                        "std": columns([cell['std'] for cell in cells], 0)})
+    return batches
+
+
+#Kernel results of compiled specs as one DataFrame in spec order
+def evaluate_specs(batches, outputs=None):
+    frames = []
+    for batch in batches:
+        out = batch_cell(batch['format'], batch['inputs'])
+        frame = pd.DataFrame({"name": batch['names'], "format": batch['format']}, index=batch['rows'])
+        for key in (outputs if outputs is not None else out.keys()):
+            frame[key] = np.broadcast_to(out[key], len(batch['rows']))
+        frames.append(frame)
+    return pd.concat(frames).sort_index()
+
+
+# FILES
+#Specs of a .yaml/.yml (documents, each a spec or a list of specs), .json (a spec or a list) or .toml
+#file (a spec, or a list under [[cells]]). A document can also hold the list under 'cells' with
+#'materials' for the whole file and 'defaults', properties every cell starts from (typically the cell
+#stack, which then compiles once).
+def read_specs(path):
+    extension = os.path.splitext(str(path))[1].lower()
+    if extension in ['.yaml', '.yml']:
+        import yaml
+        loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+        with open(path) as f:
+            documents = [document for document in yaml.load_all(f, Loader=loader) if document is not None]
+    elif extension == '.json':
+        with open(path) as f:
+            documents = [json.load(f)]
+    elif extension == '.toml':
+        try:
+            import tomllib
+        except ImportError: #python < 3.11
+            import tomli as tomllib
+        with open(path, 'rb') as f:
+            documents = [tomllib.load(f)]
+    else:
+        raise ValueError('Unknown file type: ' + str(path))
+    materials = {}
+    specs = []
+    for document in documents:
+        if isinstance(document, dict) and 'cells' in document:
+            materials.update(document.get('materials', {}))
+            defaults = document.get('defaults', {})
+            document = [dict(defaults, **cell) for cell in document['cells']] if defaults else document['cells']
+        elif isinstance(document, dict) and set(document) == {'materials'}:
+            materials.update(document['materials'])
+            continue
+        specs.extend(document if isinstance(document, list) else [document])
+    return specs, materials
+
+
+def load_specs(path):
+    with paused_gc():
+        specs, materials = read_specs(path)
+        return compile_batches(specs, materials)
+
+
+# PINT CELLS
+def build_active(spec, unit):
+    kwargs = {key: spec_quantity(spec[key], KERNEL_UNITS[kernel], unit)
+              for key, kernel in [('speccap', 'speccap'), ('avgE', 'avgE'), ('density', 'actdens')] if key in spec}
+    if 'ocv' in spec:
+        kwargs['ocv'] = (np.asarray(spec['ocv']['soc'], dtype=float), np.asarray(spec['ocv']['voltage'], dtype=float))
+    return make_active(name=spec.get('name', 'active'), unit=unit, **kwargs)
+
+
+def build_currentcollector(spec, materials, unit):
+    spec = resolve(spec, materials, 'currentcollector')
+    kwargs = {key: spec_quantity(spec[key], KERNEL_UNITS['cc'+key], unit) for key in ['thick', 'density'] if key in spec}
+    return make_currentcollector(name=spec.get('name', 'currentcollector'), unit=unit, **kwargs)
+
+
+def build_electrode(spec, materials, unit, positive=None):
+    currentcollector = build_currentcollector(spec['currentcollector'], materials, unit)
+    if spec.get('type') == 'lithium':
+        kwargs = {}
+        if 'active' in spec:
+            kwargs['active'] = build_active(resolve(spec['active'], materials, 'active'), unit)
+        if 'thick' in spec:
+            kwargs['thick'] = spec_quantity(spec['thick'], SPEC_UNITS['thick'], unit)
+        else:
+            kwargs['excess'] = spec_value(spec.get('excess', 0), 'dimensionless')[0]
+        composite = make_lithium(positive=positive, unit=unit, **kwargs)
+    else:
+        kwargs = {}
+        for key in ['arealcap', 'thick', 'arealload', 'porosity', 'density', 'activefrac']:
+            if key in spec:
+                kwargs[key] = spec_quantity(spec[key], SPEC_UNITS.get(key) or KERNEL_UNITS[key], unit)
+        if 'npratio' in spec:
+            kwargs['arealcap'] = positive.arealcap*spec_quantity(spec['npratio'], 'dimensionless', unit)
+        phases = [resolve(phase, materials, 'phase') for phase in spec.get('phases', [])]
+        if phases:
+            kwargs['phases'] = [make_phase(name=phase.get('name', 'phase'),
+                                           massfrac=spec_quantity(phase['massfrac'], 'dimensionless', unit),
+                                           density=spec_quantity(phase['density'], SPEC_UNITS['density'], unit),
+                                           unit=unit) for phase in phases]
+        composite = make_composite(active=build_active(resolve(spec['active'], materials, 'active'), unit),
+                                   unit=unit, **kwargs)
+    return make_electrode(composite=composite, currentcollector=currentcollector, unit=unit)
+
+
+def build_separator(spec, materials, unit):
+    spec = resolve(spec, materials, 'separator')
+    kwargs = {key: spec_quantity(spec[key], SPEC_UNITS.get(key) or KERNEL_UNITS[key], unit)
+              for key in ['thick', 'porosity', 'density', 'catholyte', 'conductivity'] if key in spec}
+    if spec.get('type') == 'solid':
+        return make_solidseparator(name=spec.get('name', 'separator'), unit=unit, **kwargs)
+    return make_separator(name=spec.get('name', 'separator'), unit=unit, **kwargs)
+
+
+def build_electrolyte(spec, materials, unit):
+    spec = resolve(spec, materials, 'electrolyte')
+    kwargs = {key: spec[key] for key in ['salt', 'solvent'] if key in spec}
+    if 'temperature' in spec:
+        kwargs['temperature'] = spec_quantity(spec['temperature'], SPEC_UNITS['temperature'], unit)
+    return make_electrolyte(name=spec.get('name', 'electrolyte'),
+                            concentration=spec_quantity(spec['concentration'], SPEC_UNITS['concentration'], unit),
+                            unit=unit, **kwargs)
+
+
+#Cell of a spec built with the pint builders (make_cell), uncertainties included
+def spec_cell(spec, unit, materials=None):
+    compile_spec(spec, materials) #validate
+    materials = dict(materials or {}, **spec.get('materials', {}))
+    format = spec_format(spec)
+    positive = build_electrode(resolve(spec['positive'], materials, 'electrode'), materials, unit)
+    negative = build_electrode(resolve(spec['negative'], materials, 'electrode'), materials, unit,
+                               positive=positive.composite)
+    cellstack = make_cellstack(positive=positive,
+                               negative=negative,
+                               separator=build_separator(spec['separator'], materials, unit),
+                               electrolyte=build_electrolyte(spec['electrolyte'], materials, unit),
+                               unit=unit)
+    kwargs = {}
+    defaults = CELL_FORMATS[format]['defaults']
+    for key, value in spec.items():
+        if key in SPEC_RESERVED:
+            continue
+        if isinstance(defaults[key], str) and defaults[key] != 'missing':
+            kwargs[key] = value #text property, e.g. tabloc or elytefill
+        else:
+            kwargs[key] = spec_quantity(value, kernel_unit(key), unit)
+    return make_cell(format, name=spec.get('name', defaults['name']), cellstack=cellstack, unit=unit, **kwargs)
@@ -0,0 +1,349 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.pyplot import figure
+import pandas as pd
+import pickle
+from pint import UnitRegistry
+import os
+from dotmap import DotMap
+import sys
+import json
+
+from BotB_functions.fn_batch import *
+from BotB_functions.fn_pipeline import run_pipeline, apply_stages, mask_chunk
+from BotB_functions.fn_hash import mix64, text_hash
+
+
+# MEMORY-MAPPED RESULT STORE
+# A sweep too large for memory goes to a directory:
+#   header.json     fields and their units (kernel units), number of designs, chunk size
+#   <field>.npy     one float64 column per field, row i is design i of the sweep
+#   done.npy        one byte per chunk, set once all of its rows are on disk
+# Columns are memory mapped: rows are written where they belong as chunks finish, in any order, and an
+# interrupted sweep resumes with the chunks not yet done. Opened for reading, store['energy'][a:b] and
+# store.batch(a, b) are views of the files (no copy, nothing read until used).
+#   store = run_store(source, stages, 'sweep', ['diameter', 'gravimetric_energy', 'volumetric_energy'])
+#   energy = open_store('sweep')['gravimetric_energy']
+STORE_HEADER = 'header.json'
+STORE_DONE = 'done.npy'
+
+
+class ResultStore:
+    def __init__(self, path, mode='r'):
+        self.path = str(path)
+        with open(os.path.join(self.path, STORE_HEADER)) as f:
+            header = json.load(f)
+        self.fields = header['fields']
+        self.size = header['size']
+        self.chunksize = header['chunksize']
+        self.meta = header.get('meta', {})
+        self.columns = {key: np.load(os.path.join(self.path, key + '.npy'), mmap_mode=mode) for key in self.fields}
+        self.done = np.load(os.path.join(self.path, STORE_DONE), mmap_mode=mode)
+
+    @property
+    def nchunks(self):
+        return len(self.done)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        return self.columns[key]
+
+    def keys(self):
+        return self.columns.keys()
+
+    #Chunk numbers not yet on disk
+    def missing(self):
+        return np.nonzero(self.done == 0)[0]
+
+    def complete(self):
+        return bool(np.all(self.done))
+
+    #Rows of a chunk of kernel results, at their design index
+    def write(self, chunk):
+        index = chunk['index']
+        n = len(index)
+        for key, column in self.columns.items():
+            column[index] = np.broadcast_to(chunk[key], n)
+
+    #Flush the columns first: a chunk is marked done only once its rows are on disk
+    def mark(self, chunks):
+        for column in self.columns.values():
+            column.flush()
+        self.done[np.asarray(chunks, dtype=np.int64)] = 1
+        self.done.flush()
+
+    #Rows start to stop (design indices) as a CellBatch of views
+    def batch(self, start=0, stop=None, format=None):
+        from BotB_functions.fn_cellbatch import CellBatch
+        return CellBatch({key: column[start:stop] for key, column in self.columns.items()}, format,
+                         units=self.fields)
+
+    def to_frame(self, start=0, stop=None):
+        return pd.DataFrame({key: column[start:stop] for key, column in self.columns.items()})
+
+    def __repr__(self):
+        return ('ResultStore(' + self.path + ', ' + str(self.size) + ' designs, ' + str(int(np.sum(self.done)))
+                + '/' + str(self.nchunks) + ' chunks done: ' + ', '.join(self.fields) + ')')
+
+
+#New store for size designs of the given kernel fields (columns are sparse files until written)
+def create_store(path, keys, size, chunksize, meta=None):
+    os.makedirs(path, exist_ok=True)
+    fields = {key: kernel_unit(key) for key in keys}
+    for key in fields:
+        np.lib.format.open_memmap(os.path.join(path, key + '.npy'), mode='w+', dtype=np.float64, shape=(size,)).flush()
+    np.lib.format.open_memmap(os.path.join(path, STORE_DONE), mode='w+', dtype=np.uint8,
+                              shape=(-(-size//chunksize),)).flush()
+    header = {"fields": fields, "size": int(size), "chunksize": int(chunksize), "meta": meta or {}}
+    with open(os.path.join(path, STORE_HEADER) + '.tmp', 'w') as f: #header last: a store without it is not one
+        json.dump(header, f)
+    os.replace(os.path.join(path, STORE_HEADER) + '.tmp', os.path.join(path, STORE_HEADER))
+    return ResultStore(path, 'r+')
+
+
+def open_store(path, mode='r'):
+    if not os.path.exists(os.path.join(str(path), STORE_HEADER)):
+        raise ValueError('No result store at ' + str(path))
+    return ResultStore(path, mode)
+
+
+#Pipeline sink writing chunks of a GridSource into a store
+class StoreSink:
+    def __init__(self, store):
+        self.store = store
+
+    def consume(self, chunk):
+        self.store.write(chunk)
+        self.store.mark([int(chunk['index'][0])//self.store.chunksize])
+
+    def close(self):
+        pass
+
+
+#Sweep of a GridSource into a store at path, resuming it if the same sweep (grid, base inputs, stages
+#and keys) was interrupted there
+def run_store(source, stages, path, keys, workers=1, inflight=2, meta=None):
+    meta = dict(meta or {}, grid={key: values.tolist() for key, values in zip(source.keys, source.values)},
+                identity=sweep_identity(source, stages, keys))
+    if os.path.exists(os.path.join(str(path), STORE_HEADER)):
+        store = open_store(path, 'r+')
+        if (store.size != source.size or store.chunksize != source.chunksize or list(store.fields) != list(keys)
+                or store.meta.get('grid') != meta['grid'] or store.meta.get('identity') != meta['identity']):
+            raise ValueError('Result store at ' + str(path) + ' holds another sweep.')
+    else:
+        store = create_store(path, keys, source.size, source.chunksize, meta)
+    run_pipeline(source, stages, [StoreSink(store)], workers, inflight, chunks=store.missing())
+    return store
+
+
+# CHECKPOINTED SWEEPS
+# run_checkpoint saves every finished chunk of a GridSource as <path>/chunks/<chunk id>.npz. Chunk ids
+# come from the design points in the chunk and every design point has a 64 bit hash of its grid values,
+# so ids depend only on the grid definition, never on the run. Run again after an interruption, chunks
+# whose file exists are skipped. With points added to the grid, chunks get new ids but only the points
+# with no saved result are computed (same base inputs, stages and keys; anything else is another sweep).
+# A chunk file holds the design indices of its rows in the grid of its run (kept in sweep.json), so its
+# rows are placed in any later grid one file at a time: nothing is gathered over the whole sweep.
+#   run_checkpoint(source, stages, 'overnight', ['gravimetric_energy', 'volumetric_energy'], workers=8)
+#   store = checkpoint_store('overnight', source, 'overnight_results')
+CHECKPOINT_HEADER = 'sweep.json'
+
+
+#Hash of each design point of a chunk from its grid values (axis order does not matter)
+def point_hashes(source, chunk):
+    points = np.zeros(len(chunk['index']), dtype=np.uint64)
+    for key in sorted(source.keys):
+        values = np.ascontiguousarray(chunk[key], dtype=np.float64).view(np.uint64)
+        with np.errstate(over='ignore'):
+            points = points + mix64(values ^ text_hash(key))
+        points = mix64(points)
+    return points
+
+
+def chunk_id(points):
+    import hashlib
+    return hashlib.sha1(np.sort(points).tobytes()).hexdigest()[:20]
+
+
+#Name and settings of a stage (functools.partial keywords included)
+def stage_identity(stage):
+    keywords = sorted(getattr(stage, 'keywords', {}).items())
+    stage = getattr(stage, 'func', stage)
+    return getattr(stage, '__module__', '') + '.' + getattr(stage, '__qualname__', repr(stage)) + repr(keywords)
+
+
+#What makes a sweep: base inputs, stages and result keys
+def sweep_identity(source, stages, keys):
+    import hashlib
+    digest = hashlib.sha1()
+    for key in sorted(source.base):
+        digest.update((key + ':').encode() + np.ascontiguousarray(source.base[key], dtype=np.float64).tobytes())
+    for stage in stages:
+        digest.update(stage_identity(stage).encode())
+    digest.update(repr(list(keys)).encode())
+    return digest.hexdigest()
+
+
+#Identity of the grid of a GridSource: its axes in order, as its design indices count them
+def grid_identity(source):
+    import hashlib
+    digest = hashlib.sha1()
+    for key, values in zip(source.keys, source.values):
+        digest.update((key + ':').encode() + np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    return digest.hexdigest()[:20]
+
+
+#Design indices in source of design indices of an earlier grid ({"keys", "values"}), -1 where not in source
+def regrid(grid, design, source):
+    keys = grid['keys']
+    values = [np.asarray(axis, dtype=np.float64) for axis in grid['values']]
+    positions = np.unravel_index(design, tuple(len(axis) for axis in values))
+    index = np.zeros(len(design), dtype=np.int64)
+    found = np.ones(len(design), dtype=bool)
+    for key, axis in zip(source.keys, source.values):
+        if key not in keys:
+            return np.full(len(design), -1, dtype=np.int64)
+        old = values[keys.index(key)][positions[keys.index(key)]]
+        order = np.argsort(axis, kind='stable')
+        position = np.minimum(np.searchsorted(axis[order], old), len(axis)-1)
+        found &= axis[order][position] == old
+        index = index*len(axis) + order[position]
+    return np.where(found, index, -1)
+
+
+#Worker task: compute the rows of chunk i (all rows, or rows) and save them under its id
+def checkpoint_task(source, i, rows, stages, keys, path, name, grid):
+    chunk = source.chunk(i)
+    if rows is not None:
+        chunk = mask_chunk(chunk, rows)
+    design = chunk['index']
+    chunk = apply_stages(chunk, stages)
+    n = len(design)
+    columns = {key: np.ascontiguousarray(np.broadcast_to(chunk[key], n), dtype=np.float64) for key in keys}
+    temporary = os.path.join(path, 'chunks', name + '.tmp.npz')
+    np.savez(temporary, design=design, grid=np.array(grid), **columns)
+    os.replace(temporary, os.path.join(path, 'chunks', name + '.npz')) #a chunk file is complete or absent
+    return n
+
+
+def checkpoint_files(path):
+    folder = os.path.join(str(path), 'chunks')
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                  if name.endswith('.npz') and not name.endswith('.tmp.npz'))
+
+
+def checkpoint_header(path):
+    with open(os.path.join(str(path), CHECKPOINT_HEADER)) as f:
+        return json.load(f)
+
+
+#Checkpoint files holding rows of each chunk of source, read one file at a time
+def checkpoint_index(path, source, grids):
+    files = {}
+    for name in checkpoint_files(path):
+        with np.load(name) as data:
+            index = regrid(grids[str(data['grid'])], data['design'], source)
+        for i in np.unique(index[index >= 0]//source.chunksize):
+            files.setdefault(int(i), []).append(name)
+    return files
+
+
+#Results of chunk i of source from the checkpoint files holding its rows, and which rows have one
+def chunk_results(source, i, files, keys, grids):
+    start = i*source.chunksize
+    n = min(source.chunksize, source.size-start)
+    found = np.zeros(n, dtype=bool)
+    columns = {key: np.full(n, np.nan) for key in keys}
+    for name in files:
+        with np.load(name) as data:
+            index = regrid(grids[str(data['grid'])], data['design'], source)
+            rows = np.nonzero((index >= start) & (index < start+n))[0]
+            found[index[rows]-start] = True
+            for key in keys:
+                columns[key][index[rows]-start] = data[key][rows]
+    return found, columns
+
+
+#Run a GridSource sweep with checkpoints at path, skipping what earlier runs there computed.
+#Returns the number of chunks skipped and computed and of points computed.
+def run_checkpoint(source, stages, path, keys, workers=1, inflight=2):
+    os.makedirs(os.path.join(str(path), 'chunks'), exist_ok=True)
+    identity = sweep_identity(source, stages, keys)
+    grid = grid_identity(source)
+    if os.path.exists(os.path.join(str(path), CHECKPOINT_HEADER)):
+        header = checkpoint_header(path)
+        if header['identity'] != identity:
+            raise ValueError('Checkpoint at ' + str(path) + ' holds another sweep.')
+    else:
+        header = {"identity": identity, "keys": list(keys), "grids": {}}
+    if grid not in header['grids']: #the grids of every run, to place their rows later
+        header['grids'][grid] = {"keys": list(source.keys), "values": [values.tolist() for values in source.values]}
+        temporary = os.path.join(str(path), CHECKPOINT_HEADER) + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(header, f)
+        os.replace(temporary, os.path.join(str(path), CHECKPOINT_HEADER))
+    names = set(os.path.basename(name)[:-4] for name in checkpoint_files(path))
+    saved = None
+    stats = {"skipped": 0, "chunks": 0, "points": 0}
+
+    def tasks():
+        nonlocal saved
+        for i in range(source.nchunks):
+            chunk = source.chunk(i)
+            points = point_hashes(source, chunk)
+            name = chunk_id(points)
+            if name in names:
+                stats['skipped'] += 1
+                continue
+            if saved is None: #only needed once the grid has changed
+                saved = checkpoint_index(path, source, header['grids'])
+            rows = np.nonzero(~chunk_results(source, i, saved.get(i, []), [], header['grids'])[0])[0]
+            if len(rows) == 0:
+                stats['skipped'] += 1
+                continue
+            stats['chunks'] += 1
+            yield (source, i, None if len(rows) == len(points) else rows, stages, keys, str(path), name, grid)
+
+    if workers <= 1:
+        for task in tasks():
+            stats['points'] += checkpoint_task(*task)
+        return stats
+    from concurrent.futures import ProcessPoolExecutor
+    from collections import deque
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for task in tasks():
+            pending.append(pool.submit(checkpoint_task, *task))
+            if len(pending) >= inflight*workers:
+                stats['points'] += pending.popleft().result()
+        while pending:
+            stats['points'] += pending.popleft().result()
+    return stats
+
+
+#Results of a checkpointed sweep in the order of the grid, as chunks (index and keys) for sinks.
+#Each chunk reads only the checkpoint files holding its rows.
+def checkpoint_chunks(path, source, keys=None):
+    header = checkpoint_header(path)
+    if keys is None:
+        keys = header['keys']
+    files = checkpoint_index(path, source, header['grids'])
+    for i in range(source.nchunks):
+        found, result = chunk_results(source, i, files.get(i, []), keys, header['grids'])
+        if not np.all(found):
+            raise ValueError('Checkpoint at ' + str(path) + ' misses points of the sweep.')
+        yield dict(index=np.arange(i*source.chunksize, i*source.chunksize+len(found), dtype=np.int64), **result)
+
+
+#Results of a checkpointed sweep in a result store (fn_store) at store_path
+def checkpoint_store(path, source, store_path, keys=None):
+    if keys is None:
+        keys = checkpoint_header(path)['keys']
+    store = create_store(store_path, keys, source.size, source.chunksize,
+                         {"grid": {key: values.tolist() for key, values in zip(source.keys, source.values)}})
+    sink = StoreSink(store)
+    for chunk in checkpoint_chunks(path, source, keys):
+        sink.consume(chunk)
+    return store
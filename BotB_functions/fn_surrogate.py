@@ -0,0 +1,240 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.pyplot import figure
+import pandas as pd
+import pickle
+from pint import UnitRegistry
+import os
+from dotmap import DotMap
+import sys
+
+from BotB_functions.fn_batch import *
+from BotB_functions.fn_sampling import sample_bounds, scale_samples, sample_seed, SAMPLE_UNITS
+
+
+# SURROGATE MODELS
+# A polynomial chaos expansion of kernel results over the bounds of some inputs: Legendre polynomials
+# (orthogonal for uniform inputs) of total degree up to `degree`, fitted by least squares to Sobol samples
+# of the batch kernel. A second, independent Latin hypercube sample validates the fit; the error bound of
+# an output is the `coverage` quantile of its absolute validation error.
+#   model = fit_surrogate('cylindrical', reference_inputs('cylindrical'),
+#                         {'diameter': (1.8, 4.6), 'height': (6, 14), 'pos_arealcap': (2, 6)})
+#   model.predict({'diameter': 2.1, 'height': 7, 'pos_arealcap': 4.5})['gravimetric_energy']
+#   model.report()
+#   model.save('cylindrical.npz'); model = load_surrogate('cylindrical.npz')
+# Predictions outside the bounds are extrapolations: model.inside(inputs) tells.
+SURROGATE_OUTPUTS = ['gravimetric_energy', 'volumetric_energy']
+
+
+#Exponents of every term of total degree up to degree in d inputs, constant term first
+def total_degree(d, degree):
+    terms = [()]
+    for j in range(d): #extend by one input at a time, keeping only terms within the degree
+        terms = [term + (e,) for term in terms for e in range(degree+1-sum(term))]
+    return np.array(sorted(terms, key=lambda exponents: (sum(exponents), [-e for e in exponents])), dtype=np.int64)
+
+
+#Legendre polynomials 0..degree at z in [-1, 1], shape z.shape + (degree+1,)
+def legendre(z, degree):
+    values = np.empty(np.shape(z) + (degree+1,))
+    values[..., 0] = 1
+    if degree > 0:
+        values[..., 1] = z
+    for k in range(1, degree):
+        values[..., k+1] = ((2*k+1)*z*values[..., k] - k*values[..., k-1])/(k+1)
+    return values
+
+
+#Power series coefficients of the Legendre polynomials 0..degree, A[k, m] of z**m in P_k
+def legendre_powers(degree):
+    A = np.zeros((degree+1, degree+1))
+    for k in range(degree+1):
+        A[k, :k+1] = np.polynomial.legendre.leg2poly(np.eye(degree+1)[k][:k+1])
+    return A
+
+
+#Coefficients of the same polynomial on monomials of z (terms of exponents), from Legendre coefficients
+def monomial_coefficients(exponents, coefficients):
+    A = legendre_powers(int(exponents.max()) if len(exponents) else 0)
+    position = {tuple(term): i for i, term in enumerate(exponents.tolist())}
+    monomial = np.zeros_like(coefficients)
+    for t, term in enumerate(exponents.tolist()):
+        expansion = {(): 1.0}
+        for e in term: #product over inputs of sum over m of A[e, m] z**m
+            expansion = {powers + (m,): value*A[e, m] for powers, value in expansion.items()
+                         for m in range(e+1) if A[e, m] != 0}
+        for powers, value in expansion.items():
+            monomial[position[powers]] += value*coefficients[t]
+    return monomial
+
+
+class Surrogate:
+    def __init__(self, format, bounds, exponents, coefficients, errors, coverage=0.999):
+        self.format = format
+        self.bounds = bounds #key: (low, high, scale) in kernel units
+        self.exponents = exponents
+        self.coefficients = coefficients #output: coefficient of each term
+        self.errors = errors #output: validation statistics
+        self.coverage = coverage
+        self.keys = list(bounds)
+        self.degree = int(exponents.max()) if len(exponents) else 0
+        self.low = np.array([self.transform(key, bounds[key][0]) for key in self.keys])
+        self.high = np.array([self.transform(key, bounds[key][1]) for key in self.keys])
+        self.matrix = np.stack([coefficients[output] for output in coefficients], axis=1)
+        self.monomial = monomial_coefficients(exponents, self.matrix) #same polynomial, fewer numpy calls
+        self.powers = np.arange(self.degree+1)
+        self.gather = np.arange(len(self.keys))*(self.degree+1) + exponents #z**e of each input of each term
+        self.logs = np.array([bounds[key][2] == 'log' for key in self.keys], dtype=bool)
+
+    @property
+    def outputs(self):
+        return list(self.coefficients)
+
+    def transform(self, key, value):
+        return np.log(value) if self.bounds[key][2] == 'log' else np.asarray(value, dtype=float)
+
+    #Inputs (dict of arrays or DataFrame, kernel units) to the [-1, 1] cube, shape (n, d)
+    def scaled(self, inputs):
+        missing = [key for key in self.keys if key not in inputs]
+        if missing:
+            raise ValueError('Unspecified surrogate inputs: ' + ', '.join(missing))
+        values = [inputs[key] for key in self.keys]
+        try:
+            x = np.array(values, dtype=float)
+        except ValueError: #scalars mixed with arrays
+            x = np.array(np.broadcast_arrays(*values), dtype=float)
+        x = x.reshape(len(self.keys), -1)
+        if self.logs.any():
+            x[self.logs] = np.log(x[self.logs])
+        return 2*(x.T - self.low)/(self.high - self.low) - 1
+
+    #Legendre terms at scaled inputs (fitting)
+    def basis(self, z):
+        values = legendre(z, self.degree)
+        basis = np.ones((len(z), len(self.exponents)))
+        for j in range(len(self.keys)):
+            basis *= values[:, j, self.exponents[:, j]]
+        return basis
+
+    #Outputs at scaled inputs from the monomial terms (predictions)
+    def evaluate(self, z):
+        powers = (z[:, :, None]**self.powers).reshape(len(z), -1)
+        basis = powers[:, self.gather[:, 0]]
+        for j in range(1, len(self.keys)):
+            basis *= powers[:, self.gather[:, j]]
+        return basis @ self.monomial
+
+    #Outputs at the inputs, in kernel units; with bound=True also the error bound of each output.
+    #Rows go 256 at a time so the terms of a block stay in cache.
+    def predict(self, inputs, bound=False):
+        z = self.scaled(inputs)
+        if len(z) <= 256:
+            values = self.evaluate(z)
+        else:
+            values = np.empty((len(z), self.monomial.shape[1]))
+            for start in range(0, len(z), 256):
+                values[start:start+256] = self.evaluate(z[start:start+256])
+        single = len(z) == 1 and all(np.ndim(inputs[key]) == 0 for key in self.keys)
+        predicted = {output: values[0, i] if single else values[:, i] for i, output in enumerate(self.outputs)}
+        if bound:
+            return predicted, {output: self.errors[output]['bound'] for output in self.outputs}
+        return predicted
+
+    def inside(self, inputs):
+        z = self.scaled(inputs)
+        return np.all(np.abs(z) <= 1+1e-12, axis=1)
+
+    #Mean and standard deviation of the outputs with normally distributed inputs (std in kernel units),
+    #nsamples draws per design through the surrogate
+    def propagate(self, inputs, std, nsamples=1000, seed=None):
+        rng = np.random.default_rng(seed)
+        n = max([np.size(inputs[key]) for key in self.keys])
+        draws = {}
+        for key in self.keys:
+            value = np.broadcast_to(np.asarray(inputs[key], dtype=float), n)
+            noise = rng.standard_normal((nsamples, n))*np.broadcast_to(np.asarray(std.get(key, 0.0), dtype=float), n)
+            draws[key] = (value + noise).ravel()
+        values = self.predict(draws)
+        return {output: {"nominal": values[output].reshape(nsamples, n).mean(axis=0),
+                         "std": values[output].reshape(nsamples, n).std(axis=0)} for output in self.outputs}
+
+    #Validation against the exact kernel: errors in kernel units, largest relative error and r2
+    def report(self):
+        report = pd.DataFrame(self.errors).T
+        report.index.name = 'output'
+        report.insert(0, 'unit', [kernel_unit(output) for output in report.index])
+        return report
+
+    def save(self, path):
+        np.savez(path,
+                 format=np.array(self.format),
+                 keys=np.array(self.keys),
+                 low=np.array([self.bounds[key][0] for key in self.keys]),
+                 high=np.array([self.bounds[key][1] for key in self.keys]),
+                 scale=np.array([self.bounds[key][2] for key in self.keys]),
+                 exponents=self.exponents,
+                 outputs=np.array(self.outputs),
+                 coefficients=self.matrix,
+                 statistics=np.array(list(next(iter(self.errors.values())))),
+                 errors=np.array([[self.errors[output][name] for name in next(iter(self.errors.values()))]
+                                  for output in self.outputs]),
+                 coverage=np.array(self.coverage))
+        return path
+
+
+def load_surrogate(path):
+    with np.load(path, allow_pickle=False) as data:
+        keys = [str(key) for key in data['keys']]
+        bounds = {key: (float(low), float(high), str(scale))
+                  for key, low, high, scale in zip(keys, data['low'], data['high'], data['scale'])}
+        outputs = [str(output) for output in data['outputs']]
+        statistics = [str(name) for name in data['statistics']]
+        coefficients = {output: data['coefficients'][:, i] for i, output in enumerate(outputs)}
+        errors = {output: dict(zip(statistics, [float(value) for value in data['errors'][i]]))
+                  for i, output in enumerate(outputs)}
+        return Surrogate(str(data['format']), bounds, data['exponents'], coefficients, errors, float(data['coverage']))
+
+
+#Validation statistics of predictions against exact values
+def surrogate_errors(predicted, exact, coverage):
+    error = predicted - exact
+    spread = np.std(exact)
+    return {"rmse": float(np.sqrt(np.mean(error**2))),
+            "mae": float(np.mean(np.abs(error))),
+            "max_error": float(np.max(np.abs(error))),
+            "bound": float(np.quantile(np.abs(error), coverage)),
+            "max_relative": float(np.max(np.abs(error)/np.maximum(np.abs(exact), 1e-300))),
+            "r2": float(1 - np.mean(error**2)/spread**2) if spread > 0 else 1.0}
+
+
+#Fit a surrogate of the outputs of a format over bounds (kernel units, as in fn_sampling) around base
+#kernel inputs: nsamples Sobol designs to fit, nvalidate Latin hypercube designs to validate
+def fit_surrogate(format, base, bounds, outputs=SURROGATE_OUTPUTS, degree=4, nsamples=2**14, nvalidate=2**14,
+                  seed=0, coverage=0.999):
+    bounds = sample_bounds(bounds)
+    seed = sample_seed(seed) #one seed for the fit and validation samples
+    d = len(bounds)
+    exponents = total_degree(d, degree)
+    if len(exponents) > nsamples:
+        raise ValueError('Surrogate needs more samples than its ' + str(len(exponents)) + ' terms.')
+
+    def evaluate(method, n, seed):
+        inputs = scale_samples(SAMPLE_UNITS[method](n, d, seed), bounds)
+        p = dict(base)
+        p.update(inputs)
+        out = batch_cell(format, p)
+        return inputs, {output: np.broadcast_to(out[output], n) for output in outputs}
+
+    fit_inputs, fit_out = evaluate('sobol', nsamples, seed)
+    model = Surrogate(format, bounds, exponents, {output: np.zeros(len(exponents)) for output in outputs}, {},
+                      coverage)
+    basis = model.basis(model.scaled(fit_inputs))
+    targets = np.stack([fit_out[output] for output in outputs], axis=1)
+    solution = np.linalg.lstsq(basis, targets, rcond=None)[0]
+    coefficients = {output: solution[:, i] for i, output in enumerate(outputs)}
+
+    check_inputs, check_out = evaluate('lhs', nvalidate, seed) #other sampler streams than the Sobol fit
+    model = Surrogate(format, bounds, exponents, coefficients, {}, coverage)
+    predicted = model.predict(check_inputs)
+    model.errors = {output: surrogate_errors(predicted[output], check_out[output], coverage) for output in outputs}
+    return model
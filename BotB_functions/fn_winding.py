@@ -0,0 +1,238 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.pyplot import figure
+import pandas as pd
+import pickle
+from pint import UnitRegistry
+import os
+from dotmap import DotMap
+import sys
+
+from BotB_functions.fn_cellformat import *
+from BotB_functions.fn_batch import *
+
+
+# DISCRETE WINDING OF A CYLINDRICAL JELLY ROLL
+# make_cylindrical treats the jelly roll as one continuous spiral of the averaged stack. Here the roll
+# is wound turn by turn: separator-only wraps around the mandrel, then turns of
+# separator | negative | separator | positive, then separator-only wraps at the outside.
+# The negative is longer than the positive (overhang at both ends) and wider (overhang on both
+# edges), each foil has an uncoated length for the tabs, and capacity comes from the area where
+# the positive actually faces the negative.
+WINDING_DEFAULTS = {
+    "innerwraps": 1, #separator-only turns around the mandrel
+    "outerwraps": 1, #separator-only turns around the outside of the roll
+    "overhanginner": 0.5, #negative length beyond the positive at the start of the winding (cm)
+    "overhangouter": 0.5, #negative length beyond the positive at the end of the winding (cm)
+    "overhangwidth": 0.1, #negative width beyond the positive on each edge (cm)
+    "posuncoated": 1.0, #uncoated positive foil length for the tab (cm)
+    "neguncoated": 1.0, #uncoated negative foil length for the tab (cm)
+}
+
+WINDING_UNITS = {
+    "innerwraps": 'dimensionless',
+    "outerwraps": 'dimensionless',
+    "overhanginner": 'cm',
+    "overhangouter": 'cm',
+    "overhangwidth": 'cm',
+    "posuncoated": 'cm',
+    "neguncoated": 'cm',
+    "turns": 'dimensionless',
+    "rolldiam": 'cm',
+    "length_positive": 'cm',
+    "length_negative": 'cm',
+    "length_separator": 'cm',
+    "foil_positive": 'cm**2',
+    "foil_negative": 'cm**2',
+    "area_overlap": 'cm**2',
+    "area_overhang": 'cm**2',
+}
+
+
+def winding_unit(key):
+    if key in WINDING_UNITS:
+        return WINDING_UNITS[key]
+    return kernel_unit(key)
+
+
+#Radii of one turn: mandrel + inner wraps, stack layer mid-radii and the number of electrode turns
+def winding_radii(p):
+    w = dict(WINDING_DEFAULTS)
+    w.update({key: p[key] for key in WINDING_DEFAULTS if key in p})
+    posthick, posdens = batch_composite(p, 'pos')
+    negthick, negdens = batch_composite(p, 'neg')
+    septhick = p['sep_thick']
+    pos_t = 2*posthick + p['pos_ccthick'] #double coated
+    neg_t = 2*(negthick+batch_growth(p)) + p['neg_ccthick'] #at full charge
+    stackthick = pos_t + neg_t + 2*septhick
+
+    r_start = p['mandreldiam']/2 + 2*septhick*w['innerwraps'] #two separator sheets per wrap
+    r_can = (p['diameter']-2*p['canthick'])/2
+    turns = np.maximum((r_can - 2*septhick*w['outerwraps'] - r_start)/stackthick, 0) #no turns fit a can too small
+    radii = {
+        "stackthick": stackthick,
+        "start": r_start,
+        "sep1": r_start + septhick/2,
+        "neg": r_start + septhick + neg_t/2,
+        "sep2": r_start + 1.5*septhick + neg_t,
+        "pos": r_start + 2*septhick + neg_t + pos_t/2,
+        "turns": turns,
+    }
+    return radii, w
+
+
+#Length of a layer at mid-radius a wound for n turns (whole turns plus the fraction of the last one)
+def layer_length(a, stackthick, turns):
+    whole = np.floor(turns)
+    frac = turns - whole
+    return 2*np.pi*(whole*a + stackthick*whole*(whole-1)/2 + frac*(a + whole*stackthick))
+
+
+#Turns wound when the layer at mid-radius a reaches length (inverse of layer_length)
+def layer_turns(a, stackthick, length):
+    c = length/(2*np.pi)
+    b = a - stackthick/2
+    whole = np.floor(np.maximum((np.sqrt(b**2 + 2*stackthick*c) - b)/stackthick, 0))
+    frac = (c - whole*a - stackthick*whole*(whole-1)/2)/(a + whole*stackthick)
+    while np.any(frac >= 1): #rounding at whole turns
+        whole = np.where(frac >= 1, whole+1, whole)
+        frac = (c - whole*a - stackthick*whole*(whole-1)/2)/(a + whole*stackthick)
+    return whole + np.clip(frac, 0, 1)
+
+
+#Turns where the positive starts and ends: it lies on the negative, overhanginner along the negative
+#from its start and overhangouter before its end, so the negative is longer by both overhangs
+def positive_span(radii, w):
+    length_neg = layer_length(radii['neg'], radii['stackthick'], radii['turns'])
+    posstart = layer_turns(radii['neg'], radii['stackthick'], np.minimum(w['overhanginner'], length_neg))
+    posend = layer_turns(radii['neg'], radii['stackthick'],
+                         np.clip(length_neg - w['overhangouter'], w['overhanginner'], length_neg))
+    return np.minimum(posstart, posend), posend, length_neg
+
+
+# TURN BY TURN TABLE OF ONE CELL
+def wind_turns(p):
+    radii, w = winding_radii(p)
+    stackthick = radii['stackthick']
+    nturns = int(np.ceil(radii['turns']))
+    k = np.arange(nturns)
+    frac = np.minimum(1, radii['turns']-k) #last turn is partial
+    posstart, posend, length_neg = positive_span(radii, w)
+    posfrac = np.clip(np.minimum(k+1, posend) - np.maximum(k, posstart), 0, 1) #turn fraction with positive
+    table = pd.DataFrame({'turn': k+1, 'fraction': frac, 'fraction_pos': posfrac})
+    table['radius'] = radii['start'] + (k+frac)*stackthick #outer radius after the turn
+    for layer in ['neg', 'sep1', 'sep2']:
+        circumference = 2*np.pi*(radii[layer] + k*stackthick)
+        table['length_'+layer] = np.cumsum(frac*circumference)
+    table['length_pos'] = np.cumsum(posfrac*2*np.pi*(radii['neg'] + k*stackthick)) #along the negative
+    return table[['turn', 'fraction', 'fraction_pos', 'radius', 'length_neg', 'length_pos', 'length_sep1',
+                  'length_sep2']]
+
+
+# VECTORIZED WINDING (closed form of the turn by turn sums)
+def batch_winding(p):
+    radii, w = winding_radii(p)
+    stackthick = radii['stackthick']
+    turns = radii['turns']
+    septhick = p['sep_thick']
+    posthick, posdens = batch_composite(p, 'pos')
+    negthick, negdens = batch_composite(p, 'neg')
+    poscoat = batch_coatdens(p, 'pos', posdens)
+    negcoat = batch_coatdens(p, 'neg', negdens)
+
+    #Electrode and separator lengths. The positive starts and ends inside the negative, shorter by the overhangs
+    posstart, posend, length_neg = positive_span(radii, w)
+    length_pos = np.maximum(length_neg - w['overhanginner'] - w['overhangouter'], 0)
+    r_mandrel = p['mandreldiam']/2
+    r_roll = radii['start'] + turns*stackthick
+    innerwrap = 2*np.pi*w['innerwraps']*(r_mandrel + w['innerwraps']*septhick) #per separator sheet
+    outerwrap = 2*np.pi*w['outerwraps']*(r_roll + w['outerwraps']*septhick)
+    length_sep = layer_length(radii['sep1'], stackthick, turns) + layer_length(radii['sep2'], stackthick, turns) \
+                    + 2*innerwrap + 2*outerwrap
+
+    #Widths: the negative is coated over the full jelly roll height, the positive is narrower
+    width_neg = p['height']-p['headspace']-2*p['canthick']
+    width_pos = width_neg - 2*w['overhangwidth']
+
+    #The outer face of the positive needs negative one turn further out, so the positive wound after
+    #the start of the last negative turn faces negative on its inner side only
+    lastturn = np.maximum(turns-1, posstart)
+    unpaired = np.clip(layer_length(radii['neg'], stackthick, posend)
+                       - layer_length(radii['neg'], stackthick, lastturn), 0, length_pos)
+    area_overlap = width_pos*np.maximum(2*length_pos - unpaired, 0)
+    area_neg = 2*length_neg*width_neg
+    area_pos = 2*length_pos*width_pos
+
+    capacity = np.minimum(p['pos_arealcap'],batch_hostcap(p))*p['llifactor']*area_overlap/1000 #mAh -> Ah
+    avgE = batch_avgE(p)
+    energy = capacity*avgE
+    porevolume = area_pos*posthick*p['pos_porosity'] + area_neg*negthick*p['neg_porosity'] \
+                    + length_sep*width_neg*septhick*p['sep_porosity']
+    elytevolume = batch_elytevolume(p, capacity, porevolume)
+    elytemass = elytevolume*p['elyte_density']
+    posmass = area_pos*posthick*poscoat
+    posccmass = (length_pos + w['posuncoated'])*width_pos*p['pos_ccthick']*p['pos_ccdens']
+    negmass = area_neg*negthick*negcoat
+    negccmass = (length_neg + w['neguncoated'])*width_neg*p['neg_ccthick']*p['neg_ccdens']
+    sepmass = length_sep*width_neg*septhick*p['sep_density']
+    jellymass = posmass + posccmass + negmass + negccmass + sepmass + elytemass
+    casemass = cylindrical_case(p) + p['extramass']
+
+    out = {
+        "turns": turns,
+        "rolldiam": 2*(r_roll + 2*septhick*w['outerwraps']),
+        "length_positive": length_pos,
+        "length_negative": length_neg,
+        "length_separator": length_sep,
+        "foil_positive": w['posuncoated']*width_pos, #uncoated foil areas
+        "foil_negative": w['neguncoated']*width_neg,
+        "area_overlap": area_overlap,
+        "area_overhang": area_neg - area_overlap, #negative not facing positive
+        "jlarea": area_overlap/2,
+        "capacity": capacity,
+        "energy": energy,
+        "NPratio": p['neg_arealcap']/p['pos_arealcap'],
+        "avgE": avgE,
+        "elytevolume": elytevolume,
+        "stackthick": stackthick,
+        "volume": cylindrical_volume(p, stackthick),
+        "mass_total": casemass + jellymass,
+        "mass_jellyroll": jellymass,
+        "mass_case": casemass,
+        "mass_electrolyte": elytemass,
+        "mass_positive": posmass,
+        "mass_positivecc": posccmass,
+        "mass_negative": negmass,
+        "mass_negativecc": negccmass,
+        "mass_separator": sepmass,
+    }
+    return batch_energydensity(out)
+
+
+# WIND A BUILT CYLINDRICAL CELL
+#Winding options are pint quantities (or numbers for wrap counts), e.g. overhanginner=5*unit.mm
+def wind_cylindrical(cell, **kwargs):
+    unit = cell.unit
+    if cell.format != 'cylindrical':
+        raise ValueError('Winding needs a cylindrical cell.')
+    p = cell_inputs(cell)
+    for key, value in kwargs.items():
+        if key not in WINDING_DEFAULTS:
+            raise ValueError('Unknown winding property: ' + str(key))
+        try:
+            value = value.to(unit(WINDING_UNITS[key]))
+        except AttributeError: #plain number
+            p[key] = float(value)
+            continue
+        p[key] = float(get_nominal(value))
+    out = batch_winding(p)
+
+    winding = DotMap()
+    for key, value in out.items():
+        quantity = float(value)*unit(winding_unit(key))
+        if key.startswith('mass_'):
+            winding.mass[key[5:]] = quantity
+        else:
+            winding[key] = quantity
+    winding.turntable = wind_turns(p)
+    return winding
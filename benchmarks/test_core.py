@@ -0,0 +1,24 @@
+import pytest
+from pint import UnitRegistry
+
+pytest.importorskip('pytest_benchmark')
+
+from BotB_functions.fn_benchmark import benchmark_cases, case_cells
+
+
+# pytest-benchmark suite of the calculation core (cases from fn_benchmark.benchmark_cases)
+#   python -m pytest benchmarks --benchmark-autosave                      #save a run to .benchmarks
+#   python -m pytest benchmarks --benchmark-compare --benchmark-compare-fail=median:20%
+# Throughput cases evaluate extra_info['cells'] cells per call.
+CASES = benchmark_cases(UnitRegistry())
+
+
+@pytest.mark.parametrize('name', list(CASES))
+def test_core(benchmark, name):
+    cells = case_cells(name)
+    benchmark.group = 'throughput' if cells > 1 else 'latency'
+    benchmark.extra_info['cells'] = cells
+    if cells > 1 and not name.startswith('batch_cell'): #cell by cell builds take seconds per call
+        benchmark.pedantic(CASES[name], rounds=3, iterations=1)
+    else:
+        benchmark(CASES[name])